@@ -0,0 +1,293 @@
+import threading
+import time
+from http import HTTPStatus
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts import cache_versions as versions
+from posts import live
+from posts.models import Comment, Follow, Group, Post
+from posts.paginator import COMMENTS_PER_PAGE
+
+from .views import NEW_POSTS_LIMIT
+
+User = get_user_model()
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        cls.posts = [
+            Post.objects.create(
+                author=cls.author,
+                text=f'Пост {number}',
+                group=cls.group if number % 2 else None,
+            )
+            for number in range(12)
+        ]
+        cls.comment = Comment.objects.create(
+            post=cls.posts[0], author=cls.reader, text='Комментарий'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_index_pages(self):
+        """Лента постранично отдает все посты, новые сверху"""
+        response = self.client.get(reverse('api:index'))
+        data = response.json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertIsNone(data['previous'])
+        second = self.client.get(
+            reverse('api:index'), {'cursor': data['next']}
+        ).json()
+        ids = [post['id'] for post in data['results'] + second['results']]
+        self.assertEqual(ids, [post.pk for post in self.posts[::-1]])
+        self.assertIsNone(second['next'])
+        self.assertEqual(data['results'][0], {
+            'id': self.posts[-1].pk,
+            'text': 'Пост 11',
+            'pub_date': data['results'][0]['pub_date'],
+            'author': 'author',
+            'group': 'group',
+            'image': None,
+            'comments_count': 0,
+        })
+
+    def test_sparse_fields(self):
+        """fields оставляет только запрошенные поля"""
+        data = self.client.get(
+            reverse('api:index'), {'fields': 'text,id'}
+        ).json()
+        self.assertEqual(
+            data['results'][0], {'text': 'Пост 11', 'id': self.posts[-1].pk}
+        )
+        response = self.client.get(reverse('api:index'), {'fields': 'secret'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_group_and_profile(self):
+        """Лента группы и профиль автора"""
+        group = self.client.get(
+            reverse('api:group_posts', args=[self.group.slug]),
+            {'fields': 'id'},
+        ).json()
+        self.assertEqual(
+            [post['id'] for post in group['results']],
+            [post.pk for post in self.posts[::-1] if post.group_id][:10]
+        )
+        profile = self.client.get(
+            reverse('api:profile', args=[self.reader.username])
+        ).json()
+        self.assertEqual(profile['results'], [])
+        response = self.client.get(reverse('api:profile', args=['nobody']))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_post_detail(self):
+        """Пост отдается с комментариями"""
+        post = self.posts[0]
+        data = self.client.get(
+            reverse('api:post_detail', args=[post.pk])
+        ).json()
+        self.assertEqual(data['comments_count'], 1)
+        self.assertEqual(data['comments'], [{
+            'id': self.comment.pk,
+            'author': 'reader',
+            'text': 'Комментарий',
+            'created': data['comments'][0]['created'],
+        }])
+        self.assertIsNone(data['comments_next'])
+        response = self.client.get(reverse('api:post_detail', args=[0]))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_post_comments_pages(self):
+        """Комментарии листаются курсором"""
+        post = self.posts[1]
+        for number in range(COMMENTS_PER_PAGE + 1):
+            Comment.objects.create(
+                post=post, author=self.reader, text=f'Ком {number}'
+            )
+        data = self.client.get(
+            reverse('api:post_detail', args=[post.pk])
+        ).json()
+        self.assertEqual(len(data['comments']), COMMENTS_PER_PAGE)
+        rest = self.client.get(
+            reverse('api:post_comments', args=[post.pk]),
+            {'cursor': data['comments_next']},
+        ).json()
+        self.assertEqual(
+            [comment['text'] for comment in rest['results']], ['Ком 0']
+        )
+        self.assertIsNone(rest['next'])
+
+    def test_follow_index(self):
+        """Лента подписок только для авторизованных"""
+        response = self.client.get(reverse('api:follow_index'))
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        Follow.objects.create(user=self.reader, author=self.author)
+        data = self.reader_client.get(
+            reverse('api:follow_index'), {'fields': 'id,author'}
+        ).json()
+        self.assertEqual(data['results'][0], {
+            'id': self.posts[-1].pk, 'author': 'author'
+        })
+        self.assertIsNotNone(data['next'])
+
+    def test_etag(self):
+        """Повторный запрос с ETag получает 304 до нового поста"""
+        url = reverse('api:index')
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        Post.objects.create(author=self.author, text='Новый')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_etag_changes_with_author_and_group(self):
+        """Переименование автора и правка группы меняют ETag поста
+        и профиля"""
+        post = self.posts[1]
+        urls = (
+            reverse('api:post_detail', args=[post.pk]),
+            reverse('api:post_comments', args=[post.pk]),
+            reverse('api:profile', args=['author']),
+        )
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        group = Group.objects.get(pk=self.group.pk)
+        group.slug = 'renamed'
+        group.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                etags[url] = response['ETag']
+        author = User.objects.get(pk=self.author.pk)
+        author.username = 'renamed'
+        author.save()
+        for url in urls[:2]:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_read_only(self):
+        """API принимает только чтение"""
+        response = self.client.post(reverse('api:index'))
+        self.assertEqual(
+            response.status_code, HTTPStatus.METHOD_NOT_ALLOWED
+        )
+
+
+class NewPostsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        cls.old = Post.objects.create(author=cls.author, text='Старый')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_new_posts_since(self):
+        """Отдаются только посты новее since, новые сверху"""
+        first = Post.objects.create(author=self.author, text='Первый')
+        second = Post.objects.create(
+            author=self.author, text='Второй', group=self.group
+        )
+        url = reverse('api:new_posts')
+        data = self.client.get(url, {'since': self.old.pk}).json()
+        self.assertEqual(data['count'], 2)
+        self.assertFalse(data['more'])
+        self.assertEqual(
+            [post['id'] for post in data['results']], [second.pk, first.pk]
+        )
+        group = self.client.get(
+            reverse('api:group_new_posts', args=[self.group.slug]),
+            {'since': self.old.pk, 'count': 1},
+        ).json()
+        self.assertEqual(group, {'count': 1})
+        for since in (None, str(2 ** 63), '²'):
+            with self.subTest(since=since):
+                response = self.client.get(
+                    url, {} if since is None else {'since': since}
+                )
+                self.assertEqual(
+                    response.status_code, HTTPStatus.BAD_REQUEST
+                )
+
+    def test_new_posts_more_than_limit(self):
+        """Больше NEW_POSTS_LIMIT новых постов отдаются по частям без
+        пропусков"""
+        posts = [
+            Post.objects.create(author=self.author, text=f'Пост {number}')
+            for number in range(NEW_POSTS_LIMIT + 5)
+        ]
+        url = reverse('api:new_posts')
+        first = self.client.get(
+            url, {'since': self.old.pk, 'fields': 'id'}
+        ).json()
+        self.assertEqual(first['count'], NEW_POSTS_LIMIT)
+        self.assertTrue(first['more'])
+        rest = self.client.get(
+            url, {'since': first['results'][0]['id'], 'fields': 'id'}
+        ).json()
+        self.assertFalse(rest['more'])
+        ids = [post['id'] for post in rest['results'] + first['results']]
+        self.assertEqual(ids, [post.pk for post in posts[::-1]])
+
+    def test_follow_new_posts(self):
+        """Новые посты ленты подписок"""
+        url = reverse('api:follow_new_posts')
+        self.assertEqual(
+            self.client.get(url, {'since': 0}).status_code,
+            HTTPStatus.UNAUTHORIZED
+        )
+        Follow.objects.create(user=self.reader, author=self.author)
+        data = self.reader_client.get(
+            url, {'since': 0, 'fields': 'id'}
+        ).json()
+        self.assertEqual(data['results'], [{'id': self.old.pk}])
+
+    @override_settings(LIVE_MAX_WAIT=0.2)
+    def test_wait_is_bounded(self):
+        """Без новых постов ожидание не длиннее LIVE_MAX_WAIT"""
+        started = time.monotonic()
+        data = self.client.get(
+            reverse('api:profile_new_posts', args=[self.author.username]),
+            {'since': self.old.pk, 'wait': 60},
+        ).json()
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(data['count'], 0)
+
+    def test_wait_wakes_on_new_post(self):
+        """Ожидание заканчивается, как только меняется версия ленты"""
+        scopes = [(versions.AUTHOR, self.author.pk)]
+        seen = versions.get_versions(*scopes)
+
+        def publish():
+            time.sleep(0.1)
+            versions.bump(versions.AUTHOR, self.author.pk)
+            live.notify()
+
+        thread = threading.Thread(target=publish)
+        thread.start()
+        started = time.monotonic()
+        changed = live.wait_for_change(scopes, seen, timeout=5)
+        thread.join()
+        self.assertIsNotNone(changed)
+        self.assertLess(time.monotonic() - started, live.POLL_INTERVAL)
@@ -0,0 +1,36 @@
+from django.urls import path
+from . import views
+
+app_name = 'api'
+
+# Те же адреса, что у HTML-страниц posts
+urlpatterns = [
+    path('', views.index, name='index'),
+    path('group/<slug:slug>/', views.group_posts, name='group_posts'),
+    path('profile/<str:username>/', views.profile, name='profile'),
+    path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
+    path(
+        'posts/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'
+    ),
+    path('follow/', views.follow_index, name='follow_index'),
+    # Только посты новее since, с ожиданием новых
+    path('new/', views.new_posts, name='new_posts'),
+    path(
+        'group/<slug:slug>/new/',
+        views.new_posts,
+        name='group_new_posts'
+    ),
+    path(
+        'profile/<str:username>/new/',
+        views.new_posts,
+        name='profile_new_posts'
+    ),
+    path(
+        'follow/new/',
+        views.new_posts,
+        {'follow': True},
+        name='follow_new_posts'
+    ),
+]
@@ -0,0 +1,392 @@
+"""JSON API только для чтения: те же ленты и посты, что и HTML-страницы.
+
+Строки читаются через values() - без экземпляров моделей и шаблонов.
+Имена авторов и slug групп подставляются одним запросом на страницу,
+без JOIN, поэтому API работает и с шардами постов (posts/sharding.py).
+
+Параметры:
+    cursor - курсор страницы из полей next и previous ответа;
+    fields - нужные поля через запятую, например fields=id,text.
+
+Адреса .../new/ отдают только посты новее since (id самого нового
+поста у клиента), с count=1 - только их число. С wait=N запрос,
+не найдя новых постов, ждет их до N секунд (не больше LIVE_MAX_WAIT).
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.views.decorators.http import condition, require_safe
+
+from core.query_budget import query_budget, unbudgeted
+from core.replicas import replica_reads
+from posts import cache_versions as versions
+from posts import live, sharding
+from posts.models import Comment, Follow, Group, Post, TimelineEntry, User
+from posts.paginator import COMMENTS_PER_PAGE, CursorPaginator
+
+POST_FIELDS = (
+    'id', 'text', 'pub_date', 'author', 'group', 'image', 'comments_count',
+)
+POST_DETAIL_FIELDS = POST_FIELDS + ('comments',)
+COMMENT_FIELDS = ('id', 'author', 'text', 'created')
+# Поля, которые собираются из другой колонки
+COLUMNS = {'author': 'author_id', 'group': 'group_id', 'comments': None}
+# Колонки ключа сортировки ленты нужны курсору, даже если их не просили
+FEED_KEY = ('pub_date', 'id')
+# Сколько новых постов отдавать за раз
+NEW_POSTS_LIMIT = 50
+# Больше id не поместится в целое SQLite
+MAX_ID = 2 ** 63 - 1
+DEFAULT_LIVE_MAX_WAIT = 25
+
+
+def _error(message, status):
+    return JsonResponse({'detail': message}, status=status)
+
+
+def _fields(request, allowed):
+    """Запрошенные поля по порядку или None, если есть неизвестные."""
+    raw = request.GET.get('fields')
+    if not raw:
+        return allowed
+    fields = tuple(dict.fromkeys(
+        name.strip() for name in raw.split(',') if name.strip()
+    ))
+    if not fields or set(fields) - set(allowed):
+        return None
+    return fields
+
+
+def _unknown_fields(allowed):
+    return _error(f'Доступные поля: {", ".join(allowed)}', 400)
+
+
+def _columns(fields, key=FEED_KEY):
+    columns = {COLUMNS.get(name, name) for name in fields} - {None}
+    return sorted(columns | set(key))
+
+
+def _serialize(rows, fields, usernames=None, slugs=None):
+    """Строки values() -> словари ответа только с полями fields.
+    usernames и slugs - уже известные имена авторов и slug групп:
+    в профиле и группе их не нужно запрашивать."""
+    if 'author' in fields and usernames is None:
+        usernames = dict(User.objects.filter(
+            pk__in={row['author_id'] for row in rows}
+        ).values_list('pk', 'username'))
+    if 'group' in fields and slugs is None:
+        slugs = dict(Group.objects.filter(
+            pk__in={row['group_id'] for row in rows} - {None}
+        ).values_list('pk', 'slug'))
+    results = []
+    for row in rows:
+        item = {}
+        for name in fields:
+            if name == 'author':
+                item[name] = usernames.get(row['author_id'])
+            elif name == 'group':
+                item[name] = slugs.get(row['group_id'])
+            elif name == 'image':
+                item[name] = (
+                    default_storage.url(row['image']) if row['image']
+                    else None
+                )
+            elif name in row:
+                item[name] = row[name]
+        results.append(item)
+    return results
+
+
+def _page(request, paginator, fields, **known):
+    page = paginator.get_page(request.GET.get('cursor'))
+    return JsonResponse({
+        'results': _serialize(list(page), fields, **known),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+def _feed(request, queryset, authors=None, **known):
+    fields = _fields(request, POST_FIELDS)
+    if fields is None:
+        return _unknown_fields(POST_FIELDS)
+    paginator = sharding.paginator(
+        queryset.values(*_columns(fields)), authors=authors, related=()
+    )
+    return _page(request, paginator, fields, **known)
+
+
+def _etag(request, *scopes):
+    # В отличие от HTML-страниц ответ не зависит от CSRF-токена и года
+    parts = [
+        *versions.get_versions(*scopes),
+        request.user.pk or 0,
+        request.GET.urlencode(),
+    ]
+    digest = hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def index_etag(request):
+    return _etag(request, (versions.GLOBAL, None))
+
+
+def group_posts_etag(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True
+    ).first()
+    if group_id is None:
+        return None
+    return _etag(request, (versions.GROUP, group_id))
+
+
+def profile_etag(request, username):
+    # Правка группы увеличивает версии авторов ее постов
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True
+    ).first()
+    if author_id is None:
+        return None
+    return _etag(request, (versions.AUTHOR, author_id))
+
+
+def post_detail_etag(request, post_id):
+    # Комментарии тоже сбрасывают версию поста, а имя автора и группа
+    # выводятся в ответе и меняются в своих областях
+    posts = sharding.for_post(Post.objects, post_id)
+    post = posts.filter(pk=post_id).values('author_id', 'group_id').first()
+    if post is None:
+        return None
+    return _etag(
+        request,
+        (versions.POST, post_id),
+        (versions.AUTHOR, post['author_id']),
+        (versions.GROUP, post['group_id']),
+    )
+
+
+def follow_index_etag(request):
+    if request.user.is_anonymous:
+        return None
+    # Любой новый пост меняет общую версию, подписки - версию ленты
+    return _etag(
+        request,
+        (versions.GLOBAL, None),
+        (versions.TIMELINE, request.user.pk),
+    )
+
+
+@query_budget(5)
+@require_safe
+@replica_reads
+@condition(etag_func=index_etag)
+def index(request):
+    """Все посты, новые сверху"""
+    return _feed(request, Post.objects.all())
+
+
+@query_budget(6)
+@require_safe
+@replica_reads
+@condition(etag_func=group_posts_etag)
+def group_posts(request, slug):
+    """Посты группы"""
+    group = Group.objects.filter(slug=slug).first()
+    if group is None:
+        return _error('Группа не найдена', 404)
+    return _feed(
+        request, Post.objects.filter(group=group),
+        slugs={group.pk: group.slug},
+    )
+
+
+@query_budget(6)
+@require_safe
+@replica_reads
+@condition(etag_func=profile_etag)
+def profile(request, username):
+    """Посты автора"""
+    author = User.objects.filter(username=username).first()
+    if author is None:
+        return _error('Автор не найден', 404)
+    return _feed(
+        request, Post.objects.filter(author=author), authors=[author.pk],
+        usernames={author.pk: author.username},
+    )
+
+
+@query_budget(6)
+@require_safe
+@condition(etag_func=post_detail_etag)
+def post_detail(request, post_id):
+    """Пост с комментариями, новые комментарии сверху"""
+    fields = _fields(request, POST_DETAIL_FIELDS)
+    if fields is None:
+        return _unknown_fields(POST_DETAIL_FIELDS)
+    posts = sharding.for_post(Post.objects, post_id).filter(pk=post_id)
+    rows = list(posts.values(*_columns(fields, key=('id',))))
+    if not rows:
+        return _error('Пост не найден', 404)
+    post = _serialize(rows, fields)[0]
+    if 'comments' in fields:
+        # Первая пачка, следующие - по курсору comments_next
+        page = _comments(post_id, None)
+        post['comments'] = page['results']
+        post['comments_next'] = page['next']
+    return JsonResponse(post)
+
+
+def _comments(post_id, cursor):
+    comments = sharding.for_post(Comment.objects, post_id).filter(
+        post_id=post_id
+    ).values('id', 'author_id', 'text', 'created')
+    paginator = CursorPaginator(
+        comments, per_page=COMMENTS_PER_PAGE, ordering=('-created', '-id')
+    )
+    page = paginator.get_page(cursor)
+    return {
+        'results': _serialize(list(page), COMMENT_FIELDS),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+@query_budget(5)
+@require_safe
+@condition(etag_func=post_detail_etag)
+def post_comments(request, post_id):
+    """Комментарии поста постранично, новые сверху"""
+    posts = sharding.for_post(Post.objects, post_id)
+    if not posts.filter(pk=post_id).exists():
+        return _error('Пост не найден', 404)
+    return JsonResponse(_comments(post_id, request.GET.get('cursor')))
+
+
+@query_budget(5)
+@require_safe
+@replica_reads
+@condition(etag_func=follow_index_etag)
+def follow_index(request):
+    """Посты авторов, на которых подписан пользователь"""
+    if request.user.is_anonymous:
+        return _error('Нужна авторизация', 401)
+    fields = _fields(request, POST_FIELDS)
+    if fields is None:
+        return _unknown_fields(POST_FIELDS)
+    if sharding.enabled():
+        authors = list(Follow.objects.filter(
+            user=request.user
+        ).values_list('author_id', flat=True))
+        return _feed(
+            request, Post.objects.filter(author_id__in=authors), authors
+        )
+    # Как и HTML-лента, читаем материализованную ленту подписок
+    columns = _columns(fields)
+    entries = TimelineEntry.objects.filter(user=request.user).values(
+        'pub_date', 'post_id', *[f'post__{column}' for column in columns]
+    )
+    paginator = CursorPaginator(
+        entries,
+        ordering=('-pub_date', '-post_id'),
+        transform=lambda rows: [
+            {column: row[f'post__{column}'] for column in columns}
+            for row in rows
+        ],
+    )
+    return _page(request, paginator, fields)
+
+
+def _wait(request):
+    """Секунды ожидания из wait, ограниченные LIVE_MAX_WAIT."""
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        wait = 0
+    limit = getattr(settings, 'LIVE_MAX_WAIT', DEFAULT_LIVE_MAX_WAIT)
+    return min(max(wait, 0), limit)
+
+
+def _new(queryset, authors, fields, count_only, known):
+    if count_only:
+        return {'count': sum(
+            part.count() for part in sharding.querysets(queryset, authors)
+        )}
+    # Берем самые старые из новых постов: при more клиент запросит
+    # следующие, передав в since id самого нового из полученных
+    paginator = sharding.paginator(
+        queryset.values(*_columns(fields, key=('id',))),
+        authors=authors,
+        related=(),
+        ordering=('id',),
+        per_page=NEW_POSTS_LIMIT,
+    )
+    page = paginator.get_page()
+    rows = list(page)[::-1]
+    return {
+        'count': len(rows),
+        'more': page.has_next(),
+        'results': _serialize(rows, fields, **known),
+    }
+
+
+@query_budget(6)
+@require_safe
+def new_posts(request, slug=None, username=None, follow=False):
+    """Посты ленты новее since, новые сверху"""
+    since = request.GET.get('since', '')
+    if not (since.isascii() and since.isdigit() and int(since) <= MAX_ID):
+        return _error('Нужен since - id самого нового поста клиента', 400)
+    fields = _fields(request, POST_FIELDS)
+    if fields is None:
+        return _unknown_fields(POST_FIELDS)
+    queryset = Post.objects.filter(id__gt=int(since))
+    authors = None
+    known = {}
+    if slug is not None:
+        group = Group.objects.filter(slug=slug).first()
+        if group is None:
+            return _error('Группа не найдена', 404)
+        queryset = queryset.filter(group=group)
+        scopes = [(versions.GROUP, group.pk)]
+        known['slugs'] = {group.pk: group.slug}
+    elif username is not None:
+        author = User.objects.filter(username=username).first()
+        if author is None:
+            return _error('Автор не найден', 404)
+        queryset = queryset.filter(author=author)
+        authors = [author.pk]
+        scopes = [(versions.AUTHOR, author.pk)]
+        known['usernames'] = {author.pk: author.username}
+    elif follow:
+        if request.user.is_anonymous:
+            return _error('Нужна авторизация', 401)
+        # Новых постов мало, поэтому фильтруем их по авторам,
+        # а не читаем материализованную ленту
+        authors = list(Follow.objects.filter(
+            user=request.user
+        ).values_list('author_id', flat=True))
+        queryset = queryset.filter(author_id__in=authors)
+        scopes = [
+            (versions.GLOBAL, None), (versions.TIMELINE, request.user.pk)
+        ]
+    else:
+        scopes = [(versions.GLOBAL, None)]
+    count_only = request.GET.get('count') == '1'
+    deadline = time.monotonic() + _wait(request)
+    # Версии берем до запроса: пост, сохраненный между ними,
+    # разбудит ожидание
+    seen = versions.get_versions(*scopes)
+    result = _new(queryset, authors, fields, count_only, known)
+    while not result['count']:
+        seen = live.wait_for_change(
+            scopes, seen, deadline - time.monotonic()
+        )
+        if seen is None:
+            break
+        # Сколько раз лента изменится за ожидание, заранее неизвестно
+        with unbudgeted():
+            result = _new(queryset, authors, fields, count_only, known)
+    return JsonResponse(result)
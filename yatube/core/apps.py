@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from .db import configure_sqlite
+        from .slow_queries import install
+        # WAL и прагмы для каждого нового соединения с SQLite
+        connection_created.connect(configure_sqlite)
+        # Журнал медленных запросов для каждого нового соединения
+        connection_created.connect(install)
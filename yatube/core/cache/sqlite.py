@@ -0,0 +1,313 @@
+"""Общий для всех процессов кеш в файле SQLite.
+
+LocMemCache живет внутри одного воркера: у каждого своя копия
+фрагментов, а сброс версии виден только в одном процессе.
+Этот бэкенд хранит записи в одном файле SQLite в режиме WAL, поэтому
+читатели не блокируют писателя, а кеш общий для всех воркеров
+и не требует отдельного сервиса.
+
+Настройки (OPTIONS):
+    MAX_ENTRIES - сколько записей держать до вытеснения (10000);
+    CULL_FREQUENCY - какую долю вытеснять: 1/CULL_FREQUENCY (3);
+    BUSY_TIMEOUT - сколько ждать блокировку записи, мс (5000);
+    MMAP_SIZE - размер отображаемой в память части файла (64 МБ).
+
+Вытесняются записи, которые дольше всех не читали (LRU). Время
+чтения обновляется не чаще раза в ACCESS_RESOLUTION секунд, чтобы
+каждое чтение не превращалось в запись. Размер кеша (COUNT(*))
+проверяется не на каждой записи, а раз в MAX_ENTRIES / CULL_CHECKS
+записей процесса: кеш может ненадолго превысить MAX_ENTRIES примерно
+на 1% на воркер.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+ACCESS_RESOLUTION = 10
+# Ограничение SQLite на число параметров в одном запросе
+MAX_VARIABLES = 500
+# Сколько раз за заполнение MAX_ENTRIES проверять размер кеша
+CULL_CHECKS = 100
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache_entry ('
+    ' key TEXT PRIMARY KEY,'
+    ' value BLOB,'
+    ' expires REAL,'
+    ' accessed REAL NOT NULL'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_entry_accessed '
+    'ON cache_entry (accessed)',
+)
+
+
+def _chunks(items, size=MAX_VARIABLES):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SQLiteCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        params.setdefault('OPTIONS', {}).setdefault('MAX_ENTRIES', 10000)
+        super().__init__(params)
+        options = params['OPTIONS']
+        self._path = os.path.abspath(location)
+        self._busy_timeout = int(options.get('BUSY_TIMEOUT', 5000))
+        self._mmap_size = int(options.get('MMAP_SIZE', 64 * 1024 * 1024))
+        self._local = threading.local()
+        # Записи этого процесса с последней проверки размера
+        self._cull_every = max(self._max_entries // CULL_CHECKS, 1)
+        self._writes = 0
+
+    # Соединения
+
+    @property
+    def _db(self):
+        # У каждого потока и каждого процесса (после fork) свое соединение
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = self._connect()
+            local.pid = os.getpid()
+        return local.connection
+
+    def _connect(self):
+        directory = os.path.dirname(self._path)
+        os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(
+            self._path,
+            timeout=self._busy_timeout / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(f'PRAGMA busy_timeout={self._busy_timeout}')
+        connection.execute(f'PRAGMA mmap_size={self._mmap_size}')
+        for statement in SCHEMA:
+            connection.execute(statement)
+        return connection
+
+    def _write(self, callback):
+        """Выполняет callback(db) в транзакции с блокировкой записи."""
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            result = callback(db)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return result
+
+    # Сериализация: целые числа храним как есть, чтобы incr
+    # выполнялся одним UPDATE внутри базы
+
+    def _dump(self, value):
+        if type(value) is int:
+            return value
+        return pickle.dumps(value, self.pickle_protocol)
+
+    @staticmethod
+    def _load(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    # API кеша
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return {}
+        originals = {self._key(key, version): key for key in keys}
+        now = time.time()
+        found = {}
+        stale = []
+        for chunk in _chunks(list(originals)):
+            rows = self._db.execute(
+                'SELECT key, value, expires, accessed FROM cache_entry '
+                f'WHERE key IN ({",".join("?" * len(chunk))})',
+                chunk,
+            )
+            for key, value, expires, accessed in rows:
+                if expires is not None and expires <= now:
+                    continue
+                found[originals[key]] = self._load(value)
+                if accessed < now - ACCESS_RESOLUTION:
+                    stale.append(key)
+        if stale:
+            self._touch_access(stale, now)
+        return found
+
+    def _touch_access(self, keys, now):
+        def callback(db):
+            for chunk in _chunks(keys):
+                db.execute(
+                    'UPDATE cache_entry SET accessed = ? '
+                    f'WHERE key IN ({",".join("?" * len(chunk))})',
+                    [now, *chunk],
+                )
+        try:
+            self._write(callback)
+        except sqlite3.OperationalError:
+            # Отметка о чтении не обязательна, не ждем занятую базу
+            pass
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        rows = [
+            (self._key(key, version), self._dump(value), expires, now)
+            for key, value in data.items()
+        ]
+
+        def callback(db):
+            db.executemany(
+                'INSERT OR REPLACE INTO cache_entry '
+                '(key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                rows,
+            )
+            self._cull(db, now, len(rows))
+        if rows:
+            self._write(callback)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+
+        def callback(db):
+            # Запись добавляется, только если ключа нет или он истек
+            cursor = db.execute(
+                'INSERT INTO cache_entry (key, value, expires, accessed) '
+                'VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+                'expires = excluded.expires, accessed = excluded.accessed '
+                'WHERE cache_entry.expires IS NOT NULL '
+                'AND cache_entry.expires <= ?',
+                (key, self._dump(value), expires, now, now),
+            )
+            if cursor.rowcount:
+                self._cull(db, now, 1)
+            return bool(cursor.rowcount)
+        return self._write(callback)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        cursor = self._db.execute(
+            'UPDATE cache_entry SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, now),
+        )
+        return bool(cursor.rowcount)
+
+    def incr(self, key, delta=1, version=None):
+        """Атомарно увеличивает целое значение одним UPDATE."""
+        cache_key = self._key(key, version)
+        now = time.time()
+
+        def callback(db):
+            cursor = db.execute(
+                'UPDATE cache_entry SET value = value + ?, accessed = ? '
+                "WHERE key = ? AND typeof(value) = 'integer' "
+                'AND (expires IS NULL OR expires > ?)',
+                (delta, now, cache_key, now),
+            )
+            if cursor.rowcount:
+                return db.execute(
+                    'SELECT value FROM cache_entry WHERE key = ?',
+                    (cache_key,),
+                ).fetchone()[0]
+            row = db.execute(
+                'SELECT value, expires FROM cache_entry WHERE key = ?',
+                (cache_key,),
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                raise ValueError(f"Key '{key}' not found")
+            # Не целое число: как в остальных бэкендах Django,
+            # складываем в Python и записываем результат
+            value = self._load(row[0]) + delta
+            db.execute(
+                'UPDATE cache_entry SET value = ? WHERE key = ?',
+                (self._dump(value), cache_key),
+            )
+            return value
+        return self._write(callback)
+
+    def has_key(self, key, version=None):
+        row = self._db.execute(
+            'SELECT 1 FROM cache_entry WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self._key(key, version), time.time()),
+        ).fetchone()
+        return row is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+
+        def callback(db):
+            for chunk in _chunks(keys):
+                db.execute(
+                    'DELETE FROM cache_entry '
+                    f'WHERE key IN ({",".join("?" * len(chunk))})',
+                    chunk,
+                )
+        if keys:
+            self._write(callback)
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache_entry')
+
+    def close(self, **kwargs):
+        # Соединение переиспользуется между запросами, как и в LocMemCache
+        pass
+
+    def _cull(self, db, now, written):
+        # Счетчик без блокировки: пропущенное приращение лишь отложит
+        # проверку на одну запись
+        self._writes += written
+        if self._writes < self._cull_every:
+            return
+        self._writes = 0
+        count = db.execute('SELECT COUNT(*) FROM cache_entry').fetchone()[0]
+        if count <= self._max_entries:
+            return
+        db.execute(
+            'DELETE FROM cache_entry WHERE expires IS NOT NULL '
+            'AND expires <= ?',
+            (now,),
+        )
+        count = db.execute('SELECT COUNT(*) FROM cache_entry').fetchone()[0]
+        if count <= self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            db.execute('DELETE FROM cache_entry')
+            return
+        db.execute(
+            'DELETE FROM cache_entry WHERE key IN ('
+            ' SELECT key FROM cache_entry ORDER BY accessed LIMIT ?'
+            ')',
+            (count // self._cull_frequency,),
+        )
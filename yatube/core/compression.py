@@ -0,0 +1,177 @@
+"""Минификация и сжатие HTML-ответов.
+
+HtmlCompressionMiddleware убирает из страниц HTML-комментарии и лишние
+пробелы (кроме pre, textarea, script и style) и сжимает их gzip или,
+если установлен пакет brotli и клиент его принимает, br.
+
+Одинаковые страницы (например, лента для анонимов) не сжимаются
+заново: результат кешируется по хешу исходного тела. В кеш попадают
+только общие для всех ответы: без cookie, без private, без токена
+CSRF в теле и не зависящие от cookie сессии (Vary: Cookie при запросе
+с сессией - страница вошедшего пользователя).
+
+Заголовок Server-Timing показывает цену обработки и выигрыш:
+    html-minify;dur=1.8, html-compress;dur=0.9;desc="gzip",
+    html-bytes;desc="48211 -> 7920"
+При попадании в кеш вместо них - html-cache;dur=0.3;desc="hit".
+
+Настройки:
+    HTML_COMPRESSION_MIN_SIZE - ответы короче не трогаем;
+    HTML_COMPRESSION_CACHE_TIMEOUT - сколько секунд хранить результат.
+"""
+import gzip
+import hashlib
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import has_vary_header, patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    # brotli необязателен: без него сжимаем только gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_SIZE = 512
+DEFAULT_CACHE_TIMEOUT = 600
+
+_PRESERVED = re.compile(
+    r'<(pre|textarea|script|style)\b.*?</\1\s*>', re.S | re.I
+)
+# Условные комментарии IE - не просто комментарии
+_COMMENT = re.compile(r'<!--(?!\[if).*?-->', re.S)
+_SPACES = re.compile(r'\s+')
+_ACCEPTS_BR = re.compile(r'\bbr\b')
+_ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def _collapse(match):
+    # Перевод строки оставляем переводом: так HTML остается читаемым
+    # построчно, а размер тот же
+    return '\n' if '\n' in match.group() else ' '
+
+
+def minify(html):
+    """HTML без комментариев и с одним пробелом вместо серии пробелов.
+    Содержимое pre, textarea, script и style не меняется."""
+    parts = []
+    position = 0
+    for match in _PRESERVED.finditer(html):
+        parts.append(_minify_text(html[position:match.start()]))
+        parts.append(match.group())
+        position = match.end()
+    parts.append(_minify_text(html[position:]))
+    return ''.join(parts).strip()
+
+
+def _minify_text(html):
+    return _SPACES.sub(_collapse, _COMMENT.sub('', html))
+
+
+def _encoding(request):
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if brotli is not None and _ACCEPTS_BR.search(accepted):
+        return 'br'
+    if _ACCEPTS_GZIP.search(accepted):
+        return 'gzip'
+    return None
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    return data
+
+
+def add_server_timing(response, *metrics):
+    """Дописывает метрики в заголовок Server-Timing."""
+    values = [response['Server-Timing']] if response.has_header(
+        'Server-Timing'
+    ) else []
+    response['Server-Timing'] = ', '.join(values + list(metrics))
+
+
+class HtmlCompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self._applies(response):
+            return response
+        body = response.content
+        encoding = _encoding(request)
+        cacheable = self._cacheable(request, response)
+        digest = hashlib.sha1(body).hexdigest()
+        key = f'html:{digest}:{encoding or "identity"}'
+        started = time.perf_counter()
+        processed = cache.get(key) if cacheable else None
+        if processed is not None:
+            elapsed = (time.perf_counter() - started) * 1000
+            metrics = [f'html-cache;dur={elapsed:.2f};desc="hit"']
+        else:
+            charset = response.charset
+            minified = minify(body.decode(charset)).encode(charset)
+            minified_at = time.perf_counter()
+            processed = _compress(minified, encoding)
+            compressed_at = time.perf_counter()
+            minify_ms = (minified_at - started) * 1000
+            compress_ms = (compressed_at - minified_at) * 1000
+            metrics = [
+                f'html-minify;dur={minify_ms:.2f}',
+                f'html-compress;dur={compress_ms:.2f};'
+                f'desc="{encoding or "identity"}"',
+            ]
+            if cacheable:
+                cache.set(key, processed, getattr(
+                    settings, 'HTML_COMPRESSION_CACHE_TIMEOUT',
+                    DEFAULT_CACHE_TIMEOUT
+                ))
+        metrics.append(f'html-bytes;desc="{len(body)} -> {len(processed)}"')
+        logger.debug('%s: %s', request.path, ', '.join(metrics))
+        response.content = processed
+        response['Content-Length'] = str(len(processed))
+        if encoding:
+            response['Content-Encoding'] = encoding
+            # Сжатое тело побайтно другое: сильный ETag делаем слабым
+            etag = response.get('ETag', '')
+            if etag and not etag.startswith('W/'):
+                response['ETag'] = 'W/' + etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        add_server_timing(response, *metrics)
+        return response
+
+    def _applies(self, response):
+        min_size = getattr(
+            settings, 'HTML_COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE
+        )
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not response.has_header('Content-Encoding')
+            and response.get('Content-Type', '').startswith('text/html')
+            and len(response.content) >= min_size
+        )
+
+    def _cacheable(self, request, response):
+        cache_control = response.get('Cache-Control', '')
+        return (
+            request.method in ('GET', 'HEAD')
+            and not response.cookies
+            and 'private' not in cache_control
+            and 'no-store' not in cache_control
+            # Страницы с токеном CSRF и страницы вошедших пользователей
+            # у каждого свои: их хеши не совпадут, а кеш они вытеснят
+            and not request.META.get('CSRF_COOKIE_USED')
+            and not (
+                has_vary_header(response, 'Cookie')
+                and settings.SESSION_COOKIE_NAME in request.COOKIES
+            )
+        )
@@ -0,0 +1,53 @@
+"""Настройка соединений SQLite для работы под нагрузкой.
+
+По умолчанию SQLite ведет журнал отката: пока пишется пост или
+комментарий, читатели ждут, а при нескольких воркерах запросы падают
+с "database is locked". При каждом новом соединении включаем:
+
+    journal_mode=WAL    - читатели не блокируют писателя и наоборот;
+    synchronous=NORMAL  - в режиме WAL безопасно и без fsync на коммит;
+    mmap_size           - чтение страниц из отображенного в память файла;
+    cache_size          - кеш страниц соединения (отрицательное - в КиБ);
+    busy_timeout        - сколько ждать чужую запись, мс, вместо ошибки;
+    temp_store=MEMORY   - временные таблицы и сортировки в памяти.
+
+Значения можно переопределить в settings.SQLITE_PRAGMAS, а для одной
+базы - ключом PRAGMAS в ее записи DATABASES.
+Соединения переиспользуются между запросами (CONN_MAX_AGE в DATABASES),
+поэтому прагмы выполняются один раз на соединение, а не на запрос.
+"""
+from django.conf import settings
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -32000,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+
+
+def pragmas():
+    return {**PRAGMAS, **getattr(settings, 'SQLITE_PRAGMAS', {})}
+
+
+def configure(cursor, values=None):
+    """Выполняет прагмы на курсоре DB-API (sqlite3 или Django)."""
+    for name, value in (values or pragmas()).items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Обработчик connection_created."""
+    if connection.vendor != 'sqlite':
+        return
+    # Курсор самого sqlite3: прагмы не должны попадать в обертки
+    # запросов Django (бюджет запросов, журнал медленных запросов)
+    cursor = connection.connection.cursor()
+    try:
+        configure(cursor, {
+            **pragmas(), **connection.settings_dict.get('PRAGMAS', {})
+        })
+    finally:
+        cursor.close()
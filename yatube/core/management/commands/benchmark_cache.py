@@ -0,0 +1,64 @@
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management.base import BaseCommand
+
+from core.cache.sqlite import SQLiteCache
+
+BACKENDS = {
+    'sqlite': (SQLiteCache, 'cache.sqlite3'),
+    'filebased': (FileBasedCache, 'filebased'),
+}
+
+
+def _worker(backend, location, operations, keys, seed):
+    """Смесь чтений и записей, как у страниц с фрагментным кешем:
+    на одну запись приходится девять чтений."""
+    cls, _ = BACKENDS[backend]
+    cache = cls(location, {'OPTIONS': {'MAX_ENTRIES': keys * 2}})
+    rnd = random.Random(seed)
+    fragment = 'x' * 2048
+    for _ in range(operations):
+        key = f'fragment:{rnd.randrange(keys)}'
+        if rnd.random() < 0.1:
+            cache.set(key, fragment)
+        elif cache.get(key) is None:
+            cache.set(key, fragment)
+    return operations
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность кеша в SQLite '
+            'и FileBasedCache при нескольких процессах')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--operations', type=int, default=5000)
+        parser.add_argument('--keys', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        context = multiprocessing.get_context('fork')
+        for backend, (_, name) in BACKENDS.items():
+            directory = tempfile.mkdtemp()
+            location = os.path.join(directory, name)
+            # Прогрев: кеш создается до старта воркеров
+            _worker(backend, location, options['keys'], options['keys'], 0)
+            started = time.perf_counter()
+            with context.Pool(workers) as pool:
+                done = sum(pool.starmap(_worker, [
+                    (backend, location, options['operations'],
+                     options['keys'], seed)
+                    for seed in range(1, workers + 1)
+                ]))
+            elapsed = time.perf_counter() - started
+            shutil.rmtree(directory, ignore_errors=True)
+            self.stdout.write(
+                f'{backend:10} {workers} процессов: '
+                f'{done / elapsed:,.0f} операций/с'
+            )
@@ -0,0 +1,106 @@
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.db import configure, pragmas
+
+SCHEMA = (
+    'CREATE TABLE post ('
+    ' id INTEGER PRIMARY KEY,'
+    ' author_id INTEGER NOT NULL,'
+    ' text TEXT NOT NULL,'
+    ' pub_date REAL NOT NULL'
+    ')',
+    'CREATE INDEX post_author_pub_date ON post (author_id, pub_date DESC)',
+)
+
+
+def _worker(path, values, seconds, write_share, seed, result):
+    """Смесь как у сайта: чтения страниц ленты и редкие записи постов
+    и комментариев, каждая запись - отдельная транзакция."""
+    db = sqlite3.connect(path, isolation_level=None)
+    if values:
+        configure(db.cursor(), values)
+    rnd = random.Random(seed)
+    reads = writes = errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        try:
+            if rnd.random() < write_share:
+                db.execute(
+                    'INSERT INTO post (author_id, text, pub_date) '
+                    'VALUES (?, ?, ?)',
+                    (rnd.randrange(100), 'x' * 500, time.time()),
+                )
+                writes += 1
+            else:
+                db.execute(
+                    'SELECT id, text FROM post WHERE author_id = ? '
+                    'ORDER BY pub_date DESC LIMIT 10',
+                    (rnd.randrange(100),),
+                ).fetchall()
+                reads += 1
+        except sqlite3.OperationalError:
+            # database is locked
+            errors += 1
+    db.close()
+    result.append((reads, writes, errors))
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность SQLite с настройками '
+            'по умолчанию и с прагмами из core/db.py при нескольких потоках')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=3)
+        parser.add_argument(
+            '--write-share', type=float, default=0.2,
+            help='доля записей среди операций',
+        )
+
+    def handle(self, *args, **options):
+        modes = (
+            ('по умолчанию', {}),
+            ('WAL и прагмы', pragmas()),
+        )
+        for name, values in modes:
+            directory = tempfile.mkdtemp()
+            path = os.path.join(directory, 'db.sqlite3')
+            db = sqlite3.connect(path)
+            for statement in SCHEMA:
+                db.execute(statement)
+            db.executemany(
+                'INSERT INTO post (author_id, text, pub_date) '
+                'VALUES (?, ?, ?)',
+                [(i % 100, 'x' * 500, i) for i in range(10000)],
+            )
+            db.commit()
+            db.close()
+            result = []
+            threads = [
+                threading.Thread(target=_worker, args=(
+                    path, values, options['seconds'],
+                    options['write_share'], seed, result,
+                ))
+                for seed in range(options['threads'])
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            shutil.rmtree(directory, ignore_errors=True)
+            reads, writes, errors = map(sum, zip(*result))
+            seconds = options['seconds']
+            self.stdout.write(
+                f'{name:14} {options["threads"]} потоков: '
+                f'чтений {reads / seconds:,.0f}/с, '
+                f'записей {writes / seconds:,.0f}/с, '
+                f'ошибок блокировки {errors}'
+            )
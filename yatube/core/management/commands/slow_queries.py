@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import slow_queries
+
+
+class Command(BaseCommand):
+    help = ('Отчет по журналу медленных запросов: формы запросов '
+            'по убыванию суммарного времени')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files', nargs='*',
+            help='файлы журнала; по умолчанию SLOW_QUERY_LOG и его копии',
+        )
+        parser.add_argument(
+            '--limit', type=int, default=10,
+            help='сколько форм показать',
+        )
+
+    def handle(self, *args, **options):
+        paths = options['files'] or slow_queries.log_files()
+        if not paths:
+            raise CommandError(
+                f'Журнала нет: {slow_queries.log_path()}'
+            )
+        shapes = slow_queries.report(paths)
+        if not shapes:
+            self.stdout.write('Медленных запросов нет')
+            return
+        self.stdout.write(
+            f'{"всего, с":>10} {"раз":>6} {"средн, мс":>10} '
+            f'{"макс, мс":>10}  откуда'
+        )
+        for stats in shapes[:options['limit']]:
+            average = stats['total'] / stats['count'] * 1000
+            self.stdout.write(
+                f'{stats["total"]:>10.3f} {stats["count"]:>6} '
+                f'{average:>10.1f} {stats["max"] * 1000:>10.1f}  '
+                f'{self._top(stats["locations"])}'
+            )
+            self.stdout.write(
+                f'{"":>40}страницы: {self._top(stats["views"])}; '
+                f'параметры: {self._top(stats["params"])}'
+            )
+            self.stdout.write(f'{"":>40}{stats["shape"]}')
+
+    def _top(self, counter, number=3):
+        return ', '.join(
+            f'{value or "-"} ({count})'
+            for value, count in counter.most_common(number)
+        )
@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import replicas
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в файлы реплик '
+            '(settings.DATABASE_REPLICAS) через backup API')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='повторять каждые N секунд, 0 - скопировать один раз',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError(
+                'Реплик нет: задайте переменную окружения YATUBE_REPLICAS'
+            )
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('Копирование файлом работает только с SQLite')
+        while True:
+            started = time.perf_counter()
+            self.sync()
+            self.stdout.write(
+                f'Реплики обновлены за '
+                f'{time.perf_counter() - started:.2f} с'
+            )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def sync(self):
+        replicas.copy_database(
+            settings.DATABASES['default']['NAME'],
+            [settings.DATABASES[alias]['NAME']
+             for alias in settings.DATABASE_REPLICAS],
+        )
+        # Фрагменты, собранные по старым копиям, больше не читаются
+        replicas.bump_epoch()
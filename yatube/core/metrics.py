@@ -0,0 +1,319 @@
+"""Метрики ответов в формате Prometheus.
+
+MetricsMiddleware для каждого ответа записывает по имени URL
+(posts:index, posts:profile, ...) гистограмму времени ответа, число
+ответов по статусам, число и время запросов к базе и время рендера
+шаблонов (его считает бэкенд шаблонов TimedDjangoTemplates).
+
+Запись - несколько операций со словарем в памяти процесса. Раз в
+METRICS_FLUSH_INTERVAL секунд процесс сохраняет свои счетчики в файл
+METRICS_DIR/metrics-<pid>.json, а /metrics складывает файлы всех
+воркеров gunicorn. Файлы завершившихся воркеров остаются: их
+счетчики не должны пропасть из сумм. При развертывании папку можно
+очистить.
+
+/metrics доступен сотрудникам (is_staff) и по заголовку
+Authorization: Bearer <METRICS_TOKEN>.
+"""
+import bisect
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import (DjangoTemplates, Template,
+                                             reraise)
+from django.template.exceptions import TemplateDoesNotExist
+
+from .tokens import token_matches
+
+# Границы корзин гистограммы времени ответа, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DEFAULT_FLUSH_INTERVAL = 5
+# Ответы, для которых не нашлось URL (404), - одна метка на всех
+UNRESOLVED = 'unresolved'
+
+logger = logging.getLogger(__name__)
+
+_request = threading.local()
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None) or os.path.join(
+        tempfile.gettempdir(), 'yatube-metrics'
+    )
+
+
+def _new_stats():
+    return {
+        'buckets': [0] * (len(BUCKETS) + 1),
+        'sum': 0.0,
+        'count': 0,
+        'statuses': {},
+        'queries': 0,
+        'db_seconds': 0.0,
+        'template_seconds': 0.0,
+    }
+
+
+def merge(total, snapshot):
+    """Добавляет счетчики snapshot к total."""
+    for view, stats in snapshot.items():
+        target = total.setdefault(view, _new_stats())
+        target['buckets'] = [
+            a + b for a, b in zip(target['buckets'], stats['buckets'])
+        ]
+        for name in ('sum', 'count', 'queries', 'db_seconds',
+                     'template_seconds'):
+            target[name] += stats[name]
+        for status, count in stats['statuses'].items():
+            target['statuses'][status] = (
+                target['statuses'].get(status, 0) + count
+            )
+    return total
+
+
+class Registry:
+    """Счетчики одного процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._views = {}
+        self._flushed = time.monotonic()
+
+    def observe(self, view, status, seconds, queries=0, db_seconds=0.0,
+                template_seconds=0.0):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        status = str(status)
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = _new_stats()
+            stats['buckets'][index] += 1
+            stats['sum'] += seconds
+            stats['count'] += 1
+            statuses = stats['statuses']
+            statuses[status] = statuses.get(status, 0) + 1
+            stats['queries'] += queries
+            stats['db_seconds'] += db_seconds
+            stats['template_seconds'] += template_seconds
+
+    def snapshot(self):
+        with self._lock:
+            return copy.deepcopy(self._views)
+
+    def path(self):
+        return os.path.join(metrics_dir(), f'metrics-{os.getpid()}.json')
+
+    def flush(self):
+        """Сохраняет счетчики в файл процесса, атомарно. Если другой
+        поток уже сохраняет их, ничего не делает."""
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._flushed = time.monotonic()
+            path = self.path()
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            # У каждого флаша свой временный файл: общий .tmp
+            # переименовал бы другой поток
+            descriptor, temporary = tempfile.mkstemp(
+                dir=directory, suffix='.tmp'
+            )
+            try:
+                with os.fdopen(descriptor, 'w') as file:
+                    json.dump(self.snapshot(), file)
+                os.replace(temporary, path)
+            except BaseException:
+                if os.path.exists(temporary):
+                    os.unlink(temporary)
+                raise
+        finally:
+            self._flush_lock.release()
+
+    def maybe_flush(self):
+        interval = getattr(
+            settings, 'METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL
+        )
+        if time.monotonic() - self._flushed >= interval:
+            try:
+                self.flush()
+            except OSError:
+                # Метрики не повод отдавать пользователю 500
+                logger.exception('Не удалось сохранить метрики')
+
+    def collect(self):
+        """Сумма счетчиков всех процессов; свои - без задержки флаша."""
+        total = {}
+        own = os.path.basename(self.path())
+        directory = metrics_dir()
+        names = os.listdir(directory) if os.path.isdir(directory) else []
+        for name in names:
+            if name == own or not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as file:
+                    merge(total, json.load(file))
+            except (OSError, ValueError):
+                # Файл удалили или дописывают прямо сейчас
+                continue
+        return merge(total, self.snapshot())
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+
+registry = Registry()
+
+
+def _add(name, seconds):
+    if getattr(_request, 'active', False):
+        setattr(_request, name, getattr(_request, name) + seconds)
+
+
+def _time_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        _request.queries += 1
+        _request.db_seconds += time.perf_counter() - started
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            _add('template_seconds', time.perf_counter() - started)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates, который считает время рендера для метрик.
+    Вложенные include рендерятся внутри шаблона и не считаются дважды."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(
+                self.engine.get_template(template_name), self
+            )
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _request.active = True
+        _request.queries = 0
+        _request.db_seconds = 0.0
+        _request.template_seconds = 0.0
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(_time_query)
+                    )
+                response = self.get_response(request)
+            elapsed = time.perf_counter() - started
+            match = request.resolver_match
+            registry.observe(
+                match.view_name if match else UNRESOLVED,
+                response.status_code,
+                elapsed,
+                _request.queries,
+                _request.db_seconds,
+                _request.template_seconds,
+            )
+        finally:
+            _request.active = False
+        registry.maybe_flush()
+        return response
+
+
+def _allowed(request):
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    return bool(token) and token_matches(
+        request.META.get('HTTP_AUTHORIZATION'), f'Bearer {token}'
+    )
+
+
+def _labels(**labels):
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return '{' + pairs + '}'
+
+
+def render(views):
+    """Счетчики в текстовом формате Prometheus."""
+    lines = [
+        '# HELP yatube_request_duration_seconds Время ответа',
+        '# TYPE yatube_request_duration_seconds histogram',
+    ]
+    for view, stats in sorted(views.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), stats['buckets']):
+            cumulative += count
+            labels = _labels(view=view, le=bound)
+            lines.append(
+                f'yatube_request_duration_seconds_bucket{labels} '
+                f'{cumulative}'
+            )
+        labels = _labels(view=view)
+        lines.append(
+            f'yatube_request_duration_seconds_sum{labels} {stats["sum"]}'
+        )
+        lines.append(
+            f'yatube_request_duration_seconds_count{labels} {stats["count"]}'
+        )
+    lines += [
+        '# HELP yatube_responses_total Ответы по статусам',
+        '# TYPE yatube_responses_total counter',
+    ]
+    for view, stats in sorted(views.items()):
+        for status, count in sorted(stats['statuses'].items()):
+            labels = _labels(view=view, status=status)
+            lines.append(f'yatube_responses_total{labels} {count}')
+    counters = (
+        ('yatube_db_queries_total', 'queries', 'Запросы к базе'),
+        ('yatube_db_query_seconds_total', 'db_seconds',
+         'Время запросов к базе'),
+        ('yatube_template_render_seconds_total', 'template_seconds',
+         'Время рендера шаблонов'),
+    )
+    for metric, field, description in counters:
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} counter']
+        for view, stats in sorted(views.items()):
+            lines.append(f'{metric}{_labels(view=view)} {stats[field]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics(request):
+    """/metrics для Prometheus"""
+    if not _allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render(registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,235 @@
+"""Статистический профилировщик ответов по требованию.
+
+Поток-сэмплер раз в PROFILER_INTERVAL секунд снимает стек потоков,
+которые сейчас обрабатывают профилируемые ответы
+(sys._current_frames()), и считает одинаковые стеки. Пока ничего не
+профилируется, сэмплер спит и ответы ничего не платят, кроме проверки
+заголовка.
+
+Профилируются:
+    - один ответ с заголовком X-Profile: <PROFILER_TOKEN> (сотрудникам
+      достаточно X-Profile: 1);
+    - все ответы всех воркеров на время окна, которое сотрудник
+      включает на странице /admin/profiles/.
+
+Каждый ответ с собранными сэмплами записывается в PROFILER_DIR файлом
+в формате collapsed stacks (строка "кадр;кадр;кадр число"), его
+понимают flamegraph.pl и speedscope. В имени файла - время, pid и имя
+URL; имя файла возвращается в заголовке X-Profile ответа.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import count
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .tokens import token_matches
+
+DEFAULT_INTERVAL = 0.005
+DEFAULT_MAX_FILES = 500
+# Как часто воркер перечитывает из кеша, включено ли окно
+WINDOW_CHECK_INTERVAL = 1
+WINDOW_KEY = 'profiler:until'
+SUFFIX = '.folded'
+NAME = re.compile(r'^[\w.-]+__[\w.-]+\.folded$')
+
+_sequence = count(1)
+_window = {'until': 0, 'checked': 0}
+
+
+def profiles_dir():
+    return getattr(settings, 'PROFILER_DIR', None) or os.path.join(
+        settings.BASE_DIR, 'profiles'
+    )
+
+
+def _short(filename):
+    """Путь файла без начала: posts/views.py, django/db/..."""
+    if filename.startswith(settings.BASE_DIR):
+        return os.path.relpath(filename, settings.BASE_DIR)
+    head, marker, tail = filename.rpartition('-packages' + os.sep)
+    if marker:
+        return tail
+    return os.path.basename(filename)
+
+
+class Sampler(threading.Thread):
+    """Снимает стеки зарегистрированных потоков, пока они есть."""
+
+    def __init__(self):
+        super().__init__(name='profiler', daemon=True)
+        self.targets = {}
+        self.condition = threading.Condition()
+        self._labels = {}
+
+    def add(self, ident):
+        samples = Counter()
+        with self.condition:
+            self.targets[ident] = samples
+            self.condition.notify()
+        return samples
+
+    def remove(self, ident):
+        with self.condition:
+            return self.targets.pop(ident, Counter())
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.targets:
+                    self.condition.wait()
+            time.sleep(
+                getattr(settings, 'PROFILER_INTERVAL', DEFAULT_INTERVAL)
+            )
+            frames = sys._current_frames()
+            with self.condition:
+                for ident, samples in self.targets.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[self.collapse(frame)] += 1
+            del frames
+
+    def label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (
+                f'{_short(code.co_filename)}:{code.co_name}'
+            )
+        return label
+
+    def collapse(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(self.label(frame.f_code))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def sampler():
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = Sampler()
+            _sampler.start()
+    return _sampler
+
+
+def window_until():
+    """До какого времени (time.time()) включено окно профилирования."""
+    now = time.monotonic()
+    if now - _window['checked'] >= WINDOW_CHECK_INTERVAL:
+        _window['until'] = cache.get(WINDOW_KEY) or 0
+        _window['checked'] = now
+    return _window['until']
+
+
+def set_window(seconds):
+    """Включает окно на seconds секунд для всех воркеров; 0 - выключает."""
+    until = time.time() + seconds if seconds else 0
+    if seconds:
+        cache.set(WINDOW_KEY, until, seconds)
+    else:
+        cache.delete(WINDOW_KEY)
+    _window.update(until=until, checked=time.monotonic())
+
+
+def _requested(request):
+    header = request.META.get('HTTP_X_PROFILE')
+    if header is None:
+        return False
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    return token_matches(header, getattr(settings, 'PROFILER_TOKEN', ''))
+
+
+def save(view, samples):
+    """Пишет сэмплы в файл и возвращает его имя."""
+    directory = profiles_dir()
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    name = (
+        f'{stamp}-{os.getpid()}-{next(_sequence)}__'
+        f'{view.replace(":", ".")}{SUFFIX}'
+    )
+    with open(os.path.join(directory, name), 'w') as file:
+        for stack, number in samples.most_common():
+            file.write(f'{stack} {number}\n')
+    _prune(directory)
+    return name
+
+
+def _prune(directory):
+    limit = getattr(settings, 'PROFILER_MAX_FILES', DEFAULT_MAX_FILES)
+    names = sorted(
+        name for name in os.listdir(directory) if name.endswith(SUFFIX)
+    )
+    for name in names[:max(len(names) - limit, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def profiles():
+    """Сохраненные профили, новые сверху."""
+    directory = profiles_dir()
+    if not os.path.isdir(directory):
+        return []
+    result = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not NAME.match(name):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as file:
+                samples = sum(
+                    int(line.rsplit(' ', 1)[1]) for line in file if line
+                )
+            created = datetime.fromtimestamp(
+                os.path.getmtime(path), tz=timezone.utc
+            )
+        except (OSError, IndexError, ValueError):
+            continue
+        view = name[:-len(SUFFIX)].split('__', 1)[1].replace('.', ':')
+        result.append({
+            'name': name,
+            'view': view,
+            'samples': samples,
+            'created': created,
+        })
+    return result
+
+
+class ProfilerMiddleware:
+    """Стоит после AuthenticationMiddleware: заголовок X-Profile
+    сотрудникам разрешен без токена."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not (_requested(request) or time.time() < window_until()):
+            return self.get_response(request)
+        ident = threading.get_ident()
+        profiler = sampler()
+        profiler.add(ident)
+        try:
+            response = self.get_response(request)
+        finally:
+            samples = profiler.remove(ident)
+        if samples:
+            match = request.resolver_match
+            response['X-Profile'] = save(
+                match.view_name if match else 'unresolved', samples
+            )
+        return response
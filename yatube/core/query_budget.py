@@ -0,0 +1,232 @@
+"""Бюджет запросов к базе для страниц и поиск N+1.
+
+Представление объявляет, сколько запросов ему можно сделать:
+
+    @query_budget(6)
+    def index(request): ...
+
+QueryBudgetMiddleware считает запросы каждого ответа. Одинаковые
+по форме запросы (литералы и списки IN заменены на ?) группируются;
+если форма повторилась QUERY_BUDGET_REPEAT_LIMIT раз и больше,
+это похоже на N+1, и в отчет попадает строка шаблона, из-за которой
+запрос был сделан. Запросы из unbudgeted() в бюджет не входят,
+но их число ограничено отдельно. Превышение пишется в лог
+core.query_budget, а при QUERY_BUDGET_RAISE = True (так в тестах)
+бросает исключение.
+
+Настройки:
+    QUERY_BUDGET_DEFAULT - бюджет страниц без декоратора (None - без
+    ограничения, проверяется только N+1);
+    QUERY_BUDGET_REPEAT_LIMIT - с какого повтора форма считается N+1;
+    QUERY_BUDGET_UNBUDGETED_LIMIT - сколько запросов на ответ можно
+    сделать внутри unbudgeted();
+    QUERY_BUDGET_RAISE - бросать QueryBudgetExceeded вместо записи в лог.
+"""
+import logging
+import re
+import sys
+import threading
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPEAT_LIMIT = 5
+DEFAULT_UNBUDGETED_LIMIT = 50
+
+_RENDER_CODE = Node.render_annotated.__code__
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDERS = re.compile(r'\((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)')
+_state = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    """Декоратор: не больше limit запросов на один ответ."""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+@contextmanager
+def unbudgeted():
+    """Запросы внутри блока не учитываются: для редкой разовой работы
+    вроде генерации недостающей миниатюры во время рендера."""
+    previous = getattr(_state, 'paused', False)
+    _state.paused = True
+    try:
+        yield
+    finally:
+        _state.paused = previous
+
+
+def normalize(sql):
+    """Форма запроса: без литералов и с IN (...) любой длины."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDERS.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+def template_line():
+    """Шаблон и строка узла, который сейчас рендерится, или None."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code is _RENDER_CODE:
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                return f'{origin.template_name}:{token.lineno}'
+        frame = frame.f_back
+    return None
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class QueryLog:
+    """Запросы, сделанные внутри record().
+
+    Запросы считаются по тексту SQL, формы строятся только для отчета.
+    Строку шаблона ищем обходом стека: с trace=True для каждого
+    запроса, иначе только для повторов начиная с repeat_limit-го,
+    где уже похоже на N+1. Запросы из unbudgeted() идут в свой счетчик.
+    """
+
+    def __init__(self, trace=False, repeat_limit=None):
+        self.trace = trace
+        self.repeat_limit = repeat_limit or _setting(
+            'QUERY_BUDGET_REPEAT_LIMIT', DEFAULT_REPEAT_LIMIT
+        )
+        self.queries = Counter()
+        self.locations = defaultdict(Counter)
+        self.unbudgeted = 0
+
+    def __len__(self):
+        return sum(self.queries.values())
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_state, 'paused', False):
+            self.unbudgeted += 1
+        else:
+            self.queries[sql] += 1
+            if self.trace or self.queries[sql] >= self.repeat_limit:
+                self.locations[sql][template_line()] += 1
+        return execute(sql, params, many, context)
+
+    def shapes(self):
+        """Число запросов каждой формы и строки шаблонов, откуда они."""
+        shapes = Counter()
+        locations = defaultdict(Counter)
+        for sql, count in self.queries.items():
+            shape = normalize(sql)
+            shapes[shape] += count
+            locations[shape].update(self.locations.get(sql, {}))
+        return shapes, locations
+
+    def repeated(self, limit=None):
+        """Формы, повторившиеся limit раз и больше: (форма, раз, строка)."""
+        if limit is None:
+            limit = self.repeat_limit
+        shapes, locations = self.shapes()
+        return [
+            (shape, count, _location(locations[shape]))
+            for shape, count in shapes.most_common()
+            if count >= limit
+        ]
+
+    def problems(self, budget=None, limit=None, unbudgeted_limit=None):
+        """Описания нарушений: превышение бюджета, N+1 и слишком
+        много запросов в unbudgeted()."""
+        problems = []
+        if budget is not None and len(self) > budget:
+            problems.append(f'{len(self)} запросов при бюджете {budget}')
+        for shape, count, location in self.repeated(limit):
+            problems.append(
+                f'N+1: {count} раз из {location or "кода представления"}: '
+                f'{shape}'
+            )
+        if unbudgeted_limit is None:
+            unbudgeted_limit = _setting(
+                'QUERY_BUDGET_UNBUDGETED_LIMIT', DEFAULT_UNBUDGETED_LIMIT
+            )
+        if self.unbudgeted > unbudgeted_limit:
+            problems.append(
+                f'{self.unbudgeted} запросов вне бюджета '
+                f'при лимите {unbudgeted_limit}'
+            )
+        return problems
+
+
+def _location(locations):
+    """Строка шаблона, откуда форма запрашивалась чаще всего."""
+    for location, _ in locations.most_common():
+        if location is not None:
+            return location
+    return None
+
+
+@contextmanager
+def record(trace=None):
+    """Собирает запросы ко всем базам в QueryLog.
+    Работает и без DEBUG: запросы перехватывает execute_wrapper.
+    По умолчанию каждый запрос трассируется в DEBUG и в тестах."""
+    if trace is None:
+        trace = settings.DEBUG or _setting('QUERY_BUDGET_RAISE', False)
+    log = QueryLog(trace)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(log))
+        yield log
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.query_budget = _setting('QUERY_BUDGET_DEFAULT', None)
+        with record() as log:
+            response = self.get_response(request)
+        problems = log.problems(request.query_budget)
+        if problems:
+            message = f'{request.method} {request.path}: ' + '; '.join(
+                problems
+            )
+            if _setting('QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        limit = getattr(view_func, 'query_budget', None)
+        if limit is not None:
+            request.query_budget = limit
+
+
+class QueryBudgetMixin:
+    """Для TestCase: assertQueryBudget проверяет бюджет и N+1.
+
+        with self.assertQueryBudget(5):
+            self.client.get(url)
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, budget=None, repeat_limit=None,
+                          unbudgeted_limit=None):
+        with record(trace=True) as log:
+            yield log
+        problems = log.problems(budget, repeat_limit, unbudgeted_limit)
+        if problems:
+            self.fail('\n'.join(problems))
@@ -0,0 +1,162 @@
+"""Чтение лент с реплик базы.
+
+Представления с декоратором replica_reads читают из одной из баз
+settings.DATABASE_REPLICAS, все записи идут в default. Реплика
+отстает от основной базы, поэтому пользователь, который только что
+что-то записал (пост, комментарий, подписку, вход), должен видеть
+свои изменения: после записи ответ ставит cookie, и пока она жива
+(REPLICA_STICKY_SECONDS), все чтения этого пользователя идут
+в default. Чтения после записи в том же запросе - тоже. Попутные
+записи GET-запросов (REPLICA_SIDE_EFFECT_MODELS) cookie не ставят,
+а перечитываются из default только сами записанные модели.
+Пользователи, сессии и типы содержимого всегда читаются из default.
+
+Фрагменты кеша, собранные по реплике, помечаются поколением реплик
+(см. posts.cache_versions): иначе отстающая реплика записала бы старую
+страницу под новой версией, и ее увидел бы и автор изменений.
+Команда sync_replicas после копирования увеличивает поколение.
+
+Локально реплики - копии db.sqlite3, которые делает sync_replicas.
+Без реплик роутер все отправляет в default.
+"""
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .db import configure
+
+DEFAULT_STICKY_SECONDS = 10
+DEFAULT_STICKY_COOKIE = 'use_primary'
+EPOCH_KEY = 'replicas:epoch'
+# Приложения, которые всегда читаются из default: сессию и пользователя,
+# только что вошедшего или зарегистрированного, реплика может не знать
+PRIMARY_APPS = {'auth', 'sessions', 'contenttypes'}
+# Модели, которые GET-запросы пишут попутно (счетчики пользователя
+# при первом чтении, хранилище миниатюр sorl): такая запись не повод
+# отправлять все чтения пользователя в default
+DEFAULT_SIDE_EFFECT_MODELS = ['posts.UserStats', 'thumbnail.KVStore']
+
+_state = threading.local()
+
+
+def replica_reads(view):
+    """Декоратор: представлению можно читать с реплики."""
+    view.replica_reads = True
+    return view
+
+
+def _replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def current_replica():
+    """Реплика, с которой сейчас читает запрос, или None."""
+    if getattr(_state, 'primary', False):
+        return None
+    return getattr(_state, 'replica', None)
+
+
+def bump_epoch():
+    try:
+        cache.incr(EPOCH_KEY)
+    except ValueError:
+        cache.set(EPOCH_KEY, 1, timeout=None)
+
+
+def copy_database(source, targets):
+    """Копирует файл SQLite source во все targets через backup API:
+    копия согласована, даже пока в основную базу пишут, а читатели
+    реплики на время копирования ждут busy_timeout, а не падают."""
+    source = sqlite3.connect(source)
+    try:
+        for name in targets:
+            target = sqlite3.connect(name)
+            try:
+                configure(target.cursor())
+                source.backup(target)
+            finally:
+                target.close()
+    finally:
+        source.close()
+
+
+def _written():
+    """Модели, записанные в этом запросе."""
+    if not hasattr(_state, 'written'):
+        _state.written = set()
+    return _state.written
+
+
+def _side_effect_models():
+    return getattr(
+        settings, 'REPLICA_SIDE_EFFECT_MODELS', DEFAULT_SIDE_EFFECT_MODELS
+    )
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if (model._meta.app_label in PRIMARY_APPS
+                or model._meta.label in _written()):
+            return DEFAULT_DB_ALIAS
+        # None - решают следующие роутеры, а по умолчанию это default
+        return current_replica()
+
+    def db_for_write(self, model, **hints):
+        # Дальше в этом запросе читаем свою запись из default
+        _written().add(model._meta.label)
+        if model._meta.label not in _side_effect_models():
+            # Чтения всех моделей тоже: они могут ссылаться на запись
+            _state.primary = True
+            _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии default, объекты из них можно связывать
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in _replicas()
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        cookie = getattr(
+            settings, 'REPLICA_STICKY_COOKIE', DEFAULT_STICKY_COOKIE
+        )
+        sticky_until = request.COOKIES.get(cookie, '')
+        _state.primary = (
+            sticky_until.isdigit() and int(sticky_until) > time.time()
+        )
+        _state.replica = None
+        _state.wrote = False
+        _state.written = set()
+        try:
+            response = self.get_response(request)
+            if _state.wrote:
+                seconds = getattr(
+                    settings, 'REPLICA_STICKY_SECONDS',
+                    DEFAULT_STICKY_SECONDS
+                )
+                response.set_cookie(
+                    cookie, str(int(time.time() + seconds)),
+                    max_age=seconds, httponly=True, samesite='Lax',
+                )
+        finally:
+            _state.primary = _state.wrote = False
+            _state.replica = None
+            _state.written = set()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replicas = _replicas()
+        if replicas and getattr(view_func, 'replica_reads', False):
+            # Одна реплика на весь запрос: у копий разное отставание
+            _state.replica = random.choice(replicas)
@@ -0,0 +1,244 @@
+"""Журнал медленных запросов к базе.
+
+Обертка execute_wrapper ставится на каждое новое соединение, поэтому
+видит запросы страниц, задач jobs и команд. Запрос дольше
+SLOW_QUERY_THRESHOLD секунд пишется строкой JSON в журнал процесса
+рядом с SLOW_QUERY_LOG: logs/slow_queries-<pid>.log. Ротация
+RotatingFileHandler не переживает несколько процессов, пишущих в один
+файл, поэтому у каждого воркера свой файл, который ротируется по
+SLOW_QUERY_LOG_MAX_BYTES:
+
+    {"time": "...", "duration": 0.183, "database": "default",
+     "view": "posts:follow_index", "location": "posts/views.py:follow_index",
+     "template": "posts/follow.html:12", "sql": "SELECT ... WHERE id IN
+     (%s, %s)", "params": "(int×2)", "many": false}
+
+Значения параметров не пишутся - только их типы. location - первый
+кадр кода приложений (не Django и не core), template - строка шаблона,
+если запрос сделан во время рендера. Имя страницы ставит
+SlowQueryMiddleware.
+
+Команда slow_queries собирает из журналов всех процессов отчет:
+формы запросов по суммарному времени.
+"""
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+
+from .query_budget import normalize, template_line
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+# Код, который не считается местом запроса: инструментация в core
+# и пакеты из виртуального окружения внутри проекта
+_CORE = os.path.join('core', '')
+_PACKAGES = ('site-packages', 'dist-packages')
+
+_state = threading.local()
+_handler_lock = threading.Lock()
+_handler = None
+
+
+def log_path():
+    return getattr(settings, 'SLOW_QUERY_LOG', None) or os.path.join(
+        settings.BASE_DIR, 'logs', 'slow_queries.log'
+    )
+
+
+def process_log_path(pid=None):
+    """Журнал процесса: slow_queries.log -> slow_queries-<pid>.log."""
+    root, ext = os.path.splitext(log_path())
+    return f'{root}-{pid or os.getpid()}{ext}'
+
+
+def _ensure_handler():
+    """Файловый обработчик журнала текущего процесса. После fork
+    у дочернего процесса другой pid, и он открывает свой файл."""
+    global _handler
+    path = os.path.abspath(process_log_path())
+    if _handler is not None and _handler.baseFilename == path:
+        return
+    with _handler_lock:
+        if _handler is not None:
+            if _handler.baseFilename == path:
+                return
+            logger.removeHandler(_handler)
+            _handler.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _handler = RotatingFileHandler(
+            path,
+            maxBytes=getattr(
+                settings, 'SLOW_QUERY_LOG_MAX_BYTES', DEFAULT_MAX_BYTES
+            ),
+            backupCount=getattr(
+                settings, 'SLOW_QUERY_LOG_BACKUPS', DEFAULT_BACKUPS
+            ),
+            encoding='utf-8',
+            delay=True,
+        )
+        logger.addHandler(_handler)
+
+
+def close():
+    """Закрывает файл журнала, следующая запись откроет его заново:
+    после удаления файлов старый обработчик писал бы в удаленный."""
+    global _handler
+    with _handler_lock:
+        if _handler is not None:
+            logger.removeHandler(_handler)
+            _handler.close()
+            _handler = None
+
+
+def param_shape(params, many=False):
+    """Типы параметров без значений: (int, str×3), для executemany -
+    число наборов и форма первого."""
+    if many:
+        # Итератор к этому моменту уже прочитан execute
+        if not isinstance(params, (list, tuple)):
+            return '?×()'
+        first = param_shape(params[0]) if params else '()'
+        return f'{len(params)}×{first}'
+    if params is None:
+        return '()'
+    if isinstance(params, dict):
+        return '{' + ', '.join(
+            f'{name}: {type(value).__name__}'
+            for name, value in params.items()
+        ) + '}'
+    groups = []
+    for value in params:
+        name = type(value).__name__
+        if groups and groups[-1][0] == name:
+            groups[-1][1] += 1
+        else:
+            groups.append([name, 1])
+    return '(' + ', '.join(
+        name if number == 1 else f'{name}×{number}'
+        for name, number in groups
+    ) + ')'
+
+
+def app_location():
+    """Первый кадр кода приложений: posts/views.py:profile."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(settings.BASE_DIR):
+            relative = os.path.relpath(filename, settings.BASE_DIR)
+            if not relative.startswith(_CORE) and not any(
+                    name in relative for name in _PACKAGES):
+                return f'{relative}:{frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+def _view():
+    request = getattr(_state, 'request', None)
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else None
+
+
+def log_slow_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        threshold = getattr(
+            settings, 'SLOW_QUERY_THRESHOLD', DEFAULT_THRESHOLD
+        )
+        if threshold is not None and duration >= threshold:
+            _write(sql, params, many, context, duration)
+
+
+def _write(sql, params, many, context, duration):
+    _ensure_handler()
+    logger.info(json.dumps({
+        'time': datetime.now(timezone.utc).isoformat(),
+        'duration': round(duration, 6),
+        'database': context['connection'].alias,
+        'view': _view(),
+        'location': app_location(),
+        'template': template_line(),
+        'sql': sql,
+        'params': param_shape(params, many),
+        'many': many,
+    }, ensure_ascii=False))
+
+
+def log_files(path=None):
+    """Журналы всех процессов и их ротированные копии, старые первыми."""
+    root, ext = os.path.splitext(path or log_path())
+    pattern = f'{glob.escape(root)}-*{glob.escape(ext)}'
+    names = glob.glob(pattern) + [
+        # RotatingFileHandler: .1, .2 и т.д. - старые копии
+        name for name in glob.glob(f'{pattern}.*')
+        if name.rsplit('.', 1)[1].isdigit()
+    ]
+    return sorted(names, key=os.path.getmtime)
+
+
+def report(paths):
+    """Формы запросов из журналов по убыванию суммарного времени."""
+    shapes = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                    shape = normalize(entry['sql'])
+                    duration = float(entry['duration'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                stats = shapes.setdefault(shape, {
+                    'shape': shape,
+                    'count': 0,
+                    'total': 0.0,
+                    'max': 0.0,
+                    'locations': Counter(),
+                    'views': Counter(),
+                    'params': Counter(),
+                })
+                stats['count'] += 1
+                stats['total'] += duration
+                stats['max'] = max(stats['max'], duration)
+                stats['locations'][entry.get('location')] += 1
+                stats['views'][entry.get('view')] += 1
+                stats['params'][entry.get('params')] += 1
+    return sorted(shapes.values(), key=lambda stats: -stats['total'])
+
+
+def install(sender, connection, **kwargs):
+    """Для сигнала connection_created: обертка на все запросы соединения.
+    Ставится первой в списке: execute_wrapper() других модулей снимают
+    свои обертки с конца."""
+    if log_slow_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, log_slow_query)
+
+
+class SlowQueryMiddleware:
+    """Запоминает запрос потока, чтобы записать в журнал имя страницы."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.request = request
+        try:
+            return self.get_response(request)
+        finally:
+            _state.request = None
@@ -0,0 +1,70 @@
+"""Хранилище статики: имена с хешем содержимого и сжатые копии.
+
+collectstatic записывает файлы под именами вида bootstrap.3f2a1c.css
+и staticfiles.json с соответствием имен, а рядом с каждым текстовым
+файлом - сжатые копии .gz и, если установлен пакет brotli, .br.
+Файлы с хешем в имени не меняются, поэтому core.views.serve_static
+отдает их с Cache-Control immutable, выбирая сжатую копию по
+Accept-Encoding.
+"""
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    # brotli необязателен: без него пишутся только .gz
+    brotli = None
+
+COMPRESSIBLE = (
+    '.css', '.js', '.svg', '.txt', '.html', '.json', '.map', '.xml', '.ico',
+)
+# Файлы меньше этого не сжимаем: выигрыш меньше заголовков
+MIN_SIZE = 256
+
+
+def compress(path):
+    """Пишет path.gz и path.br, если они меньше исходного файла.
+    Возвращает пути записанных копий."""
+    with open(path, 'rb') as source:
+        data = source.read()
+    if len(data) < MIN_SIZE:
+        return []
+    # mtime=0 - одинаковый файл при каждом collectstatic
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data)
+    written = []
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as target:
+                target.write(compressed)
+            written.append(path + suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # collectstatic еще не запускали (разработка, тесты) или
+            # файла нет: ссылка без хеша вместо ошибки рендера страницы
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        processed_files = super().post_process(paths, dry_run, **options)
+        for name, hashed_name, processed in processed_files:
+            yield name, hashed_name, processed
+            if isinstance(processed, Exception):
+                continue
+            names.add(name)
+            if hashed_name:
+                names.add(hashed_name)
+        if dry_run:
+            return
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE):
+                compress(self.path(name))
@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+from copy import deepcopy
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Переносит файловые кеши во временную папку на время тестов,
+    чтобы тесты не читали фрагменты рабочего кеша и не чистили его.
+    Счетчики метрик, профили и журнал медленных запросов тоже пишутся
+    во временную папку.
+    Превышение бюджета запросов в тестах - ошибка, а не предупреждение."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_dir = tempfile.mkdtemp()
+        caches = deepcopy(settings.CACHES)
+        for alias, config in caches.items():
+            if config.get('LOCATION') and 'locmem' not in config['BACKEND']:
+                config['LOCATION'] = os.path.join(
+                    self._cache_dir, alias, os.path.basename(
+                        config['LOCATION']
+                    )
+                )
+        self._caches_override = override_settings(
+            CACHES=caches,
+            METRICS_DIR=os.path.join(self._cache_dir, 'metrics'),
+            PROFILER_DIR=os.path.join(self._cache_dir, 'profiles'),
+            SLOW_QUERY_LOG=os.path.join(
+                self._cache_dir, 'logs', 'slow_queries.log'
+            ),
+            QUERY_BUDGET_RAISE=True,
+        )
+        self._caches_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches_override.disable()
+        shutil.rmtree(self._cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
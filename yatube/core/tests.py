@@ -0,0 +1,717 @@
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Permission
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, router
+from django.http import HttpResponse
+from django.template import engines
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.urls import reverse
+
+from posts.models import Group, Post, UserStats
+
+from . import slow_queries
+from .cache.sqlite import SQLiteCache
+from .compression import minify
+from .db import configure, pragmas
+from .metrics import registry
+from .profiler import ProfilerMiddleware, profiles, window_until
+from .replicas import (ReplicaMiddleware, bump_epoch, copy_database,
+                       replica_reads)
+from .management.commands.benchmark_sqlite import SCHEMA, _worker
+from .query_budget import QueryBudgetMixin, normalize, record, unbudgeted
+from .slow_queries import log_files, param_shape, process_log_path
+from .storage import MIN_SIZE
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(
+            self.location, {'OPTIONS': {'MAX_ENTRIES': 10}}
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_values_are_shared_between_instances(self):
+        """Запись видна другому экземпляру кеша на том же файле"""
+        self.cache.set_many({'a': {'x': 1}, 'b': 'текст'})
+        other = SQLiteCache(self.location, {})
+        self.assertEqual(
+            other.get_many(['a', 'b', 'c']), {'a': {'x': 1}, 'b': 'текст'}
+        )
+        self.assertFalse(other.add('a', 'новое'))
+        self.cache.set('expired', 1, timeout=0)
+        self.assertIsNone(other.get('expired'))
+        self.assertTrue(other.add('expired', 2))
+
+    def test_incr_is_atomic(self):
+        """incr из нескольких потоков не теряет обновлений"""
+        self.cache.set('counter', 0)
+
+        def work():
+            for _ in range(50):
+                self.cache.incr('counter')
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_least_recently_used_entries_are_culled(self):
+        """При переполнении вытесняются давно не читанные записи"""
+        self.cache.set('keep', 'значение')
+        self.cache._db.execute(
+            "UPDATE cache_entry SET accessed = accessed + 3600 "
+            "WHERE key = ?", (self.cache.make_key('keep'),)
+        )
+        for number in range(20):
+            self.cache.set(f'key{number}', number)
+        self.assertEqual(self.cache.get('keep'), 'значение')
+        self.assertLessEqual(
+            self.cache._db.execute(
+                'SELECT COUNT(*) FROM cache_entry'
+            ).fetchone()[0],
+            10,
+        )
+
+    def test_size_is_not_counted_on_every_write(self):
+        """COUNT(*) выполняется раз в MAX_ENTRIES / 100 записей"""
+        cache = SQLiteCache(self.location, {'OPTIONS': {'MAX_ENTRIES': 1000}})
+        statements = []
+        cache._db.set_trace_callback(statements.append)
+        for number in range(50):
+            cache.set(f'key{number}', number)
+        counts = [sql for sql in statements if 'COUNT(*)' in sql]
+        self.assertEqual(len(counts), 5)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    def test_normalize_ignores_literals_and_in_lists(self):
+        """Запросы с разными значениями имеют одну форму"""
+        self.assertEqual(
+            normalize("SELECT * FROM t WHERE a = 1 AND b IN (%s, %s)"),
+            normalize("SELECT * FROM t WHERE a = 25 AND b IN (%s)"),
+        )
+        self.assertEqual(
+            normalize("SELECT 'x' FROM t"), normalize("SELECT 'y' FROM t")
+        )
+
+    def test_repeated_queries_point_to_template_line(self):
+        """N+1 из шаблона находится вместе со строкой шаблона"""
+        template = engines['django'].from_string(
+            '{% for perm in perms %}\n'
+            '{{ perm.content_type.model }}\n'
+            '{% endfor %}'
+        )
+        perms = Permission.objects.all()[:6]
+        with record() as log:
+            template.render({'perms': perms})
+        [(shape, count, location)] = log.repeated(limit=6)
+        self.assertEqual(count, 6)
+        self.assertIn('django_content_type', shape)
+        self.assertTrue(location.endswith(':2'))
+        with self.assertRaises(AssertionError):
+            with self.assertQueryBudget(3):
+                template.render({'perms': Permission.objects.all()[:6]})
+
+    def test_without_trace_only_repeats_walk_the_stack(self):
+        """В рабочем режиме стек обходится только для повторов"""
+        template = engines['django'].from_string(
+            '{% for perm in perms %}\n'
+            '{{ perm.content_type.model }}\n'
+            '{% endfor %}'
+        )
+        perms = Permission.objects.all()[:6]
+        with record(trace=False) as log:
+            template.render({'perms': perms})
+        [(shape, count, location)] = log.repeated(limit=5)
+        self.assertEqual(count, 6)
+        self.assertTrue(location.endswith(':2'))
+        # Повторы с пятого по шестой, а не все семь запросов
+        traced = sum(sum(found.values()) for found in log.locations.values())
+        self.assertEqual(traced, 2)
+
+    def test_unbudgeted_queries_have_their_own_limit(self):
+        """unbudgeted() не учитывается в бюджете, но не бесконечен"""
+        with record() as log:
+            with unbudgeted():
+                for _ in range(3):
+                    Permission.objects.count()
+        self.assertEqual(len(log), 0)
+        self.assertEqual(log.problems(unbudgeted_limit=3), [])
+        self.assertEqual(len(log.problems(unbudgeted_limit=2)), 1)
+
+
+class SQLitePragmasTests(SimpleTestCase):
+    databases = {'default'}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'db.sqlite3')
+        db = sqlite3.connect(self.path)
+        for statement in SCHEMA:
+            db.execute(statement)
+        db.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def connect(self, values):
+        db = sqlite3.connect(self.path, isolation_level=None, timeout=0)
+        if values:
+            configure(db.cursor(), values)
+        self.addCleanup(db.close)
+        return db
+
+    def test_django_connections_are_configured(self):
+        """Соединения Django открываются с прагмами из core.db"""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(
+                cursor.fetchone()[0], pragmas()['busy_timeout']
+            )
+
+    def test_readers_are_not_blocked_by_writer_in_wal(self):
+        """В WAL чтение идет во время чужой записи, без WAL - ошибка"""
+        for values, blocked in (({}, True), (pragmas(), False)):
+            with self.subTest(wal=not blocked):
+                writer = self.connect(values)
+                reader = self.connect(values)
+                writer.execute('BEGIN EXCLUSIVE')
+                writer.execute(
+                    "INSERT INTO post (author_id, text, pub_date) "
+                    "VALUES (1, 'текст', 0)"
+                )
+                if blocked:
+                    with self.assertRaises(sqlite3.OperationalError):
+                        reader.execute('SELECT COUNT(*) FROM post').fetchone()
+                else:
+                    self.assertEqual(reader.execute(
+                        'SELECT COUNT(*) FROM post'
+                    ).fetchone(), (0,))
+                writer.execute('ROLLBACK')
+
+    def test_threads_read_and_write_without_lock_errors(self):
+        """Несколько потоков читают и пишут без "database is locked\""""
+        result = []
+        threads = [
+            threading.Thread(
+                target=_worker,
+                args=(self.path, pragmas(), 0.3, 0.3, seed, result),
+            )
+            for seed in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        reads, writes, errors = map(sum, zip(*result))
+        self.assertGreater(reads, 0)
+        self.assertGreater(writes, 0)
+        self.assertEqual(errors, 0)
+
+    def test_benchmark_readers_run_during_open_write_transaction(self):
+        """Потоки бенчмарка читают, пока открыта чужая транзакция
+        записи: в WAL - без ошибок, с журналом отката - ни одного чтения"""
+        # Без ожидания блокировки: заблокированное чтение сразу ошибка
+        no_wait = {'busy_timeout': 0}
+        for values, blocked in (
+            (no_wait, True), ({**pragmas(), **no_wait}, False),
+        ):
+            with self.subTest(wal=not blocked):
+                writer = self.connect(values)
+                writer.execute('BEGIN EXCLUSIVE')
+                writer.execute(
+                    "INSERT INTO post (author_id, text, pub_date) "
+                    "VALUES (1, 'текст', 0)"
+                )
+                result = []
+                threads = [
+                    threading.Thread(
+                        target=_worker,
+                        args=(self.path, values, 0.1, 0, seed, result),
+                    )
+                    for seed in range(4)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                writer.execute('ROLLBACK')
+                reads, writes, errors = map(sum, zip(*result))
+                if blocked:
+                    self.assertEqual(reads, 0)
+                    self.assertGreater(errors, 0)
+                else:
+                    self.assertGreater(reads, 0)
+                    self.assertEqual(errors, 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def call(self, view, cookies=None):
+        """Прогоняет view через ReplicaMiddleware, возвращает ответ
+        и базы, из которых view читал бы до и после своих записей."""
+        reads = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request, reads)
+
+        middleware = ReplicaMiddleware(get_response)
+        request = self.factory.get('/')
+        request.COOKIES.update(cookies or {})
+        return middleware(request), reads
+
+    @staticmethod
+    def reader(request, reads):
+        reads.append(router.db_for_read(Group))
+        return HttpResponse()
+
+    @staticmethod
+    def writer(request, reads):
+        reads.append(router.db_for_read(Group))
+        router.db_for_write(Group)
+        reads.append(router.db_for_read(Group))
+        return HttpResponse()
+
+    def test_only_marked_views_read_from_replica(self):
+        """С реплики читают только представления с replica_reads"""
+        _, reads = self.call(self.reader)
+        self.assertEqual(reads, ['default'])
+        _, reads = self.call(replica_reads(self.reader))
+        self.assertEqual(reads, ['replica1'])
+        # После запроса состояние сброшено
+        self.assertEqual(router.db_for_read(Group), 'default')
+
+    def test_reads_stick_to_primary_after_write(self):
+        """После записи чтения идут в default, в том числе
+        в следующих запросах, пока жива cookie"""
+        response, reads = self.call(replica_reads(self.writer))
+        self.assertEqual(reads, ['replica1', 'default'])
+        cookie = response.cookies['use_primary']
+        self.assertEqual(cookie['max-age'], 10)
+        _, reads = self.call(
+            replica_reads(self.reader), {'use_primary': cookie.value}
+        )
+        self.assertEqual(reads, ['default'])
+        _, reads = self.call(
+            replica_reads(self.reader), {'use_primary': '1'}
+        )
+        self.assertEqual(reads, ['replica1'])
+
+    def test_auth_reads_and_side_effect_writes(self):
+        """Пользователи и сессии читаются из default, а попутная
+        запись GET-запроса не ставит cookie"""
+        def view(request, reads):
+            reads.append(router.db_for_read(Permission))
+            reads.append(router.db_for_read(Session))
+            router.db_for_write(UserStats)
+            reads.append(router.db_for_read(UserStats))
+            reads.append(router.db_for_read(Group))
+            return HttpResponse()
+
+        response, reads = self.call(replica_reads(view))
+        self.assertEqual(reads, ['default', 'default', 'default', 'replica1'])
+        self.assertNotIn('use_primary', response.cookies)
+
+    def test_replica_fragments_are_keyed_by_epoch(self):
+        """Версии фрагментов по реплике отличаются от версий по default
+        и меняются после синхронизации реплик"""
+        from posts import cache_versions
+
+        def versions(request, reads):
+            reads.append(cache_versions.get_version('global'))
+            return HttpResponse()
+
+        _, [primary] = self.call(versions)
+        _, [replica] = self.call(replica_reads(versions))
+        self.assertEqual(replica, f'{primary}:replica1:0')
+        bump_epoch()
+        _, [replica] = self.call(replica_reads(versions))
+        self.assertEqual(replica, f'{primary}:replica1:1')
+
+
+class CopyDatabaseTests(SimpleTestCase):
+    def test_copies_primary_into_replicas(self):
+        """Реплики - согласованные копии файла основной базы"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        primary = os.path.join(directory, 'db.sqlite3')
+        db = sqlite3.connect(primary)
+        db.execute('CREATE TABLE post (text TEXT)')
+        db.execute("INSERT INTO post VALUES ('пост')")
+        db.commit()
+        db.close()
+        names = [os.path.join(directory, f'r{i}.sqlite3') for i in (1, 2)]
+        copy_database(primary, names)
+        for name in names:
+            copy = sqlite3.connect(name)
+            self.assertEqual(
+                copy.execute('SELECT text FROM post').fetchall(), [('пост',)]
+            )
+            copy.close()
+
+
+class StaticPipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        source = os.path.join(self.directory, 'source')
+        os.makedirs(os.path.join(source, 'css'))
+        with open(os.path.join(source, 'css', 'site.css'), 'w') as file:
+            file.write('body { color: black; }\n' * MIN_SIZE)
+        settings = override_settings(
+            STATICFILES_DIRS=[source],
+            STATIC_ROOT=os.path.join(self.directory, 'root'),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def collect(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        """collectstatic пишет имя с хешем и сжатую копию"""
+        self.collect()
+        hashed = staticfiles_storage.stored_name('css/site.css')
+        self.assertNotEqual(hashed, 'css/site.css')
+        with gzip.open(staticfiles_storage.path(hashed) + '.gz') as file:
+            self.assertIn(b'color: black', file.read())
+
+    def test_missing_manifest_falls_back_to_plain_name(self):
+        """Без collectstatic ссылки ведут на файлы без хеша"""
+        template = engines['django'].from_string(
+            "{% load static %}{% static 'css/site.css' %}"
+        )
+        self.assertEqual(template.render(), '/static/css/site.css')
+
+    def test_serve_static_sends_compressed_immutable_file(self):
+        """Файл с хешем отдается сжатым и с вечным кешем"""
+        self.collect()
+        hashed = staticfiles_storage.stored_name('css/site.css')
+        response = self.client.get(
+            f'/static/{hashed}', HTTP_ACCEPT_ENCODING='gzip, deflate'
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertIn(b'color: black', body)
+        plain = self.client.get('/static/css/site.css')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertNotIn('immutable', plain['Cache-Control'])
+        response = self.client.get(
+            f'/static/{hashed}',
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(
+            self.client.get('/static/css/missing.css').status_code, 404
+        )
+
+
+class HtmlCompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_minify(self):
+        """Комментарии и серии пробелов убираются, pre и script - нет"""
+        html = (
+            '<!DOCTYPE html> <!-- комментарий -->\n\n  <p>  текст\n\n'
+            '  еще</p>\n<pre>  как   есть </pre><script>\n'
+            '// строка\nvar a;</script>'
+        )
+        self.assertEqual(
+            minify(html),
+            '<!DOCTYPE html>\n<p> текст\nеще</p>\n<pre>  как   есть </pre>'
+            '<script>\n// строка\nvar a;</script>'
+        )
+
+    def test_page_is_minified_compressed_and_cached(self):
+        """Страница уходит сжатой, повторная - из кеша по хешу тела"""
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        html = gzip.decompress(response.content).decode()
+        self.assertNotIn('<!--', html)
+        self.assertIn('</body>', html)
+        self.assertIn('html-bytes', response['Server-Timing'])
+        again = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertIn('html-cache', again['Server-Timing'])
+        self.assertEqual(again.content, response.content)
+
+    def test_personal_pages_are_not_cached(self):
+        """Страницы с сессией или токеном CSRF в кеш не попадают"""
+        user = get_user_model().objects.create_user(username='user')
+        self.client.force_login(user)
+        for url in ('/', reverse('posts:post_create')):
+            with self.subTest(url=url):
+                for _ in range(2):
+                    response = self.client.get(
+                        url, HTTP_ACCEPT_ENCODING='gzip'
+                    )
+                    self.assertEqual(response['Content-Encoding'], 'gzip')
+                    self.assertNotIn(
+                        'html-cache', response['Server-Timing']
+                    )
+
+    def test_plain_client_gets_minified_html(self):
+        """Без Accept-Encoding страница только минифицируется"""
+        response = self.client.get('/')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertNotContains(response, '<!--')
+        self.assertEqual(
+            int(response['Content-Length']), len(response.content)
+        )
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.staff = get_user_model().objects.create_user(
+            username='staff', is_staff=True
+        )
+
+    def test_metrics_are_protected(self):
+        """/metrics - только сотрудникам и по токену"""
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get(
+                '/metrics', HTTP_AUTHORIZATION='Bearer secret'
+            )
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(
+                '/metrics', HTTP_AUTHORIZATION='Bearer wrong'
+            )
+            self.assertEqual(response.status_code, 403)
+            response = self.client.get(
+                '/metrics', HTTP_AUTHORIZATION='Bearer секрет'
+            )
+            self.assertEqual(response.status_code, 403)
+
+    def test_requests_are_recorded_per_view(self):
+        """Ответы считаются по имени URL вместе с запросами и шаблонами"""
+        self.client.get('/')
+        self.client.get('/group/missing/')
+        self.client.force_login(self.staff)
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn(
+            'yatube_request_duration_seconds_count{view="posts:index"} 1',
+            text
+        )
+        self.assertIn(
+            'yatube_request_duration_seconds_bucket'
+            '{view="posts:index",le="+Inf"} 1',
+            text
+        )
+        self.assertIn(
+            'yatube_responses_total{view="posts:group_posts",status="404"} 1',
+            text
+        )
+        stats = registry.snapshot()['posts:index']
+        self.assertGreater(stats['queries'], 0)
+        self.assertGreater(stats['template_seconds'], 0)
+
+    def test_workers_are_summed(self):
+        """Счетчики других воркеров берутся из их файлов"""
+        registry.observe('posts:index', 200, 0.02)
+        registry.flush()
+        path = registry.path()
+        other = os.path.join(os.path.dirname(path), 'metrics-0.json')
+        shutil.copy(path, other)
+        self.addCleanup(os.remove, other)
+        with open(other) as file:
+            self.assertEqual(json.load(file)['posts:index']['count'], 1)
+        registry.observe('posts:index', 500, 3)
+        stats = registry.collect()['posts:index']
+        self.assertEqual(stats['count'], 3)
+        self.assertEqual(stats['statuses'], {'200': 2, '500': 1})
+
+    def test_concurrent_flushes_do_not_fail(self):
+        """Потоки сохраняют счетчики одновременно без ошибок"""
+        registry.observe('posts:index', 200, 0.02)
+        errors = []
+
+        def flush():
+            for _ in range(20):
+                try:
+                    registry.flush()
+                except OSError as error:
+                    errors.append(error)
+
+        threads = [threading.Thread(target=flush) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        with open(registry.path()) as file:
+            self.assertEqual(json.load(file)['posts:index']['count'], 1)
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0)
+    def test_flush_error_does_not_break_response(self):
+        """Ошибка записи метрик попадает в лог, а не в ответ"""
+        with mock.patch('core.metrics.os.replace', side_effect=OSError):
+            with self.assertLogs('core.metrics', 'ERROR'):
+                response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([
+            name for name in os.listdir(os.path.dirname(registry.path()))
+            if name.endswith('.tmp')
+        ])
+
+
+def _busy(request):
+    started = time.monotonic()
+    while time.monotonic() - started < 0.1:
+        pass
+    return HttpResponse()
+
+
+@override_settings(PROFILER_INTERVAL=0.001)
+class ProfilerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = get_user_model().objects.create_user(
+            username='staff', is_staff=True
+        )
+        self.factory = RequestFactory()
+
+    def test_header_profiles_one_request(self):
+        """X-Profile сотрудника пишет collapsed stacks ответа"""
+        middleware = ProfilerMiddleware(_busy)
+        request = self.factory.get('/', HTTP_X_PROFILE='1')
+        request.user = self.staff
+        name = middleware(request)['X-Profile']
+        profile = next(item for item in profiles() if item['name'] == name)
+        self.assertEqual(profile['view'], 'unresolved')
+        self.assertGreater(profile['samples'], 10)
+        self.client.force_login(self.staff)
+        folded = self.client.get(
+            reverse('profile_download', args=[name])
+        ).content.decode()
+        stack, samples = folded.splitlines()[0].rsplit(' ', 1)
+        self.assertTrue(stack.endswith('core/tests.py:_busy'))
+        self.assertGreater(int(samples), 0)
+
+    def test_header_needs_staff_or_token(self):
+        """Чужой X-Profile не включает профилирование"""
+        request = self.factory.get('/', HTTP_X_PROFILE='1')
+        request.user = AnonymousUser()
+        self.assertNotIn('X-Profile', ProfilerMiddleware(_busy)(request))
+        with override_settings(PROFILER_TOKEN='secret'):
+            request = self.factory.get('/', HTTP_X_PROFILE='secret')
+            request.user = AnonymousUser()
+            self.assertIn('X-Profile', ProfilerMiddleware(_busy)(request))
+            request = self.factory.get('/', HTTP_X_PROFILE='секрет')
+            request.user = AnonymousUser()
+            self.assertNotIn('X-Profile', ProfilerMiddleware(_busy)(request))
+
+    def test_admin_page_toggles_window(self):
+        """Окно включается и выключается со страницы профилей"""
+        url = reverse('profiles')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.staff)
+        self.client.post(url, {'minutes': 5})
+        self.assertGreater(window_until(), time.time())
+        self.assertContains(self.client.get(url), 'Выключить')
+        self.client.post(url, {'minutes': 0})
+        self.assertEqual(window_until(), 0)
+
+
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        slow_queries.close()
+        for path in log_files():
+            os.remove(path)
+
+    def test_param_shape(self):
+        """В журнал попадают типы параметров, а не значения"""
+        self.assertEqual(param_shape([1, 2, 3, 'a', None]),
+                         '(int×3, str, NoneType)')
+        self.assertEqual(param_shape(None), '()')
+        self.assertEqual(param_shape([(1, 'a'), (2, 'b')], many=True),
+                         '2×(int, str)')
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_queries_are_logged_with_view_and_location(self):
+        """Запись знает страницу и место в коде приложения"""
+        author = get_user_model().objects.create_user(username='author')
+        Post.objects.create(author=author, text='Пост')
+        self.client.get(reverse('posts:profile', args=[author.username]))
+        with open(log_files()[-1], encoding='utf-8') as file:
+            entries = [json.loads(line) for line in file]
+        entry = next(
+            entry for entry in entries
+            if entry['view'] == 'posts:profile'
+            and entry['location'] == 'posts/views.py:profile'
+        )
+        self.assertIn('%s', entry['sql'])
+        self.assertEqual(entry['params'], '(str)')
+        output = StringIO()
+        call_command('slow_queries', '--limit', '50', stdout=output)
+        self.assertIn('posts/views.py:profile', output.getvalue())
+        self.assertIn('posts:profile', output.getvalue())
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_each_process_writes_its_own_file(self):
+        """У процесса свой журнал, отчет читает журналы всех процессов"""
+        get_user_model().objects.count()
+        [own] = log_files()
+        self.assertTrue(own.endswith(f'-{os.getpid()}.log'))
+        other = process_log_path(pid=1)
+        shutil.copy(own, other)
+        self.addCleanup(os.remove, other)
+        self.assertEqual(sorted(log_files()), sorted([own, other]))
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_response_phase_queries_know_the_view(self):
+        """Запросы middleware после представления тоже с именем страницы"""
+        user = get_user_model().objects.create_user(username='user')
+        self.client.force_login(user)
+        session = self.client.session
+        session['touched'] = True
+        session.save()
+        slow_queries.close()
+        for path in log_files():
+            os.remove(path)
+        with self.settings(SESSION_SAVE_EVERY_REQUEST=True):
+            self.client.get(reverse('posts:index'))
+        with open(log_files()[-1], encoding='utf-8') as file:
+            entries = [json.loads(line) for line in file]
+        updates = [
+            entry for entry in entries
+            if entry['sql'].startswith('UPDATE "django_session"')
+        ]
+        self.assertTrue(updates)
+        self.assertEqual(
+            {entry['view'] for entry in updates}, {'posts:index'}
+        )
@@ -0,0 +1,12 @@
+"""Проверка секретных токенов из заголовков запроса."""
+import hmac
+
+
+def token_matches(value, token):
+    """Совпадает ли значение заголовка с токеном. Сравнение за
+    постоянное время и по байтам: compare_digest со строками не ASCII
+    бросает TypeError, а заголовок присылает клиент. Пустой токен
+    не совпадает ни с чем."""
+    if not token or value is None:
+        return False
+    return hmac.compare_digest(value.encode(), token.encode())
@@ -1,4 +1,31 @@
-from django.shortcuts import render
+import mimetypes
+import os
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified)
+from django.shortcuts import redirect, render
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+from . import profiler
+
+# Файлы с хешем в имени не меняются: год без перепроверки
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Файлы без хеша могут измениться при следующем collectstatic
+REVALIDATE = 'public, max-age=60'
+# Сжатые копии, которые пишет core.storage, в порядке предпочтения
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Самое долгое окно профилирования, минуты
+DEFAULT_PROFILER_MAX_WINDOW = 60
 
 
 def page_not_found(request, exception):
@@ -17,3 +44,100 @@ def server_error(request):
 
 def permission_denied(request, exception):
     return render(request, 'core/403.html', status=403)
+
+
+def _is_hashed(path):
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', {})
+    return path in hashed_files.values()
+
+
+@require_safe
+def serve_static(request, path):
+    """Отдает собранную collectstatic статику из STATIC_ROOT:
+    сжатую копию, если клиент ее принимает, и с долгим кешем для
+    файлов с хешем в имени. Для локального запуска без nginx."""
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404(path)
+    if path.endswith(('.gz', '.br')) or not os.path.isfile(fullpath):
+        raise Http404(path)
+    content_type, _ = mimetypes.guess_type(fullpath)
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    encoding, served = None, fullpath
+    for name, suffix in ENCODINGS:
+        if name in accepted and os.path.isfile(fullpath + suffix):
+            encoding, served = name, fullpath + suffix
+            break
+    stat = os.stat(served)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                              stat.st_mtime, stat.st_size):
+        return HttpResponseNotModified()
+    response = FileResponse(open(served, 'rb'))
+    # Тип исходного файла, а не сжатой копии
+    response['Content-Type'] = content_type or 'application/octet-stream'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = IMMUTABLE if _is_hashed(path) else REVALIDATE
+    # Тело зависит от Accept-Encoding - промежуточные кеши это учтут
+    response['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+@staff_member_required
+def profiles(request):
+    """Список профилей и включение окна профилирования"""
+    limit = getattr(
+        settings, 'PROFILER_MAX_WINDOW', DEFAULT_PROFILER_MAX_WINDOW
+    )
+    if request.method == 'POST':
+        try:
+            minutes = min(max(int(request.POST.get('minutes', 0)), 0), limit)
+        except ValueError:
+            minutes = 0
+        profiler.set_window(minutes * 60)
+        return redirect('profiles')
+    until = profiler.window_until()
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Профили ответов',
+        'profiles': profiler.profiles(),
+        'max_window': limit,
+        'window_until': datetime.fromtimestamp(until, tz=timezone.utc)
+        if until > time.time() else None,
+    }
+    return render(request, 'core/profiles.html', context)
+
+
+def _folded(filename, names):
+    parts = []
+    for name in names:
+        try:
+            with open(safe_join(profiler.profiles_dir(), name)) as file:
+                parts.append(file.read())
+        except FileNotFoundError:
+            continue
+    if not parts:
+        raise Http404(filename)
+    # Одинаковые стеки в склеенных файлах flamegraph.pl суммирует сам
+    response = HttpResponse(''.join(parts), content_type='text/plain')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@staff_member_required
+def profile_download(request, name):
+    """Один профиль в формате collapsed stacks"""
+    if not profiler.NAME.match(name):
+        raise Http404(name)
+    return _folded(name, [name])
+
+
+@staff_member_required
+def view_profiles_download(request, view):
+    """Все профили страницы одним файлом"""
+    names = [
+        item['name'] for item in profiler.profiles() if item['view'] == view
+    ]
+    return _folded(f'{view.replace(":", ".")}{profiler.SUFFIX}', names)
@@ -0,0 +1,81 @@
+"""Отправка писем через фоновую очередь.
+
+EMAIL_BACKEND = 'jobs.mail.QueuedEmailBackend' только ставит письма
+в очередь, а воркер отправляет их бэкендом из JOBS_EMAIL_BACKEND.
+Так письмо сброса пароля не задерживает ответ на запрос.
+"""
+import base64
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .queue import enqueue
+
+
+def serialize(message):
+    """Письмо -> словарь для JSON в payload задачи.
+    Вложения - только кортежи (имя, содержимое, тип)."""
+    attachments = []
+    for attachment in message.attachments:
+        if not isinstance(attachment, tuple):
+            raise TypeError('Вложения MIMEBase не ставятся в очередь')
+        filename, content, mimetype = attachment
+        if isinstance(content, bytes):
+            content = {'base64': base64.b64encode(content).decode()}
+        attachments.append([filename, content, mimetype])
+    return {
+        'subject': message.subject,
+        'body': message.body,
+        'from_email': message.from_email,
+        'to': message.to,
+        'cc': message.cc,
+        'bcc': message.bcc,
+        'reply_to': message.reply_to,
+        'headers': message.extra_headers,
+        'alternatives': [
+            list(alternative)
+            for alternative in getattr(message, 'alternatives', [])
+        ],
+        'attachments': attachments,
+        'content_subtype': message.content_subtype,
+    }
+
+
+def deserialize(data):
+    message = EmailMultiAlternatives(
+        subject=data['subject'],
+        body=data['body'],
+        from_email=data['from_email'],
+        to=data['to'],
+        cc=data['cc'],
+        bcc=data['bcc'],
+        reply_to=data['reply_to'],
+        headers=data['headers'],
+        alternatives=[tuple(item) for item in data['alternatives']],
+    )
+    message.content_subtype = data['content_subtype']
+    for filename, content, mimetype in data['attachments']:
+        if isinstance(content, dict):
+            content = base64.b64decode(content['base64'])
+        message.attach(filename, content, mimetype)
+    return message
+
+
+def send_messages(messages):
+    """Задача очереди: отправляет письма настоящим бэкендом."""
+    connection = get_connection(settings.JOBS_EMAIL_BACKEND)
+    connection.send_messages([deserialize(data) for data in messages])
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        messages = list(email_messages)
+        if not messages:
+            return 0
+        enqueue(
+            'jobs.mail.send_messages',
+            [serialize(message) for message in messages],
+            priority=10,
+        )
+        return len(messages)
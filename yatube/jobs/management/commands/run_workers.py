@@ -0,0 +1,101 @@
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from jobs import queue
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркеры фоновой очереди задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=4,
+            help='потоков в каждом процессе',
+        )
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='количество процессов',
+        )
+        parser.add_argument(
+            '--poll', type=float, default=1.0,
+            help='пауза в секундах, когда очередь пуста',
+        )
+        parser.add_argument(
+            '--visibility-timeout', type=int,
+            default=queue.VISIBILITY_TIMEOUT,
+            help='через сколько секунд задачу упавшего воркера берут снова',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='выполнить готовые задачи и выйти',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.done = 0
+        processes = options['processes']
+        if processes <= 1:
+            self._run_process()
+            return
+        # Дочерние процессы не должны наследовать открытые соединения
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        children = [
+            context.Process(target=self._run_process)
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            for child in children:
+                child.terminate()
+
+    def _run_process(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *args: self.stop.set())
+        threads = [
+            threading.Thread(target=self._loop, args=(number,))
+            for number in range(self.options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+        self.stdout.write(
+            f'Процесс {os.getpid()}: выполнено задач {self.done}'
+        )
+
+    def _loop(self, number):
+        worker = f'{socket.gethostname()}:{os.getpid()}:{number}'
+        done = 0
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                job = queue.claim(worker, self.options['visibility_timeout'])
+                if job is None:
+                    if self.options['once']:
+                        break
+                    self.stop.wait(self.options['poll'])
+                    continue
+                queue.run(job)
+                done += 1
+        finally:
+            connections.close_all()
+            with self.lock:
+                self.done += done
@@ -0,0 +1,47 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """Задача фоновой очереди. Хранится в той же базе, что и данные,
+    поэтому ставится в очередь в одной транзакции с ними."""
+    QUEUED = 'queued'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    # Путь к функции, например 'posts.thumbnails.warm_image'
+    task = models.CharField('Задача', max_length=200)
+    # Аргументы вызова в JSON: {"args": [...], "kwargs": {...}}
+    payload = models.TextField(default='{}')
+    # Чем больше, тем раньше задача будет взята в работу
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    # Пока срок не истек, задачу не возьмет другой воркер; если воркер
+    # упал, задача снова станет видна после этого времени
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-priority', 'run_at', 'id']
+        indexes = [
+            models.Index(
+                fields=['status', '-priority', 'run_at'],
+                name='job_pending_idx',
+            ),
+        ]
+        verbose_name = 'Задача'
+        verbose_name_plural = 'Задачи'
+
+    def __str__(self):
+        return f'{self.task} ({self.get_status_display()})'
@@ -0,0 +1,131 @@
+"""Фоновая очередь задач на таблице Job.
+
+    from jobs.queue import enqueue
+    enqueue('posts.thumbnails.warm_image', post.image.name, priority=5)
+
+Задача записывается в текущей транзакции: если транзакция откатится,
+задачи тоже не будет, а воркер увидит ее только после коммита.
+Воркеры (manage.py run_workers) забирают задачи атомарным UPDATE
+с условием на locked_until, поэтому несколько процессов и потоков
+не возьмут одну задачу дважды. Упавшая задача повторяется
+с экспоненциальной задержкой, пока не кончатся попытки.
+При JOBS_EAGER = True задачи выполняются сразу, без очереди.
+"""
+import json
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд задачу, взятую упавшим воркером, можно взять снова
+VISIBILITY_TIMEOUT = 300
+
+
+def enqueue(task, *args, priority=0, delay=0, max_attempts=5, **kwargs):
+    """Ставит вызов task(*args, **kwargs) в очередь.
+    Аргументы должны сериализоваться в JSON."""
+    import_string(task)  # опечатка в пути должна падать сразу
+    if getattr(settings, 'JOBS_EAGER', False):
+        import_string(task)(*args, **kwargs)
+        return None
+    return Job.objects.create(
+        task=task,
+        payload=json.dumps({'args': args, 'kwargs': kwargs}),
+        priority=priority,
+        max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def claim(worker, visibility_timeout=VISIBILITY_TIMEOUT, limit=10):
+    """Забирает одну готовую к запуску задачу или возвращает None."""
+    now = timezone.now()
+    visible = Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    _fail_exhausted(visible, now, limit)
+    candidates = Job.objects.filter(
+        visible,
+        status=Job.QUEUED,
+        run_at__lte=now,
+        attempts__lt=F('max_attempts'),
+    ).values_list('pk', flat=True)[:limit]
+    for pk in candidates:
+        claimed = Job.objects.filter(
+            visible, pk=pk, status=Job.QUEUED, attempts__lt=F('max_attempts')
+        ).update(
+            locked_until=now + timedelta(seconds=visibility_timeout),
+            locked_by=worker,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def _fail_exhausted(visible, now, limit):
+    """Задача, которая исчерпала попытки и снова стала видна, убила
+    своего воркера (OOM, SIGKILL) и не дошла до run(): помечаем ее
+    упавшей, а не берем снова."""
+    exhausted = list(Job.objects.filter(
+        visible, status=Job.QUEUED, attempts__gte=F('max_attempts')
+    ).values_list('pk', flat=True)[:limit])
+    if exhausted:
+        Job.objects.filter(
+            visible, pk__in=exhausted, status=Job.QUEUED
+        ).update(
+            status=Job.FAILED,
+            last_error='Воркер не завершил задачу ни в одной из попыток',
+            locked_until=None,
+            finished=now,
+        )
+
+
+def run(job):
+    """Выполняет задачу и записывает результат."""
+    payload = json.loads(job.payload)
+    try:
+        import_string(job.task)(*payload['args'], **payload['kwargs'])
+    except Exception:
+        logger.exception('Задача %s упала', job)
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.FAILED,
+                last_error=error,
+                locked_until=None,
+                finished=timezone.now(),
+            )
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                last_error=error,
+                locked_until=None,
+                run_at=timezone.now() + timedelta(
+                    seconds=2 ** job.attempts
+                ),
+            )
+        return False
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.DONE,
+        locked_until=None,
+        finished=timezone.now(),
+    )
+    return True
+
+
+def run_pending(worker='inline', visibility_timeout=VISIBILITY_TIMEOUT):
+    """Выполняет все готовые задачи в текущем потоке.
+    Возвращает количество выполненных."""
+    count = 0
+    job = claim(worker, visibility_timeout)
+    while job is not None:
+        run(job)
+        count += 1
+        job = claim(worker, visibility_timeout)
+    return count
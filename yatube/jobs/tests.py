@@ -0,0 +1,114 @@
+import json
+from datetime import timedelta
+from io import StringIO
+
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import claim, enqueue, run, run_pending
+
+CALLS = []
+
+
+def remember(value):
+    CALLS.append(value)
+
+
+def explode():
+    raise RuntimeError('сломалось')
+
+
+class QueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_failed_job_is_retried_then_marked_failed(self):
+        """Упавшая задача повторяется, пока не кончатся попытки"""
+        job = enqueue('jobs.tests.explode', max_attempts=2)
+        self.assertFalse(run(claim('test')))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('сломалось', job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_job_that_killed_its_worker_is_not_claimed_again(self):
+        """Задача без попыток после таймаута помечается упавшей"""
+        job = enqueue('jobs.tests.remember', 1, max_attempts=1)
+        self.assertEqual(claim('killed').pk, job.pk)
+        # Воркер умер, не дойдя до run()
+        Job.objects.filter(pk=job.pk).update(
+            locked_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertIsNone(claim('next'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(CALLS, [])
+
+    def test_claimed_job_is_invisible_until_timeout(self):
+        """Взятую задачу не берет другой воркер, пока не истек таймаут"""
+        job = enqueue('jobs.tests.remember', 1)
+        self.assertEqual(claim('first').pk, job.pk)
+        self.assertIsNone(claim('second'))
+        Job.objects.filter(pk=job.pk).update(
+            locked_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(claim('second').pk, job.pk)
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_mode_runs_immediately(self):
+        enqueue('jobs.tests.remember', 'сразу')
+        self.assertEqual(CALLS, ['сразу'])
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(
+        EMAIL_BACKEND='jobs.mail.QueuedEmailBackend',
+        JOBS_EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    )
+    def test_email_is_sent_by_worker(self):
+        """Письмо уходит только когда воркер выполнит задачу"""
+        message = mail.EmailMultiAlternatives(
+            'Тема', 'Текст', 'from@example.com', ['to@example.com'],
+            reply_to=['reply@example.com'],
+        )
+        message.attach_alternative('<p>Текст</p>', 'text/html')
+        message.attach('file.bin', b'\x00\xff', 'application/octet-stream')
+        message.send()
+        self.assertEqual(len(mail.outbox), 0)
+        # В очереди - письмо в JSON, а не pickle
+        payload = json.loads(Job.objects.get().payload)
+        self.assertEqual(payload['args'][0][0]['subject'], 'Тема')
+        run_pending()
+        sent = mail.outbox[0]
+        self.assertEqual(sent.subject, 'Тема')
+        self.assertEqual(sent.reply_to, ['reply@example.com'])
+        self.assertEqual(sent.alternatives, [('<p>Текст</p>', 'text/html')])
+        self.assertEqual(
+            sent.attachments,
+            [('file.bin', b'\x00\xff', 'application/octet-stream')]
+        )
+
+
+class WorkersTests(TransactionTestCase):
+    # Потоки воркеров работают со своими соединениями,
+    # поэтому задачи должны быть закоммичены
+    def setUp(self):
+        CALLS.clear()
+
+    def test_jobs_run_by_priority(self):
+        """Воркер выполняет задачи, начиная с более приоритетных"""
+        enqueue('jobs.tests.remember', 'обычная')
+        enqueue('jobs.tests.remember', 'срочная', priority=10)
+        enqueue('jobs.tests.remember', 'отложенная', delay=3600)
+        call_command('run_workers', '--once', '--threads=1',
+                     stdout=StringIO())
+        self.assertEqual(CALLS, ['срочная', 'обычная'])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
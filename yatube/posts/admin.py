@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db.models.expressions import RawSQL
+from . import search
 from .models import Post, Group
 
 
@@ -20,6 +22,17 @@ class PostAdmin(admin.ModelAdmin):
     # Это свойство сработает для всех колонок: где пусто — там будет эта строка
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Вместо LIKE '%...%' по всей таблице ищем по индексу FTS5
+        if not search_term or not search.is_available():
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        if search.match_query(search_term) is None:
+            return queryset.none(), False
+        sql, params = search.matching_ids_sql(search_term)
+        return queryset.filter(pk__in=RawSQL(sql, params)), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = (
@@ -1,5 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def install_search_index(sender, using, **kwargs):
+    # Пересоздание таблицы posts_post при миграции удаляет триггеры
+    # полнотекстового индекса - возвращаем их
+    from django.db import connections
+    from . import search
+    search.install(connections[using])
 
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        # Подключаем обработчики сигналов моделей
+        from . import signals  # noqa: F401
+        post_migrate.connect(install_search_index, sender=self)
@@ -0,0 +1,233 @@
+"""Нагрузочные замеры страниц ленты на синтетических данных.
+
+generate() наполняет базу пользователями, группами, постами,
+подписками и комментариями. Активность авторов распределена
+по степенному закону: несколько авторов пишут большую часть постов,
+как на живом сайте. run() прогоняет страницы через тестовый клиент
+и считает перцентили времени ответа и количество запросов к базе.
+Результаты сохраняются в JSON и сравниваются с прошлым замером.
+"""
+import datetime
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from faker import Faker
+
+from . import counters, timeline
+from .models import Comment, Follow, Group, Post
+from .transfer import keep_dates
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+# Показатель степени в законе Ципфа для активности авторов
+AUTHOR_SKEW = 1.1
+# Во сколько раз можно замедлиться, прежде чем это считается регрессией
+DEFAULT_THRESHOLD = 0.2
+
+
+def _zipf_weights(count, skew=AUTHOR_SKEW):
+    return [1 / (rank ** skew) for rank in range(1, count + 1)]
+
+
+def generate(users=200, groups=10, posts=5000, follows=20, comments=10000,
+             seed=0):
+    """Создает синтетический набор данных.
+    follows - среднее число подписок на пользователя."""
+    rnd = random.Random(seed)
+    fake = Faker('ru_RU')
+    fake.seed_instance(seed)
+    password = make_password(None)
+    now = timezone.now()
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [User(username=f'bench{number}', password=password,
+                  first_name=fake.first_name(), last_name=fake.last_name())
+             for number in range(users)],
+            batch_size=BATCH_SIZE,
+        )
+        user_ids = list(
+            User.objects.filter(username__startswith='bench')
+            .order_by('pk').values_list('pk', flat=True)
+        )
+        Group.objects.bulk_create(
+            [Group(title=fake.sentence(nb_words=3)[:200],
+                   slug=f'bench-{number}',
+                   description=fake.paragraph())
+             for number in range(groups)],
+            batch_size=BATCH_SIZE,
+        )
+        group_ids = list(
+            Group.objects.filter(slug__startswith='bench-')
+            .values_list('pk', flat=True)
+        )
+        # Посты и комментарии растянуты на год назад от текущего момента
+        authors = rnd.choices(user_ids, _zipf_weights(len(user_ids)), k=posts)
+        with keep_dates():
+            _bulk(Post, (
+                Post(
+                    author_id=author_id,
+                    group_id=rnd.choice(group_ids + [None]),
+                    text=fake.paragraph(nb_sentences=5),
+                    pub_date=now - datetime.timedelta(
+                        seconds=rnd.randrange(365 * 24 * 3600)
+                    ),
+                )
+                for author_id in authors
+            ))
+            post_ids = list(Post.objects.values_list('pk', flat=True))
+            post_weights = _zipf_weights(len(post_ids))
+            commented = rnd.choices(post_ids, post_weights, k=comments)
+            _bulk(Comment, (
+                Comment(
+                    post_id=post_id,
+                    author_id=rnd.choice(user_ids),
+                    text=fake.sentence(),
+                    created=now - datetime.timedelta(
+                        seconds=rnd.randrange(365 * 24 * 3600)
+                    ),
+                )
+                for post_id in commented
+            ))
+        # На популярных авторов подписываются чаще
+        pairs = set()
+        author_weights = _zipf_weights(len(user_ids))
+        for user_id in user_ids:
+            wanted = min(len(user_ids) - 1, int(rnd.expovariate(1 / follows)))
+            for author_id in rnd.choices(user_ids, author_weights, k=wanted):
+                if author_id != user_id:
+                    pairs.add((user_id, author_id))
+        _bulk(Follow, (
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id, author_id in pairs
+        ))
+        counters.reconcile()
+        timeline.rebuild()
+    cache.clear()
+
+
+def _bulk(model, objects):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def scenarios():
+    """Страницы для замера: самые тяжелые объекты каждого вида.
+    Возвращает список (название, url, пользователь или None)."""
+    busiest_group = Group.objects.order_by('-posts_count').first()
+    busiest_author = User.objects.order_by('-stats__posts_count').first()
+    busiest_post = Post.objects.order_by('-comments_count').first()
+    busiest_reader = User.objects.order_by(
+        '-stats__following_count'
+    ).first()
+    result = [('index', reverse('posts:index'), None)]
+    if busiest_group is not None:
+        result.append((
+            'group_posts',
+            reverse('posts:group_posts', args=[busiest_group.slug]),
+            None,
+        ))
+    if busiest_author is not None:
+        result.append((
+            'profile',
+            reverse('posts:profile', args=[busiest_author.username]),
+            None,
+        ))
+    if busiest_post is not None:
+        result.append((
+            'post_detail',
+            reverse('posts:post_detail', args=[busiest_post.pk]),
+            None,
+        ))
+    if busiest_reader is not None:
+        result.append((
+            'follow_index', reverse('posts:follow_index'), busiest_reader,
+        ))
+    return result
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def measure(client, url, requests, cold):
+    """Замеряет одну страницу.
+    cold=True очищает кеш перед каждым запросом."""
+    timings = []
+    queries = []
+    for _ in range(requests):
+        if cold:
+            cache.clear()
+        # Журнал запросов ограничен 9000 записей, начинаем его заново
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(url)
+            elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} ответил {response.status_code}')
+        timings.append(elapsed * 1000)
+        queries.append(len(captured))
+    return {
+        'requests': requests,
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(_percentile(timings, 50), 3),
+        'p90_ms': round(_percentile(timings, 90), 3),
+        'p99_ms': round(_percentile(timings, 99), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': max(queries),
+    }
+
+
+def run(requests=50, warmup=5):
+    """Прогоняет все сценарии с холодным и прогретым кешем."""
+    results = {}
+    for name, url, user in scenarios():
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        for _ in range(warmup):
+            client.get(url)
+        results[f'{name}:cold'] = measure(client, url, requests, cold=True)
+        results[f'{name}:warm'] = measure(client, url, requests, cold=False)
+    return results
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Список регрессий относительно базового замера.
+    Время сравнивается по p50 и p90, запросы - строго."""
+    regressions = []
+    for name, result in current.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p90_ms'):
+            limit = previous[metric] * (1 + threshold)
+            if result[metric] > limit:
+                regressions.append(
+                    f'{name}: {metric} {result[metric]:.1f} '
+                    f'> {previous[metric]:.1f} (+{threshold:.0%})'
+                )
+        if result['queries'] > previous['queries']:
+            regressions.append(
+                f'{name}: запросов {result["queries"]} '
+                f'> {previous["queries"]}'
+            )
+    return regressions
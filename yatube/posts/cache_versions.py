@@ -0,0 +1,82 @@
+"""Поколения кеша для фрагментов страниц.
+
+У каждой области (все посты, группа, автор, пост, лента подписок,
+подписчики автора)
+есть счетчик версии. Он входит в ключ {% cache %}, поэтому после
+записи достаточно увеличить счетчик - старые фрагменты больше
+не читаются и вытесняются сами, а новые посты видны сразу.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from core import replicas
+
+GLOBAL = 'global'
+GROUP = 'group'
+AUTHOR = 'author'
+POST = 'post'
+TIMELINE = 'timeline'
+FOLLOWERS = 'followers'
+
+
+def _key(scope, pk=None):
+    return f'posts:version:{scope}:{pk or ""}'
+
+
+def _initial():
+    # Начинаем не с единицы: если счетчик вытеснили из кеша, новые ключи
+    # не совпадут с ключами старых фрагментов
+    return time.time_ns()
+
+
+def get_versions(*scopes):
+    """Принимает пары (область, pk), возвращает список версий."""
+    keys = [_key(scope, pk) for scope, pk in scopes]
+    replica = replicas.current_replica()
+    found = cache.get_many(keys + [replicas.EPOCH_KEY] if replica else keys)
+    versions = []
+    for key in keys:
+        if key not in found:
+            cache.add(key, _initial(), timeout=None)
+            found[key] = cache.get(key)
+        versions.append(found[key])
+    if replica:
+        # Фрагменты по отстающей реплике живут до ее следующей
+        # синхронизации и не достаются читающим из default
+        epoch = found.get(replicas.EPOCH_KEY, 0)
+        versions = [f'{version}:{replica}:{epoch}' for version in versions]
+    return versions
+
+
+def get_version(scope, pk=None):
+    return get_versions((scope, pk))[0]
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial(), timeout=None)
+
+
+def bump(scope, pk=None):
+    """Делает все фрагменты области устаревшими.
+    Внутри транзакции версия увеличивается еще раз после коммита,
+    чтобы не остался фрагмент, собранный до фиксации данных."""
+    key = _key(scope, pk)
+    _incr(key)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _incr(key))
+
+
+def bump_post(post, *group_ids):
+    """Пост попадает в общую ленту, ленту группы, профиль автора
+    и на свою страницу - сбрасываем их все."""
+    bump(GLOBAL)
+    bump(AUTHOR, post.author_id)
+    bump(POST, post.pk)
+    for group_id in {post.group_id, *group_ids}:
+        if group_id is not None:
+            bump(GROUP, group_id)
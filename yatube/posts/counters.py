@@ -0,0 +1,102 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import sharding
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+def _count_of(model, field, outer='pk'):
+    """Подзапрос COUNT(*) строк model, у которых field = внешний ключ."""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef(outer)})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def _user_counts(user_id):
+    return {
+        'posts_count': sharding.for_author(
+            Post.objects, user_id
+        ).filter(author_id=user_id).count(),
+        'followers_count': Follow.objects.filter(author_id=user_id).count(),
+        'following_count': Follow.objects.filter(user_id=user_id).count(),
+    }
+
+
+def stats_for(user):
+    """Возвращает счетчики пользователя, при первом обращении
+    считает их по таблицам."""
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            stats = UserStats.objects.create(
+                user=user, **_user_counts(user.pk)
+            )
+    except IntegrityError:
+        stats = UserStats.objects.get(user=user)
+    user.stats = stats
+    return stats
+
+
+def bump_user(user_id, **deltas):
+    """Атомарно меняет счетчики пользователя на deltas.
+    Если строки счетчиков еще нет, ничего не делаем: stats_for
+    посчитает ее по таблицам при первом чтении."""
+    UserStats.objects.filter(user_id=user_id).update(
+        **{name: F(name) + delta for name, delta in deltas.items()}
+    )
+
+
+def bump_group(group_id, delta):
+    if group_id is not None:
+        Group.objects.filter(pk=group_id).update(
+            posts_count=F('posts_count') + delta
+        )
+
+
+def bump_post(post_id, delta):
+    sharding.for_post(Post.objects, post_id).filter(pk=post_id).update(
+        comments_count=F('comments_count') + delta
+    )
+
+
+def reconcile():
+    """Пересчитывает все счетчики по таблицам.
+    Возвращает словарь: модель -> количество исправленных строк."""
+    missing = User.objects.filter(stats__isnull=True).values_list(
+        'pk', flat=True
+    )
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in missing.iterator()],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    targets = (
+        (Group, {'posts_count': _count_of(Post, 'group')}),
+        (Post, {'comments_count': _count_of(Comment, 'post')}),
+        (UserStats, {
+            'posts_count': _count_of(Post, 'author', 'user_id'),
+            'followers_count': _count_of(Follow, 'author', 'user_id'),
+            'following_count': _count_of(Follow, 'user', 'user_id'),
+        }),
+    )
+    fixed = {}
+    for model, counts in targets:
+        actual = {f'actual_{name}': value for name, value in counts.items()}
+        drifted = model.objects.annotate(**actual).exclude(**{
+            name: F(f'actual_{name}') for name in counts
+        })
+        fixed[model.__name__] = drifted.count()
+        if fixed[model.__name__]:
+            model.objects.update(**counts)
+    return fixed
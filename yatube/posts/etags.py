@@ -0,0 +1,76 @@
+"""Валидаторы для условных GET-запросов к публичным страницам.
+
+ETag собирается из версий областей кеша (см. cache_versions), поэтому
+считается без рендеринга шаблона и почти без обращений к базе.
+Last-Modified не отдаем: дата последнего поста не меняется при
+удалении и редактировании, а версии учитывают любые записи.
+"""
+import datetime
+import hashlib
+
+from . import cache_versions as versions
+from . import sharding
+from .models import Group, Post, User
+
+
+def _etag(request, *scopes):
+    # Шапка и форма комментария зависят от пользователя и CSRF-токена,
+    # подвал - от текущего года
+    parts = [
+        *versions.get_versions(*scopes),
+        request.user.pk or 0,
+        request.META.get('CSRF_COOKIE', ''),
+        datetime.date.today().year,
+        request.GET.urlencode(),
+    ]
+    digest = hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+    # Слабый ETag: тело может отличаться байтами при сжатии
+    return f'W/"{digest}"'
+
+
+def index_etag(request):
+    return _etag(request, (versions.GLOBAL, None))
+
+
+def group_posts_etag(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True
+    ).first()
+    if group_id is None:
+        return None
+    return _etag(request, (versions.GROUP, group_id))
+
+
+def profile_etag(request, username):
+    client_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True
+    ).first()
+    if client_id is None:
+        return None
+    return _etag(
+        request,
+        # Правка группы тоже увеличивает версии авторов ее постов
+        (versions.AUTHOR, client_id),
+        (versions.FOLLOWERS, client_id),
+        # подписки самого автора и подписка зрителя на автора
+        (versions.TIMELINE, client_id),
+        (versions.TIMELINE, request.user.pk),
+    )
+
+
+def post_comments_etag(request, post_id):
+    # Новый комментарий меняет версию поста
+    return _etag(request, (versions.POST, post_id))
+
+
+def post_detail_etag(request, post_id):
+    posts = sharding.for_post(Post.objects, post_id)
+    post = posts.filter(pk=post_id).values('author_id', 'group_id').first()
+    if post is None:
+        return None
+    return _etag(
+        request,
+        (versions.POST, post_id),
+        (versions.AUTHOR, post['author_id']),
+        (versions.GROUP, post['group_id']),
+    )
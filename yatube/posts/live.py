@@ -0,0 +1,38 @@
+"""Ожидание новых постов для long-polling.
+
+Запрос ждет, пока не изменится версия кеша его ленты (см.
+cache_versions). Новый пост в этом же процессе будит ожидающих сразу
+через notify(), посты из других процессов замечаются по общему кешу
+не позже чем через POLL_INTERVAL секунд.
+"""
+import threading
+import time
+
+from . import cache_versions as versions
+
+# Как часто, в секундах, сверять версии, записанные другими процессами
+POLL_INTERVAL = 1
+
+_changed = threading.Condition()
+
+
+def notify():
+    """Будит ожидающие запросы этого процесса."""
+    with _changed:
+        _changed.notify_all()
+
+
+def wait_for_change(scopes, seen, timeout):
+    """Ждет не дольше timeout секунд, пока версии областей scopes
+    не станут отличаться от seen. Возвращает новые версии или None,
+    если время вышло."""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        with _changed:
+            _changed.wait(min(POLL_INTERVAL, remaining))
+        current = versions.get_versions(*scopes)
+        if current != seen:
+            return current
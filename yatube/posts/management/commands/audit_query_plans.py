@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import get_runner
+from django.urls import reverse
+
+from posts import benchmark, query_plans
+
+
+class Command(BaseCommand):
+    help = ('Открывает страницы на синтетических данных и ищет в планах '
+            'их запросов полные проходы по таблицам и временные сортировки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=500)
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='печатать планы всех запросов, а не только проблемных',
+        )
+        parser.add_argument(
+            '--fail', action='store_true',
+            help='завершиться с ошибкой, если найдены проблемы',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN есть только в SQLite')
+        runner = get_runner(settings)(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            benchmark.generate(
+                users=options['users'], groups=5, posts=options['posts'],
+                follows=10, comments=options['posts'] * 2,
+            )
+            pages = benchmark.scenarios()
+            pages.append((
+                'post_search', reverse('posts:post_search') + '?q=а', None,
+            ))
+            report = query_plans.audit(pages)
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+        found = 0
+        for name, sql, plan, problems in report:
+            if not problems and not options['verbose_plans']:
+                continue
+            found += bool(problems)
+            style = self.style.WARNING if problems else str
+            self.stdout.write(style(f'{name}: {sql}'))
+            for line in plan:
+                marker = '!' if line in problems else ' '
+                self.stdout.write(f'  {marker} {line}')
+        summary = f'Запросов проверено: {len(report)}, с проблемами: {found}'
+        if found and options['fail']:
+            raise CommandError(summary)
+        self.stdout.write(summary)
@@ -0,0 +1,94 @@
+import datetime
+import json
+import platform
+import sqlite3
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import get_runner
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время ответа и число запросов страниц ленты '
+            'на синтетических данных во временной базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='среднее число подписок на пользователя',
+        )
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='запросов на каждую страницу',
+        )
+        parser.add_argument(
+            '--save', help='сохранить результаты в JSON-файл',
+        )
+        parser.add_argument(
+            '--compare', help='JSON-файл базового замера для сравнения',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=benchmark.DEFAULT_THRESHOLD,
+            help='допустимое замедление, доля от базового замера',
+        )
+
+    def handle(self, *args, **options):
+        # Как при тестах: отдельная база и кеш во временной папке,
+        # рабочие данные не трогаем
+        runner = get_runner(settings)(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            dataset = {
+                name: options[name] for name in
+                ('users', 'groups', 'posts', 'follows', 'comments', 'seed')
+            }
+            self.stdout.write(f'Генерация данных: {dataset}')
+            benchmark.generate(**dataset)
+            results = benchmark.run(requests=options['requests'])
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:20} p50 {result["p50_ms"]:8.2f} мс  '
+                f'p90 {result["p90_ms"]:8.2f} мс  '
+                f'p99 {result["p99_ms"]:8.2f} мс  '
+                f'запросов {result["queries"]}'
+            )
+        if options['save']:
+            report = {
+                'created': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'dataset': dataset,
+                'results': results,
+            }
+            with open(options['save'], 'w') as baseline:
+                json.dump(report, baseline, indent=2, ensure_ascii=False)
+            self.stdout.write(f'Результаты сохранены в {options["save"]}')
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                previous = json.load(baseline)
+            if previous.get('dataset') != dataset:
+                self.stderr.write(
+                    'Внимание: базовый замер сделан на других данных'
+                )
+            regressions = benchmark.compare(
+                previous['results'], results, options['threshold']
+            )
+            if regressions:
+                raise CommandError(
+                    'Регрессии:\n' + '\n'.join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
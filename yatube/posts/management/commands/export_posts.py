@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Выгружает группы, посты, комментарии и подписки в NDJSON '
+            '(файл .gz сжимается)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='файл для выгрузки, по умолчанию stdout',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='сколько строк читать из базы за раз',
+        )
+        parser.add_argument(
+            '--media-dir',
+            help='скопировать картинки постов в эту папку',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help='потоков для копирования картинок',
+        )
+
+    def handle(self, *args, **options):
+        rows = transfer.export_rows(options['chunk_size'])
+        if options['path'] == '-':
+            lines = self.write_rows(rows, self.stdout, ending='')
+        else:
+            with transfer.open_stream(options['path'], 'w') as stream:
+                lines = self.write_rows(rows, stream)
+        if options['media_dir']:
+            images = (
+                Post.objects.exclude(image='')
+                .values_list('image', flat=True).distinct()
+            )
+            copied = transfer.copy_files(
+                images.iterator(), None, options['media_dir'],
+                workers=options['workers'],
+            )
+            self.stderr.write(f'Картинок скопировано: {copied}')
+        self.stderr.write(self.style.SUCCESS(f'Выгружено записей: {lines}'))
+
+    def write_rows(self, rows, stream, **kwargs):
+        count = 0
+        for line in rows:
+            stream.write(line, **kwargs)
+            count += 1
+        return count
@@ -0,0 +1,69 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from posts import counters, timeline, transfer
+
+
+class Command(BaseCommand):
+    help = ('Загружает NDJSON из export_posts пачками через bulk_create '
+            'и пересчитывает счетчики и ленты')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='файл выгрузки, по умолчанию stdin',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='сколько записей вставлять одной транзакцией',
+        )
+        parser.add_argument(
+            '--ignore-conflicts', action='store_true',
+            help='пропускать записи с уже занятыми ключами',
+        )
+        parser.add_argument(
+            '--media-dir',
+            help='папка с картинками из export_posts --media-dir',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help='потоков для копирования картинок',
+        )
+
+    def handle(self, *args, **options):
+        importer = transfer.Importer(
+            batch_size=options['batch_size'],
+            ignore_conflicts=options['ignore_conflicts'],
+            media_dir=options['media_dir'],
+            workers=options['workers'],
+        )
+        try:
+            with transfer.open_stream(options['path'], 'r') as stream:
+                transfer.import_lines(stream, importer)
+        except IntegrityError as error:
+            raise CommandError(
+                f'Записи уже есть в базе ({error}), '
+                'повторите с --ignore-conflicts'
+            )
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(error)
+        finally:
+            # Пачки до ошибки уже закоммичены, производные данные
+            # для них нужно пересобрать в любом случае
+            self.rebuild(importer)
+        self.stdout.write(self.style.SUCCESS('Импорт завершен'))
+
+    def rebuild(self, importer):
+        for model, count in importer.counts.items():
+            self.stdout.write(f'{model}: загружено {count}')
+        if importer.copied:
+            self.stdout.write(f'Картинок скопировано: {importer.copied}')
+        # bulk_create не вызывает сигналы: счетчики и ленты подписок
+        # пересобираем целиком, поисковый индекс обновили триггеры
+        with transaction.atomic():
+            counters.reconcile()
+            timeline.rebuild()
+        # Версии кеша тоже не увеличивались, а затронуты могут быть
+        # любые группы и авторы
+        cache.clear()
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import sharding
+
+
+class Command(BaseCommand):
+    help = ('Переносит авторов между шардами постов: одного (--author и '
+            '--to) или всех по жадному плану выравнивания')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--author', type=int, help='id автора')
+        parser.add_argument('--to', help='алиас шарда назначения')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='только показать план, ничего не переносить',
+        )
+        parser.add_argument(
+            '--wait', type=float, default=sharding.MAP_TTL,
+            help='сколько секунд ждать, пока процессы перечитают карту',
+        )
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError(
+                'Шардирование выключено: задайте YATUBE_SHARDING=1'
+            )
+        if (options['author'] is None) != (options['to'] is None):
+            raise CommandError('--author и --to задаются вместе')
+        if options['to'] is not None and (
+                options['to'] not in sharding.shards()):
+            raise CommandError(f'Нет шарда {options["to"]}')
+        if options['author'] is not None:
+            source = sharding.shard_map.shard_for(options['author'])
+            moves = [(options['author'], source, options['to'], None)]
+        else:
+            moves = sharding.plan_moves()
+        for author_id, source, target, count in moves:
+            if count is not None:
+                self.stdout.write(
+                    f'Автор {author_id}: {source} -> {target}, '
+                    f'постов {count}'
+                )
+            if options['dry_run']:
+                continue
+            try:
+                posts, comments = sharding.move_author(
+                    author_id, target, wait=options['wait']
+                )
+            except sharding.AuthorMoving as error:
+                raise CommandError(error)
+            self.stdout.write(
+                f'Автор {author_id} перенесен в {target}: постов {posts}, '
+                f'комментариев {comments}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Переносов: {len(moves)}'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счетчики постов и подписок'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = counters.reconcile()
+        for model, count in fixed.items():
+            self.stdout.write(f'{model}: исправлено строк {count}')
+        self.stdout.write(self.style.SUCCESS('Счетчики сверены'))
@@ -0,0 +1,42 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import sharding
+from posts.models import Post
+from posts.thumbnails import warm_image
+
+
+class Command(BaseCommand):
+    help = 'Создает миниатюры для картинок всех постов в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count(),
+            help='количество процессов',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=20,
+            help='сколько картинок отдавать процессу за раз',
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='')
+        images = sorted({
+            image
+            for queryset in sharding.querysets(posts)
+            for image in queryset.values_list('image', flat=True).distinct()
+        })
+        # Дочерние процессы не должны наследовать открытые соединения
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(
+                max_workers=options['workers'], mp_context=context) as pool:
+            done = sum(pool.map(
+                warm_image, images, chunksize=options['chunk_size']
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Картинок: {len(images)}, миниатюр готово: {done}'
+        ))
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.16 on 2026-10-17 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorShard',
+            fields=[
+                ('author_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('shard', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ShardKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author_id', models.IntegerField(db_index=True)),
+            ],
+        ),
+    ]
@@ -4,16 +4,52 @@ from django.contrib.auth import get_user_model
 User = get_user_model()
 
 
-class Group(models.Model):
+class CountersMixin:
+    """Денормализованные счетчики меняются только через F()
+    (posts/counters.py). Сохранение уже существующей строки их не пишет,
+    иначе form.save() или админка затерли бы параллельные приращения
+    устаревшим значением из памяти."""
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Group(CountersMixin, models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=50, unique=True)
     description = models.TextField()
+    # Денормализованный счетчик, поддерживается сигналами Post
+    posts_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('posts_count',)
 
     def __str__(self):
         return self.title
 
 
-class Post(models.Model):
+class ShardedQuerySet(models.QuerySet):
+    """create() без явного using пишет строку туда, куда роутер
+    направит сам объект, а не модель: при шардировании это шард
+    автора (см. posts/sharding.py). Без шардов - default, как обычно."""
+
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True)
+        return obj
+
+
+class Post(CountersMixin, models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField(auto_now_add=True)
     group = models.ForeignKey(
@@ -36,11 +72,32 @@ class Post(models.Model):
     )
     # Аргумент upload_to указывает директорию,
     # в которую будут загружаться пользовательские файлы
+    # Денормализованный счетчик, поддерживается сигналами Comment
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('comments_count',)
+    objects = ShardedQuerySet.as_manager()
 
     class Meta:
         ordering = ["-pub_date"]
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Ленты листаются курсором по (pub_date, id): с такими индексами
+        # страница - это диапазон индекса без сортировки во временном дереве
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx',
+            ),
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_pub_date_idx',
+            ),
+        ]
 
     def __str__(self):
         # выводим текст поста
@@ -61,8 +118,16 @@ class Comment(models.Model):
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
 
+    objects = ShardedQuerySet.as_manager()
+
     class Meta:
         ordering = ["-created"]
+        indexes = [
+            models.Index(
+                fields=['post', '-created', '-id'],
+                name='comment_post_created_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.text
@@ -79,3 +144,79 @@ class Follow(models.Model):
         on_delete=models.CASCADE,
         related_name='following'
     )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='follow_unique_user_author',
+            ),
+        ]
+
+
+class UserStats(models.Model):
+    """Счетчики пользователя, чтобы страницы не делали COUNT(*).
+    Обновляются атомарно через F() при сохранении и удалении
+    Post и Follow, расхождения чинит команда reconcile_counters."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.user)
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок: пост автора, на которого
+    подписан пользователь. Заполняется при публикации поста
+    и при подписке, поэтому чтение /follow/ - это выборка по индексу
+    из одной таблицы без JOIN с Follow."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    # Копия Post.pub_date, чтобы сортировать ленту по индексу
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-pub_date', '-post_id']
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_pub_date_idx',
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='timeline_unique_user_post',
+            ),
+        ]
+
+
+class ShardKey(models.Model):
+    """Глобальный id строки при шардировании постов по авторам.
+    Посты и комментарии получают id отсюда, поэтому id не повторяются
+    между шардами и строки можно переносить. Для поста author_id -
+    его автор, для комментария - автор поста: так по id поста
+    находится шард, где лежат и пост, и его комментарии."""
+    author_id = models.IntegerField(db_index=True)
+
+
+class AuthorShard(models.Model):
+    """Шард автора, если он отличается от шарда по остатку от деления.
+    Записи появляются при переносе автора командой rebalance_shards."""
+    author_id = models.IntegerField(primary_key=True)
+    shard = models.CharField(max_length=100)
@@ -0,0 +1,221 @@
+import base64
+import binascii
+import datetime
+import heapq
+import json
+from itertools import islice
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+# Сколько постов показывать на одной странице ленты
+POSTS_PER_PAGE = 10
+# Сколько комментариев показывать под постом за раз
+COMMENTS_PER_PAGE = 20
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, values):
+    """Упаковывает направление и значения ключа в непрозрачную строку."""
+    values = [
+        value.isoformat() if isinstance(value, datetime.datetime) else value
+        for value in values
+    ]
+    raw = json.dumps([direction, values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Распаковывает курсор, для битой строки возвращает None."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(raw.decode())
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if direction not in (NEXT, PREVIOUS) or not isinstance(values, list):
+        return None
+    return direction, values
+
+
+class CursorPage:
+    """Страница ленты: ведет себя как список объектов и знает
+    курсоры соседних страниц."""
+
+    def __init__(self, object_list, paginator, cursor,
+                 has_next, has_previous, first_key=None, last_key=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.cursor = cursor or ''
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self._first_key = first_key
+        self._last_key = last_key
+
+    def __repr__(self):
+        return f'<CursorPage {self.cursor or "first"}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or self._last_key is None:
+            return None
+        return encode_cursor(NEXT, self._last_key)
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or self._first_key is None:
+            return None
+        return encode_cursor(PREVIOUS, self._first_key)
+
+    @property
+    def last_cursor(self):
+        # Последняя страница - это первая страница при обратной сортировке,
+        # поэтому ей не нужен ни OFFSET, ни подсчет записей
+        return encode_cursor(PREVIOUS, [])
+
+
+class CursorPaginator:
+    """Keyset-пагинация по уникальному ключу сортировки.
+
+    В отличие от django.core.paginator.Paginator не делает COUNT(*)
+    и не использует OFFSET: каждая страница выбирается условием
+    "ключ меньше последнего показанного", поэтому сотая страница
+    стоит столько же, сколько первая.
+    По умолчанию записи идут от новых к старым по (pub_date, id).
+    transform получает список строк страницы и возвращает то,
+    что увидит шаблон (например, посты вместо записей ленты).
+    """
+
+    def __init__(self, queryset, per_page=POSTS_PER_PAGE,
+                 ordering=('-pub_date', '-id'), transform=None):
+        self.queryset = queryset
+        self.transform = transform
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+
+    def key_for(self, obj):
+        # строки values() - словари
+        if isinstance(obj, dict):
+            return [obj[field] for field in self.fields]
+        return [getattr(obj, field) for field in self.fields]
+
+    def _to_python(self, field, value):
+        try:
+            model_field = self.queryset.model._meta.get_field(field)
+        except FieldDoesNotExist:
+            return value
+        return model_field.to_python(value)
+
+    def _after(self, values, reverse):
+        """Условие "строго после ключа values" в порядке сортировки."""
+        condition = Q()
+        equal = Q()
+        for field, descending, value in zip(
+                self.fields, self.descending, values):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def _fetch(self, condition, ordering, reverse, limit):
+        queryset = self.queryset.filter(condition).order_by(*ordering)
+        return list(queryset[:limit])
+
+    def get_page(self, cursor=None):
+        """Возвращает страницу по курсору; битый курсор - первая страница."""
+        decoded = decode_cursor(cursor)
+        direction, values = decoded if decoded else (NEXT, [])
+        if values and len(values) != len(self.fields):
+            direction, values = NEXT, []
+        if values:
+            try:
+                values = [
+                    self._to_python(field, value)
+                    for field, value in zip(self.fields, values)
+                ]
+            except (ValidationError, TypeError, ValueError):
+                direction, values = NEXT, []
+        reverse = direction == PREVIOUS
+        condition = self._after(values, reverse) if values else Q()
+        if reverse:
+            ordering = [
+                name.lstrip('-') if descending else f'-{name}'
+                for name, descending in zip(self.fields, self.descending)
+            ]
+        else:
+            ordering = self.ordering
+        # Берем на одну запись больше, чтобы узнать есть ли еще страница
+        rows = self._fetch(condition, ordering, reverse, self.per_page + 1)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = bool(values), has_more
+        else:
+            has_next, has_previous = has_more, bool(values)
+            cursor = cursor if values else None
+        first_key = self.key_for(rows[0]) if rows else None
+        last_key = self.key_for(rows[-1]) if rows else None
+        if self.transform is not None:
+            rows = self.transform(rows)
+        return CursorPage(
+            rows, self, cursor,
+            has_next=has_next,
+            has_previous=has_previous,
+            first_key=first_key,
+            last_key=last_key,
+        )
+
+
+class MergedCursorPaginator(CursorPaginator):
+    """Keyset-пагинация по нескольким querysets одной модели, например
+    по шардам: из каждого берется страница с тем же условием, а
+    страницы сливаются heapq.merge по ключу сортировки.
+    Все поля сортировки должны идти в одном направлении."""
+
+    def __init__(self, querysets, **kwargs):
+        self.querysets = list(querysets)
+        super().__init__(self.querysets[0] if self.querysets else None,
+                         **kwargs)
+        if len(set(self.descending)) > 1:
+            raise ValueError('Поля сортировки должны идти в одну сторону')
+
+    def _to_python(self, field, value):
+        if self.queryset is None:
+            return value
+        return super()._to_python(field, value)
+
+    def _fetch(self, condition, ordering, reverse, limit):
+        pages = [
+            list(queryset.filter(condition).order_by(*ordering)[:limit])
+            for queryset in self.querysets
+        ]
+        merged = heapq.merge(
+            *pages,
+            key=lambda obj: tuple(self.key_for(obj)),
+            reverse=self.descending[0] != reverse,
+        )
+        return list(islice(merged, limit))
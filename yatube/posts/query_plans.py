@@ -0,0 +1,86 @@
+"""Проверка планов запросов страниц через EXPLAIN QUERY PLAN.
+
+Страницы открываются тестовым клиентом, каждый уникальный по форме
+запрос повторяется с теми же параметрами под EXPLAIN QUERY PLAN.
+Проблемой считаются полный проход по таблице (SCAN без индекса)
+и сортировка во временном B-дереве (USE TEMP B-TREE): на больших
+таблицах это и есть медленные страницы. Сортировка результатов
+полнотекстового поиска по релевантности не считается проблемой.
+"""
+import re
+from collections import OrderedDict
+
+from django.db import connection
+from django.test import Client
+
+from core.query_budget import normalize
+
+_FULL_SCAN = re.compile(r'^SCAN (?!.*\b(?:USING|VIRTUAL TABLE)\b)')
+_TEMP_SORT = re.compile(r'USE TEMP B-TREE')
+
+
+class _Collector:
+    def __init__(self):
+        self.queries = OrderedDict()
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            self.queries.setdefault(normalize(sql), (sql, params))
+        return execute(sql, params, many, context)
+
+
+def explain(sql, params):
+    """Строки плана запроса (поле detail из EXPLAIN QUERY PLAN)."""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def problems_in(plan):
+    # Результаты полнотекстового поиска сортируются по релевантности,
+    # которая считается для каждого совпадения: индекс тут не поможет
+    ranked = any('VIRTUAL TABLE' in line for line in plan)
+    return [
+        line for line in plan
+        if _FULL_SCAN.search(line)
+        or (_TEMP_SORT.search(line) and not ranked)
+    ]
+
+
+def collect(url, user=None):
+    """Запросы, которые делает страница: {форма: (sql, params)}."""
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    collector = _Collector()
+    with connection.execute_wrapper(collector):
+        response = client.get(url)
+    return response, collector.queries
+
+
+def audit(pages):
+    """Проверяет страницы, pages - список (название, url, пользователь).
+    Для лент проверяется и вторая страница: у нее другое условие.
+    Возвращает список (название, sql, план, проблемы)."""
+    report = []
+    seen = set()
+    pages = list(pages)
+    while pages:
+        name, url, user = pages.pop(0)
+        response, queries = collect(url, user)
+        page_obj = (response.context or {}).get('page_obj')
+        cursor = getattr(page_obj, 'next_cursor', None)
+        if cursor and 'cursor=' not in url:
+            separator = '&' if '?' in url else '?'
+            pages.insert(0, (
+                f'{name} (следующая страница)',
+                f'{url}{separator}cursor={cursor}',
+                user,
+            ))
+        for shape, (sql, params) in queries.items():
+            if shape in seen:
+                continue
+            seen.add(shape)
+            plan = explain(sql, params)
+            report.append((name, sql, plan, problems_in(plan)))
+    return report
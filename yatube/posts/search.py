@@ -0,0 +1,140 @@
+"""Полнотекстовый поиск по постам на SQLite FTS5.
+
+Индекс posts_post_fts - внешняя (content=) таблица FTS5 над
+posts_post: тексты не дублируются, а триггеры на вставку, удаление
+и изменение текста поддерживают индекс в актуальном состоянии даже
+при bulk_create и правках в обход ORM. Результаты ранжируются
+по BM25 и листаются курсором по (score, id).
+"""
+import re
+
+from django.db import connection
+
+from . import sharding
+from .models import Post
+from .paginator import (NEXT, POSTS_PER_PAGE, PREVIOUS, CursorPage,
+                        decode_cursor)
+
+FTS_TABLE = 'posts_post_fts'
+
+INSTALL_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "text, content='posts_post', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON posts_post "
+    f"BEGIN INSERT INTO {FTS_TABLE}(rowid, text) "
+    "VALUES (new.id, new.text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON posts_post "
+    f"BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) "
+    "VALUES ('delete', old.id, old.text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au "
+    "AFTER UPDATE OF text ON posts_post "
+    f"BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    f"INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); END",
+)
+
+
+def is_available(using=None):
+    return (using or connection).vendor == 'sqlite'
+
+
+def install(using=None):
+    """Создает индекс и триггеры, если их нет.
+    SQLite пересоздает таблицу при некоторых миграциях и теряет
+    триггеры, поэтому вызывается и после каждого migrate."""
+    using = using or connection
+    if not is_available(using):
+        return
+    with using.cursor() as cursor:
+        for statement in INSTALL_SQL:
+            cursor.execute(statement)
+
+
+def rebuild(using=None):
+    """Перестраивает индекс по текущему содержимому posts_post."""
+    using = using or connection
+    install(using)
+    with using.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+        )
+
+
+def match_query(query):
+    """Превращает строку пользователя в запрос FTS5: все слова
+    должны встретиться, последнее слово ищется как префикс."""
+    words = re.findall(r'\w+', query.lower())
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def matching_ids_sql(query):
+    """Подзапрос с id подходящих постов для фильтра pk__in."""
+    return (
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        [match_query(query)],
+    )
+
+
+def _ranked(match, values, reverse, limit):
+    condition = ''
+    params = [match]
+    if values:
+        op = '<' if reverse else '>'
+        condition = f'WHERE score {op} %s OR (score = %s AND id {op} %s)'
+        params += [values[0], values[0], values[1]]
+    direction = 'DESC' if reverse else 'ASC'
+    sql = (
+        'SELECT id, score FROM ('
+        f' SELECT rowid AS id, bm25({FTS_TABLE}) AS score'
+        f' FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+        f') {condition} ORDER BY score {direction}, id {direction} LIMIT %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit])
+        return cursor.fetchall()
+
+
+def search_page(query, cursor=None, per_page=POSTS_PER_PAGE):
+    """Страница результатов поиска, лучшие совпадения первыми."""
+    match = match_query(query)
+    if match is None:
+        return CursorPage([], None, None, False, False)
+    if not is_available() or sharding.enabled():
+        # Индекс FTS5 есть только в default, шарды ищем LIKE
+        paginator = sharding.paginator(
+            Post.objects.filter(text__icontains=query)
+        )
+        return paginator.get_page(cursor)
+    decoded = decode_cursor(cursor)
+    direction, values = decoded if decoded else (NEXT, [])
+    if values and not (
+            len(values) == 2 and all(
+                isinstance(value, (int, float)) for value in values)):
+        direction, values = NEXT, []
+    reverse = direction == PREVIOUS
+    rows = _ranked(match, values, reverse, per_page + 1)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if reverse:
+        rows.reverse()
+        has_next, has_previous = bool(values), has_more
+    else:
+        has_next, has_previous = has_more, bool(values)
+        cursor = cursor if values else None
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        [post_id for post_id, _ in rows]
+    )
+    return CursorPage(
+        [posts[post_id] for post_id, _ in rows if post_id in posts],
+        None,
+        cursor,
+        has_next=has_next,
+        has_previous=has_previous,
+        first_key=[rows[0][1], rows[0][0]] if rows else None,
+        last_key=[rows[-1][1], rows[-1][0]] if rows else None,
+    )
@@ -0,0 +1,414 @@
+"""Шардирование постов и комментариев по автору.
+
+Выключено, пока settings.POST_SHARDS пуст. Если перечислить там
+алиасы баз, посты автора и комментарии к ним хранятся в одном шарде:
+по умолчанию shards[author_id % N], а перенесенные командой
+rebalance_shards авторы записаны в AuthorShard. Пользователи, группы,
+подписки, счетчики и ShardKey остаются в default.
+
+Id постов и комментариев выдает ShardKey в default: они уникальны
+между шардами, а по id поста находится его шард. JOIN между базами
+невозможен, поэтому вместо select_related авторы и группы
+подгружаются из default отдельным in_bulk (см. select_related).
+Ленты собираются слиянием страниц всех нужных шардов по ключу
+сортировки (MergedCursorPaginator).
+
+Не поддерживаются в режиме шардов: материализованные ленты
+(/follow/ читается слиянием постов авторов), полнотекстовый поиск
+(ищется LIKE по всем шардам), reconcile_counters, import_posts,
+список постов в админке и каскадное удаление постов при удалении
+пользователя: такие запросы падают с ShardNotResolved.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count
+from django.http import Http404
+
+from .models import AuthorShard, Comment, Group, Post, ShardKey, User
+from .paginator import (COMMENTS_PER_PAGE, CursorPaginator,
+                        MergedCursorPaginator)
+from .transfer import keep_dates
+
+SHARDED_MODELS = (Post, Comment)
+# Как часто процесс перечитывает карту переносов
+MAP_TTL = 5
+MAP_VERSION_KEY = 'posts:shard_map'
+# Сколько пар пост -> автор помнить в процессе: автор поста не меняется
+POST_AUTHORS_SIZE = 10000
+
+# Сколько ждать переноса автора перед записью его постов, секунды
+MOVE_WRITE_TIMEOUT = 30
+MOVING_KEY = 'posts:moving:{}'
+
+_post_authors = {}
+
+
+class ShardNotResolved(Exception):
+    """Запрос к постам или комментариям, шард которого неизвестен:
+    без шардов он молча прочитал бы пустые таблицы default."""
+
+
+class AuthorMoving(Exception):
+    """Автор переносится между шардами: запись его постов
+    и комментариев сейчас потерялась бы."""
+
+
+def shards():
+    return list(getattr(settings, 'POST_SHARDS', []))
+
+
+def enabled():
+    return bool(shards())
+
+
+class ShardMap:
+    """Автор -> алиас шарда. Переносы читаются из AuthorShard
+    и кешируются в процессе; после переноса rebalance_shards меняет
+    версию в общем кеше, и процессы перечитывают карту не позже
+    чем через MAP_TTL секунд."""
+
+    def __init__(self):
+        self._moved = None
+        self._version = None
+        self._checked = 0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._moved is not None and now - self._checked < MAP_TTL:
+            return
+        self._checked = now
+        version = cache.get(MAP_VERSION_KEY)
+        if self._moved is None or version != self._version:
+            self._moved = dict(
+                AuthorShard.objects.using(DEFAULT_DB_ALIAS)
+                .values_list('author_id', 'shard')
+            )
+            self._version = version
+
+    def reload(self):
+        self._moved = None
+
+    def invalidate(self):
+        try:
+            cache.incr(MAP_VERSION_KEY)
+        except ValueError:
+            cache.set(MAP_VERSION_KEY, 1, timeout=None)
+        self._moved = None
+
+    def home(self, author_id):
+        """Шард по остатку от деления, без учета переносов."""
+        aliases = shards()
+        return aliases[author_id % len(aliases)]
+
+    def shard_for(self, author_id):
+        self._refresh()
+        return self._moved.get(author_id) or self.home(author_id)
+
+    def shards_for(self, author_ids):
+        """Шарды, где лежат посты этих авторов, в порядке settings."""
+        wanted = {self.shard_for(author_id) for author_id in author_ids}
+        return [alias for alias in shards() if alias in wanted]
+
+
+shard_map = ShardMap()
+
+
+def is_moving(author_id):
+    return bool(cache.get(MOVING_KEY.format(author_id)))
+
+
+def wait_for_move(author_id, timeout=None):
+    """Ждет окончания переноса автора. После переноса карта
+    перечитывается сразу, чтобы запись ушла в новый шард.
+    Возвращает True, если пришлось ждать."""
+    if not is_moving(author_id):
+        return False
+    if timeout is None:
+        timeout = MOVE_WRITE_TIMEOUT
+    deadline = time.monotonic() + timeout
+    while is_moving(author_id):
+        if time.monotonic() > deadline:
+            raise AuthorMoving(
+                f'Автор {author_id} переносится между шардами'
+            )
+        time.sleep(0.1)
+    shard_map.reload()
+    return True
+
+
+def post_author(post_id):
+    author_id = _post_authors.get(post_id)
+    if author_id is None:
+        author_id = ShardKey.objects.using(DEFAULT_DB_ALIAS).filter(
+            pk=post_id
+        ).values_list('author_id', flat=True).first()
+        if author_id is not None:
+            if len(_post_authors) >= POST_AUTHORS_SIZE:
+                _post_authors.clear()
+            _post_authors[post_id] = author_id
+    return author_id
+
+
+def shard_for_post(post_id):
+    author_id = post_author(post_id)
+    return None if author_id is None else shard_map.shard_for(author_id)
+
+
+def for_author(queryset, author_id):
+    """Запрос к постам или комментариям автора - в его шард."""
+    if not enabled():
+        return queryset
+    return queryset.using(shard_map.shard_for(author_id))
+
+
+def for_post(queryset, post_id):
+    """Запрос к посту или его комментариям - в шард поста."""
+    if not enabled():
+        return queryset
+    shard = shard_for_post(post_id)
+    return queryset.none() if shard is None else queryset.using(shard)
+
+
+def attach_related(objects, fields=('author', 'group')):
+    """Подставляет объекты из default в внешние ключи строк шарда:
+    по одному in_bulk на поле вместо JOIN."""
+    models = {'author': User, 'group': Group}
+    for name in fields:
+        ids = {getattr(obj, f'{name}_id') for obj in objects} - {None}
+        related = models[name].objects.using(DEFAULT_DB_ALIAS).in_bulk(ids)
+        for obj in objects:
+            value = getattr(obj, f'{name}_id')
+            if value is not None:
+                setattr(obj, name, related[value])
+    return objects
+
+
+def select_related(queryset, *fields):
+    """select_related для постов и комментариев: в режиме шардов
+    возвращает список со связанными объектами из default."""
+    if not enabled():
+        return queryset.select_related(*fields)
+    return attach_related(list(queryset.select_related(None)), fields)
+
+
+def get_post_or_404(post_id):
+    queryset = for_post(Post.objects, post_id)
+    posts = select_related(queryset.filter(pk=post_id), 'author', 'group')
+    if not posts:
+        raise Http404('Пост не найден')
+    return posts[0]
+
+
+def querysets(queryset, authors=None):
+    """queryset для каждого шарда с постами авторов authors
+    (None - всех шардов); без шардов - сам queryset."""
+    if not enabled():
+        return [queryset]
+    aliases = shards() if authors is None else shard_map.shards_for(authors)
+    return [queryset.using(alias) for alias in aliases]
+
+
+def paginator(queryset, authors=None, related=('author', 'group'),
+              **kwargs):
+    """CursorPaginator по постам; в режиме шардов - слияние страниц
+    шардов авторов authors (None - всех шардов).
+    related - связанные объекты для шаблона; для values() - пусто."""
+    if not enabled():
+        if related:
+            queryset = queryset.select_related(*related)
+        return CursorPaginator(queryset, **kwargs)
+    transform = kwargs.pop('transform', None)
+
+    def attach(posts):
+        if related:
+            attach_related(posts, related)
+        return transform(posts) if transform else posts
+
+    return MergedCursorPaginator(
+        querysets(queryset, authors),
+        transform=attach,
+        **kwargs,
+    )
+
+
+def comments_paginator(post_id, per_page=COMMENTS_PER_PAGE):
+    """CursorPaginator по комментариям поста, новые сверху, с авторами:
+    JOIN'ом или, в режиме шардов, одним in_bulk."""
+    comments = for_post(Comment.objects, post_id).filter(post_id=post_id)
+    options = {'per_page': per_page, 'ordering': ('-created', '-id')}
+    if not enabled():
+        return CursorPaginator(comments.select_related('author'), **options)
+    return CursorPaginator(
+        comments,
+        transform=lambda rows: attach_related(rows, ('author',)),
+        **options,
+    )
+
+
+def allocate_key(instance):
+    """Выдает id новому посту или комментарию."""
+    if isinstance(instance, Post):
+        author_id = instance.author_id
+    else:
+        author_id = post_author(instance.post_id)
+    instance.pk = ShardKey.objects.using(DEFAULT_DB_ALIAS).create(
+        author_id=author_id
+    ).pk
+
+
+def _copy_author(author_id, source, target):
+    """Копирует посты автора и комментарии к ним, которых еще нет
+    в target. Id сохраняются, даты - тоже."""
+    posts = list(Post.objects.using(source).filter(author_id=author_id))
+    comments = list(
+        Comment.objects.using(source).filter(post__author_id=author_id)
+    )
+    with keep_dates():
+        Post.objects.using(target).bulk_create(posts, ignore_conflicts=True)
+        Comment.objects.using(target).bulk_create(
+            comments, ignore_conflicts=True
+        )
+    return len(posts), len(comments)
+
+
+def _author_rows(author_id, alias):
+    """Все поля постов автора и комментариев к ним в шарде alias."""
+    posts = Post.objects.using(alias).filter(author_id=author_id)
+    comments = Comment.objects.using(alias).filter(
+        post__author_id=author_id
+    )
+    return (
+        list(posts.order_by('pk').values_list()),
+        list(comments.order_by('pk').values_list()),
+    )
+
+
+def _delete_author(author_id, alias):
+    # В обход сигналов: пост не исчез, счетчики и картинки
+    # трогать не нужно
+    Comment.objects.using(alias).filter(
+        post__author_id=author_id
+    )._raw_delete(alias)
+    Post.objects.using(alias).filter(author_id=author_id)._raw_delete(alias)
+
+
+def _switch(author_id, alias):
+    """Записывает автора в шард alias и просит процессы
+    перечитать карту."""
+    overrides = AuthorShard.objects.using(DEFAULT_DB_ALIAS)
+    if alias == shard_map.home(author_id):
+        overrides.filter(author_id=author_id).delete()
+    else:
+        overrides.update_or_create(
+            author_id=author_id, defaults={'shard': alias}
+        )
+    shard_map.invalidate()
+
+
+def move_author(author_id, target, wait=MAP_TTL):
+    """Переносит автора в шард target, не останавливая сайт.
+
+    На время переноса запись постов и комментариев автора ждет
+    (см. wait_for_move). Строки копируются в target, затем карта
+    переключается на него, и после wait секунд (за это время все
+    процессы перечитают карту) старые строки удаляются, если они
+    совпадают с копией. Если старый шард успел измениться, карта
+    возвращается на него, копия удаляется, и бросается AuthorMoving.
+    Возвращает (постов, комментариев)."""
+    source = shard_map.shard_for(author_id)
+    if source == target:
+        return 0, 0
+    key = MOVING_KEY.format(author_id)
+    cache.set(key, True, timeout=2 * wait + MOVE_WRITE_TIMEOUT)
+    try:
+        moved = _copy_author(author_id, source, target)
+        _switch(author_id, target)
+        time.sleep(wait)
+        if _author_rows(author_id, source) != _author_rows(
+                author_id, target):
+            _switch(author_id, source)
+            time.sleep(wait)
+            _delete_author(author_id, target)
+            raise AuthorMoving(
+                f'Строки автора {author_id} в {source} изменились '
+                f'во время переноса, перенос отменен'
+            )
+        _delete_author(author_id, source)
+    finally:
+        cache.delete(key)
+    return moved
+
+
+def plan_moves():
+    """Жадный план выравнивания шардов по числу постов:
+    самые плодовитые авторы переезжают из нагруженных шардов
+    в самый легкий, пока это сокращает разрыв.
+    Возвращает [(автор, откуда, куда, постов)]."""
+    loads = dict.fromkeys(shards(), 0)
+    authors = []
+    for alias in loads:
+        counts = Post.objects.using(alias).order_by().values_list(
+            'author_id'
+        ).annotate(count=Count('id'))
+        for author_id, count in counts:
+            loads[alias] += count
+            authors.append((count, author_id, alias))
+    moves = []
+    for count, author_id, alias in sorted(authors, reverse=True):
+        lightest = min(loads, key=loads.get)
+        if loads[alias] - loads[lightest] > count:
+            loads[alias] -= count
+            loads[lightest] += count
+            moves.append((author_id, alias, lightest, count))
+    return moves
+
+
+class ShardRouter:
+    """Пишет посты и комментарии в шард автора поста, остальное
+    отдает следующим роутерам. Чтение постов и комментариев
+    без объекта-подсказки (админка, queryset без using) не знает
+    шарда: вместо пустого default - ShardNotResolved."""
+
+    def _shard(self, model, instance, strict=False):
+        if not enabled() or model not in SHARDED_MODELS:
+            return None
+        if instance is not None and instance._state.db in shards():
+            return instance._state.db
+        shard = None
+        if isinstance(instance, Post):
+            shard = shard_map.shard_for(instance.author_id)
+        elif isinstance(instance, Comment):
+            shard = shard_for_post(instance.post_id)
+        if shard is None and strict:
+            raise ShardNotResolved(
+                f'Шард для {model._meta.label} неизвестен: используйте '
+                f'posts.sharding.querysets, for_author или for_post'
+            )
+        return shard
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints.get('instance'), strict=True)
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        author_id = None
+        if enabled() and isinstance(instance, Post):
+            author_id = instance.author_id
+        elif enabled() and isinstance(instance, Comment):
+            author_id = post_author(instance.post_id)
+        if author_id is not None and wait_for_move(author_id):
+            # Объект мог быть прочитан из старого шарда
+            return shard_map.shard_for(author_id)
+        return self._shard(model, instance)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Автор и группа поста лежат в default, сам пост - в шарде
+        if enabled():
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -0,0 +1,153 @@
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import (cache_versions, counters, live, sharding, thumbnails,
+               timeline)
+from .models import Comment, Follow, Group, Post, ShardKey, User
+
+# Поля пользователя, которые выводятся на страницах
+DISPLAYED_USER_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+@receiver(post_init, sender=Post)
+def post_loaded(sender, instance, **kwargs):
+    # Запоминаем группу, чтобы при смене группы поправить счетчики,
+    # и картинку, чтобы делать миниатюры только для новой
+    instance._counted_group_id = instance.group_id
+    instance._thumbnailed_image = instance.image.name
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Comment)
+def allocate_shard_key(sender, instance, raw=False, **kwargs):
+    # В режиме шардов id выдает ShardKey, а не автоинкремент шарда
+    if not raw and instance.pk is None and sharding.enabled():
+        sharding.allocate_key(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.bump_user(instance.author_id, posts_count=1)
+        counters.bump_group(instance.group_id, 1)
+        # Редактирование поста не меняет ленты, раскладываем только новые
+        timeline.schedule_fan_out(instance)
+    elif instance._counted_group_id != instance.group_id:
+        counters.bump_group(instance._counted_group_id, -1)
+        counters.bump_group(instance.group_id, 1)
+    cache_versions.bump_post(instance, instance._counted_group_id)
+    if created:
+        # Ожидающие новых постов клиенты проверят ленты после коммита
+        transaction.on_commit(live.notify)
+    instance._counted_group_id = instance.group_id
+    if instance.image and instance.image.name != instance._thumbnailed_image:
+        thumbnails.warm_in_background(instance.image.name)
+    instance._thumbnailed_image = instance.image.name
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, posts_count=-1)
+    counters.bump_group(instance._counted_group_id, -1)
+    cache_versions.bump_post(instance, instance._counted_group_id)
+    if sharding.enabled():
+        ShardKey.objects.filter(pk=instance.pk).delete()
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_post(instance.post_id, 1)
+        cache_versions.bump(cache_versions.POST, instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.bump_post(instance.post_id, -1)
+    cache_versions.bump(cache_versions.POST, instance.post_id)
+    if sharding.enabled():
+        ShardKey.objects.filter(pk=instance.pk).delete()
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_user(instance.author_id, followers_count=1)
+        counters.bump_user(instance.user_id, following_count=1)
+        timeline.backfill(instance.user_id, instance.author_id)
+        cache_versions.bump(cache_versions.TIMELINE, instance.user_id)
+        cache_versions.bump(cache_versions.FOLLOWERS, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, followers_count=-1)
+    counters.bump_user(instance.user_id, following_count=-1)
+    timeline.prune(instance.user_id, instance.author_id)
+    cache_versions.bump(cache_versions.TIMELINE, instance.user_id)
+    cache_versions.bump(cache_versions.FOLLOWERS, instance.author_id)
+
+
+def _bump_group_authors(group_id):
+    # Ссылка на группу есть у каждого поста в профиле его автора
+    posts = Post.objects.filter(group_id=group_id)
+    author_ids = set()
+    for queryset in sharding.querysets(posts):
+        author_ids.update(
+            queryset.values_list('author_id', flat=True).distinct()
+        )
+    for author_id in author_ids:
+        cache_versions.bump(cache_versions.AUTHOR, author_id)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # Название и slug группы выводятся и в общей ленте
+        cache_versions.bump(cache_versions.GROUP, instance.pk)
+        cache_versions.bump(cache_versions.GLOBAL)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, raw=False, **kwargs):
+    # У новой группы еще нет постов
+    if not created and not raw:
+        _bump_group_authors(instance.pk)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # После удаления у постов group_id уже пустой
+    _bump_group_authors(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, raw=False, update_fields=None,
+                 **kwargs):
+    # Новый пользователь еще нигде не выводится, а вход в систему
+    # сохраняет только last_login
+    if created or raw or (
+            update_fields is not None
+            and not DISPLAYED_USER_FIELDS & set(update_fields)):
+        return
+    # Имя автора есть в общей ленте, профиле, лентах групп его постов
+    # и на страницах постов, которые он комментировал
+    cache_versions.bump(cache_versions.AUTHOR, instance.pk)
+    cache_versions.bump(cache_versions.GLOBAL)
+    posts = Post.objects.filter(author_id=instance.pk)
+    group_ids = set()
+    for queryset in sharding.querysets(posts, [instance.pk]):
+        group_ids.update(queryset.exclude(group=None).values_list(
+            'group_id', flat=True
+        ).distinct())
+    for group_id in group_ids:
+        cache_versions.bump(cache_versions.GROUP, group_id)
+    comments = Comment.objects.filter(author_id=instance.pk)
+    for queryset in sharding.querysets(comments):
+        for post_id in queryset.values_list('post_id', flat=True).distinct():
+            cache_versions.bump(cache_versions.POST, post_id)
@@ -0,0 +1,12 @@
+from django import template
+
+from ..cache_versions import get_version
+
+register = template.Library()
+
+
+@register.simple_tag
+def cache_version(scope, pk=None):
+    """Версия области кеша для ключа {% cache %}:
+    {% cache_version 'group' group.pk as version %}"""
+    return get_version(scope, pk)
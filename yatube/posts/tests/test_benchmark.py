@@ -0,0 +1,39 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from .. import benchmark
+from ..models import Comment, Follow, Post
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_generate_and_run(self):
+        """Генератор создает данные, замер проходит по всем страницам"""
+        benchmark.generate(
+            users=10, groups=2, posts=50, follows=3, comments=30, seed=1
+        )
+        self.assertEqual(Post.objects.count(), 50)
+        self.assertEqual(Comment.objects.count(), 30)
+        self.assertTrue(Follow.objects.exists())
+        results = benchmark.run(requests=2, warmup=1)
+        self.assertEqual(
+            {name.split(':')[0] for name in results},
+            {'index', 'group_posts', 'profile', 'post_detail',
+             'follow_index'},
+        )
+        for result in results.values():
+            self.assertEqual(result['requests'], 2)
+            self.assertGreaterEqual(result['p90_ms'], result['p50_ms'])
+
+    def test_compare_flags_regressions(self):
+        """Медленнее порога или больше запросов - регрессия"""
+        baseline = {'index:cold': {'p50_ms': 10, 'p90_ms': 20, 'queries': 5}}
+        self.assertEqual(benchmark.compare(baseline, {
+            'index:cold': {'p50_ms': 11, 'p90_ms': 23, 'queries': 5},
+        }), [])
+        regressions = benchmark.compare(baseline, {
+            'index:cold': {'p50_ms': 13, 'p90_ms': 20, 'queries': 6},
+        })
+        self.assertEqual(len(regressions), 2)
@@ -0,0 +1,89 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..counters import stats_for
+from ..models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+
+class CountersTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.other_group = Group.objects.create(
+            title='Вторая группа',
+            slug='other-slug',
+            description='Тестовое описание',
+        )
+
+    def setUp(self):
+        # Свежие объекты, чтобы не тянуть закешированные stats между тестами
+        self.author = User.objects.get(pk=self.author.pk)
+        self.reader = User.objects.get(pk=self.reader.pk)
+
+    def test_counters_follow_writes(self):
+        """Счетчики меняются при создании и удалении объектов"""
+        stats_for(self.author)
+        post = Post.objects.create(
+            author=self.author, text='Пост', group=self.group
+        )
+        Comment.objects.create(post=post, author=self.reader, text='Ком')
+        Follow.objects.create(user=self.reader, author=self.author)
+        stats = UserStats.objects.get(user=self.author)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 1)
+        self.assertEqual(stats_for(self.reader).following_count, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        post.group = self.other_group
+        post.save()
+        self.group.refresh_from_db()
+        self.other_group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.other_group.posts_count, 1)
+        post.delete()
+        stats.refresh_from_db()
+        self.assertEqual(stats.posts_count, 0)
+
+    def test_save_keeps_concurrent_increments(self):
+        """Сохранение устаревшего объекта не затирает счетчики"""
+        post = Post.objects.create(
+            author=self.author, text='Пост', group=self.group
+        )
+        group = Group.objects.get(pk=self.group.pk)
+        Comment.objects.create(post=post, author=self.reader, text='Ком')
+        Post.objects.create(author=self.author, text='Еще', group=self.group)
+        post.text = 'Исправленный пост'
+        post.save()
+        group.description = 'Новое описание'
+        group.save()
+        post.refresh_from_db()
+        group.refresh_from_db()
+        self.assertEqual(post.text, 'Исправленный пост')
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(group.description, 'Новое описание')
+        self.assertEqual(group.posts_count, 2)
+
+    def test_reconcile_counters_repairs_drift(self):
+        """Команда reconcile_counters чинит разошедшиеся счетчики"""
+        Post.objects.create(author=self.author, text='Пост', group=self.group)
+        stats_for(self.author)
+        UserStats.objects.update(posts_count=42)
+        Group.objects.update(posts_count=42)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 1
+        )
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.test import TestCase
+from django.urls import reverse
+
+from .. import query_plans
+from ..models import Follow, Group, Post
+
+User = get_user_model()
+
+
+class QueryPlansTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        for i in range(12):
+            Post.objects.create(
+                author=self.author, text=f'Пост {i}', group=self.group
+            )
+
+    def test_problems_in_plan(self):
+        """Полный проход и временная сортировка - проблемы"""
+        self.assertEqual(query_plans.problems_in([
+            'SCAN posts_post',
+            'SCAN posts_post USING INDEX post_pub_date_idx',
+            'USE TEMP B-TREE FOR ORDER BY',
+        ]), ['SCAN posts_post', 'USE TEMP B-TREE FOR ORDER BY'])
+
+    def test_feeds_use_indexes(self):
+        """Ленты и их вторые страницы читаются по индексам"""
+        report = query_plans.audit([
+            ('index', reverse('posts:index'), None),
+            ('group_posts', reverse('posts:group_posts', args=['test-slug']),
+             None),
+            ('profile', reverse('posts:profile', args=['author']), None),
+        ])
+        self.assertTrue(any(
+            'pub_date_idx' in line
+            for _, _, plan, _ in report for line in plan
+        ))
+        self.assertEqual(
+            [(name, sql) for name, sql, _, problems in report if problems],
+            [],
+        )
+
+    def test_follow_is_unique(self):
+        """Повторная подписка на того же автора запрещена базой"""
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.author)
+        with self.assertRaises(IntegrityError):
+            Follow.objects.create(user=reader, author=self.author)
@@ -0,0 +1,77 @@
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Post
+
+User = get_user_model()
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.match = Post.objects.create(
+            author=cls.user, text='Котики любят спать на солнце'
+        )
+        cls.other = Post.objects.create(
+            author=cls.user, text='Собаки любят гулять'
+        )
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def search(self, query, **params):
+        return self.guest_client.get(
+            reverse('posts:post_search'), {'q': query, **params}
+        )
+
+    def test_search_finds_posts_by_words_and_prefix(self):
+        """Поиск находит посты по словам и началу последнего слова"""
+        response = self.search('котики')
+        self.assertEqual(list(response.context['page_obj']), [self.match])
+        response = self.search('любят')
+        self.assertEqual(len(response.context['page_obj']), 2)
+        response = self.search('любят сол')
+        self.assertEqual(list(response.context['page_obj']), [self.match])
+
+    def test_index_follows_edits_and_deletes(self):
+        """Индекс обновляется при редактировании и удалении поста"""
+        # Работаем с копиями, чтобы не менять объекты класса
+        other = Post.objects.get(pk=self.other.pk)
+        other.text = 'Собаки и котики дружат'
+        other.save()
+        self.assertEqual(len(self.search('котики').context['page_obj']), 2)
+        Post.objects.get(pk=self.match.pk).delete()
+        self.assertEqual(
+            list(self.search('котики').context['page_obj']), [self.other]
+        )
+
+    def test_results_are_paginated_by_cursor(self):
+        """Результаты листаются курсором, запрос сохраняется в ссылках"""
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Пост про котиков номер {i}')
+            for i in range(12)
+        )
+        first_page = self.search('котиков').context['page_obj']
+        self.assertEqual(len(first_page), 10)
+        response = self.search('котиков', cursor=first_page.next_cursor)
+        second_page = response.context['page_obj']
+        self.assertEqual(len(second_page), 2)
+        self.assertFalse(set(first_page) & set(second_page))
+        self.assertContains(response, 'q=%D0%BA%D0%BE%D1%82')
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке находит посты через индекс"""
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'
+        )
+        client = Client()
+        client.force_login(admin)
+        response = client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'собаки'}
+        )
+        self.assertEqual(
+            list(response.context['cl'].result_list), [self.other]
+        )
@@ -0,0 +1,193 @@
+import logging
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import Client, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from .. import sharding
+from ..models import Comment, Follow, Group, Post, ShardKey
+from ..paginator import MergedCursorPaginator
+
+User = get_user_model()
+
+SHARDS = ['shard1', 'shard2']
+
+
+# Бюджеты запросов представлений рассчитаны на одну базу: в шардах
+# добавляются запросы к каждому шарду и подгрузка авторов и групп
+@override_settings(POST_SHARDS=SHARDS, QUERY_BUDGET_RAISE=False)
+class ShardingTests(TransactionTestCase):
+    databases = {'default', *SHARDS}
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        # Миграции в общей тестовой базе в памяти снова включили
+        # проверку внешних ключей, которую выключает PRAGMAS шардов
+        for alias in SHARDS:
+            connections[alias].disable_constraint_checking()
+        cache.clear()
+        sharding.shard_map.invalidate()
+        sharding._post_authors.clear()
+        self.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        # id 1 и 2 попадают в разные шарды
+        self.odd = User.objects.create_user(username='odd', pk=1)
+        self.even = User.objects.create_user(username='even', pk=2)
+        self.posts = [
+            Post.objects.create(
+                author=author, text=f'Пост {number}', group=self.group
+            )
+            for number in range(3) for author in (self.odd, self.even)
+        ]
+        self.client = Client()
+        self.client.force_login(self.odd)
+
+    def shard_posts(self, alias):
+        return set(Post.objects.using(alias).values_list('id', flat=True))
+
+    def test_posts_stored_on_author_shard(self):
+        """Посты лежат в шарде автора, id не повторяются"""
+        odd = {post.pk for post in self.posts if post.author == self.odd}
+        even = {post.pk for post in self.posts if post.author == self.even}
+        self.assertEqual(self.shard_posts('shard2'), odd)
+        self.assertEqual(self.shard_posts('shard1'), even)
+        self.assertFalse(Post.objects.using('default').exists())
+
+    def test_index_merges_shards_in_order(self):
+        """Главная сливает шарды по дате публикации"""
+        response = self.client.get(reverse('posts:index'))
+        page = list(response.context['page_obj'])
+        self.assertEqual(page, self.posts[::-1])
+        self.assertEqual(page[0].author, self.even)
+        self.assertEqual(page[0].group, self.group)
+
+    def test_api_feed_merges_shards(self):
+        """JSON API читает ленту из всех шардов"""
+        data = self.client.get(reverse('api:index')).json()
+        self.assertEqual(
+            [(post['id'], post['author']) for post in data['results']],
+            [(post.pk, post.author.username) for post in self.posts[::-1]]
+        )
+
+    def test_merged_paginator_pages(self):
+        """Курсоры ведут по объединенной ленте без пропусков"""
+        paginator = MergedCursorPaginator(
+            [Post.objects.using(alias) for alias in SHARDS], per_page=4
+        )
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        self.assertEqual(list(first) + list(second), self.posts[::-1])
+        self.assertFalse(second.has_next())
+        self.assertEqual(
+            list(paginator.get_page(second.previous_cursor)), list(first)
+        )
+
+    def test_post_detail_and_comment(self):
+        """Комментарий хранится рядом с постом и виден на его странице"""
+        post = self.posts[1]
+        self.client.post(
+            reverse('posts:add_comment', args=[post.pk]),
+            data={'text': 'Комментарий'},
+        )
+        comment = Comment.objects.using('shard1').get()
+        self.assertEqual(comment.post_id, post.pk)
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk])
+        )
+        self.assertEqual(list(response.context['comments']), [comment])
+        self.assertEqual(response.context['post'].comments_count, 1)
+
+    def test_follow_index_reads_author_shards(self):
+        """Лента подписок собирается из шардов авторов"""
+        Follow.objects.create(user=self.odd, author=self.even)
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']),
+            [post for post in self.posts[::-1] if post.author == self.even]
+        )
+
+    def test_rebalance_moves_author(self):
+        """Перенос автора переносит посты и комментарии"""
+        post = self.posts[0]
+        Comment.objects.create(post=post, author=self.even, text='Текст')
+        call_command(
+            'rebalance_shards', author=self.odd.pk, to='shard1', wait=0,
+            stdout=StringIO(),
+        )
+        self.assertEqual(self.shard_posts('shard2'), set())
+        self.assertEqual(len(self.shard_posts('shard1')), len(self.posts))
+        self.assertEqual(sharding.shard_map.shard_for(self.odd.pk), 'shard1')
+        moved = Post.objects.using('shard1').get(pk=post.pk)
+        self.assertEqual(moved.pub_date, post.pub_date)
+        self.assertTrue(Comment.objects.using('shard1').filter(post=post))
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk])
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_source_is_kept_if_it_changed_during_move(self):
+        """Правка в старом шарде во время переноса отменяет перенос"""
+        post = self.posts[0]
+
+        def edit(seconds):
+            Post.objects.using('shard2').filter(pk=post.pk).update(
+                text='Правка'
+            )
+
+        with mock.patch.object(sharding.time, 'sleep', edit):
+            with self.assertRaises(sharding.AuthorMoving):
+                sharding.move_author(self.odd.pk, 'shard1', wait=0)
+        self.assertEqual(
+            Post.objects.using('shard2').get(pk=post.pk).text, 'Правка'
+        )
+        self.assertEqual(sharding.shard_map.shard_for(self.odd.pk), 'shard2')
+        self.assertFalse(
+            Post.objects.using('shard1').filter(author=self.odd).exists()
+        )
+        self.assertFalse(sharding.is_moving(self.odd.pk))
+
+    def test_writes_wait_for_move(self):
+        """Запись постов переносимого автора ждет конца переноса"""
+        cache.set(sharding.MOVING_KEY.format(self.odd.pk), True)
+        post = self.posts[0]
+        post.text = 'Правка'
+        with mock.patch.object(sharding, 'MOVE_WRITE_TIMEOUT', 0):
+            with self.assertRaises(sharding.AuthorMoving):
+                post.save()
+        self.assertNotEqual(
+            Post.objects.using('shard2').get(pk=post.pk).text, 'Правка'
+        )
+
+    def test_unhinted_reads_fail_loudly(self):
+        """Запрос без шарда - ошибка, а не пустой результат из default"""
+        with self.assertRaises(sharding.ShardNotResolved):
+            list(Post.objects.all())
+        with self.assertRaises(sharding.ShardNotResolved):
+            self.odd.posts.count()
+
+    def test_deleted_comment_frees_shard_key(self):
+        """Удаление комментария удаляет и его ключ"""
+        comment = Comment.objects.create(
+            post=self.posts[0], author=self.even, text='Текст'
+        )
+        self.assertTrue(ShardKey.objects.filter(pk=comment.pk).exists())
+        comment.delete()
+        self.assertFalse(ShardKey.objects.filter(pk=comment.pk).exists())
+
+    def test_plan_moves_balances_load(self):
+        """План переносит автора из перегруженного шарда"""
+        # Во втором шарде 3 поста odd и 5 постов prolific, в первом - 3:
+        # перенос odd сокращает разрыв, перенос prolific - нет
+        prolific = User.objects.create_user(username='prolific', pk=3)
+        for number in range(5):
+            Post.objects.create(author=prolific, text=f'Еще {number}')
+        self.assertEqual(
+            sharding.plan_moves(), [(self.odd.pk, 'shard2', 'shard1', 3)]
+        )
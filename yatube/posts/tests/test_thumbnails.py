@@ -0,0 +1,95 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.images import ImageFile
+
+from .. import thumbnails
+from ..models import Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailsTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # KVStore sorl лежит и в кеше, который не откатывается с базой
+        cache.clear()
+        self.user = User.objects.create_user(username='auth')
+
+    def create_post(self):
+        return Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='small.gif', content=SMALL_GIF, content_type='image/gif'
+            ),
+        )
+
+    def test_saving_image_schedules_thumbnails(self):
+        """Новая картинка ставит генерацию миниатюр, правка текста - нет"""
+        with mock.patch.object(thumbnails, 'warm_in_background') as warm:
+            post = self.create_post()
+            warm.assert_called_once_with(post.image.name)
+            post.text = 'Новый текст'
+            post.save()
+            warm.assert_called_once()
+
+    def test_warm_image_creates_thumbnails(self):
+        """После прогрева миниатюра уже есть в хранилище sorl"""
+        post = self.create_post()
+        self.assertEqual(
+            thumbnails.warm_image(post.image.name), len(thumbnails.THUMBNAILS)
+        )
+        source = default.kvstore.get(ImageFile(post.image.name))
+        self.assertIsNotNone(source)
+        self.assertEqual(len(default.kvstore._get(
+            source.key, identity='thumbnails'
+        )), len(thumbnails.THUMBNAILS))
+
+    def test_resolve_reads_page_in_one_batch(self):
+        """Миниатюры страницы берутся одной выборкой без проверок файлов"""
+        posts = [self.create_post() for _ in range(3)]
+        posts.append(Post.objects.create(author=self.user, text='Без'))
+        for post in posts[:3]:
+            thumbnails.warm_image(post.image.name)
+        expected = {
+            post.pk: get_thumbnail(
+                post.image, '960x339', crop='center', upscale=True
+            ).url
+            for post in posts[:3]
+        }
+        cache.clear()
+        with mock.patch.object(
+                default.storage, 'exists',
+                side_effect=AssertionError('лишняя проверка файла')):
+            with self.assertNumQueries(1):
+                resolved = thumbnails.resolve(posts)
+        self.assertEqual(
+            {pk: image.url for pk, image in resolved.items()}, expected
+        )
+        thumbnails.attach(posts)
+        self.assertFalse(posts[3].thumbnail)
+        self.assertEqual(posts[0].thumbnail.url, expected[posts[0].pk])
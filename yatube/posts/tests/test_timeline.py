@@ -0,0 +1,82 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from jobs.models import Job
+from jobs.queue import run_pending
+
+from .. import timeline
+from ..models import Follow, Post, TimelineEntry
+
+User = get_user_model()
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.old_post = Post.objects.create(
+            author=cls.author,
+            text='Пост до подписки',
+        )
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_follow_backfills_and_new_post_fans_out(self):
+        """Подписка добавляет старые посты, новый пост попадает в ленту"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']),
+            [new_post, self.old_post]
+        )
+
+    def test_large_fan_out_runs_in_worker(self):
+        """Пост автора с большим числом подписчиков раскладывает воркер"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        # Свежий объект: счетчики подписчиков в self.author устарели
+        author = User.objects.get(pk=self.author.pk)
+        with mock.patch.object(timeline, 'FAN_OUT_INLINE_LIMIT', 0):
+            new_post = Post.objects.create(author=author, text='Новый')
+        self.assertFalse(
+            TimelineEntry.objects.filter(post=new_post).exists()
+        )
+        # Лента без нового поста попадает в кеш фрагментов
+        url = reverse('posts:follow_index')
+        self.assertNotContains(self.reader_client.get(url), 'Новый')
+        run_pending()
+        self.assertContains(self.reader_client.get(url), 'Новый')
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(post=new_post).values_list(
+                'user', flat=True
+            )),
+            [self.reader.pk]
+        )
+
+    def test_unfollow_prunes_timeline(self):
+        """После отписки посты автора уходят из ленты"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.reader_client.get(
+            reverse('posts:profile_unfollow', args=[self.author.username])
+        )
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader))
+
+    def test_rebuild_timelines_command(self):
+        """Команда восстанавливает ленты по подпискам"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list('user', 'post')),
+            [(self.reader.pk, self.old_post.pk)]
+        )
@@ -7,7 +7,11 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from core.query_budget import QueryBudgetMixin
 from ..models import Group, Post, Comment, Follow
+from ..paginator import COMMENTS_PER_PAGE
 from django import forms
 
 
@@ -21,7 +25,7 @@ TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 # Для сохранения media-файлов в тестах будет использоваться
 # временная папка TEMP_MEDIA_ROOT, а потом мы ее удалим
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
-class TaskPagesTests(TestCase):
+class TaskPagesTests(QueryBudgetMixin, TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
@@ -62,6 +66,8 @@ class TaskPagesTests(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        # Фрагменты из прошлых тестов могли пережить откат базы
+        cache.clear()
         # Создаем авторизованный клиент
         self.user = User.objects.create_user(username='auth')
         self.authorized_client = Client()
@@ -222,15 +228,46 @@ class TaskPagesTests(TestCase):
                     get(reverse('posts:post_detail',
                                 kwargs={'post_id': 1}))
                     )
-        first_object = response.context['comments']
-        # Из-за QuerySet пришлось добавить .get()
-        # Без нее была бы ошибка, как ниже
-        # <QuerySet [<Comment: Test comment>]> != 'Test comment'
-        self.assertEqual(first_object.get().text, 'Test comment')
+        # Комментарии приходят страницей, берем первый
+        first_object = response.context['comments'][0]
+        self.assertEqual(first_object.text, 'Test comment')
         # Проверим и автора
-        self.assertEqual(first_object.get().author, self.user)
+        self.assertEqual(first_object.author, self.user)
         # Проверим и пост относящийся к комментарию
-        self.assertEqual(first_object.get().post.text, self.post.text)
+        self.assertEqual(first_object.post.text, self.post.text)
+
+    def test_comments_load_by_pages(self):
+        """Под постом первая пачка комментариев, остальные
+        подгружаются фрагментами по курсору"""
+        comments = [
+            Comment.objects.create(
+                post=self.post, author=self.user, text=f'Комментарий {i}'
+            )
+            for i in range(COMMENTS_PER_PAGE + 5)
+        ]
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', args=[self.post.pk])
+        )
+        page = response.context['comments']
+        self.assertEqual(
+            list(page), comments[::-1][:COMMENTS_PER_PAGE]
+        )
+        self.assertContains(response, 'Показать еще')
+        fragment_url = reverse('posts:post_comments', args=[self.post.pk])
+        with self.assertQueryBudget(4):
+            fragment = self.authorized_client.get(
+                fragment_url, {'cursor': page.next_cursor}
+            )
+        self.assertTemplateUsed(fragment, 'posts/includes/comments.html')
+        self.assertEqual(
+            list(fragment.context['comments']),
+            comments[::-1][COMMENTS_PER_PAGE:]
+        )
+        self.assertNotContains(fragment, 'Показать еще')
+        response = self.authorized_client.get(
+            reverse('posts:post_comments', args=[0])
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
 
     def test_cache(self):
         """Проверка кеширования главной страницы"""
@@ -253,6 +290,107 @@ class TaskPagesTests(TestCase):
         # Кол-во постов = 0
         self.assertEqual(count_after_del, count_before_del - 1)
 
+    def test_cache_invalidated_by_writes(self):
+        """Закешированные страницы обновляются сразу после записи"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'tester'}),
+        )
+        for url in urls:
+            self.authorized_client.get(url)
+        Post.objects.create(
+            author=self.post.author,
+            text='Свежий пост без ожидания кеша',
+            group=self.group,
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertContains(response, 'Свежий пост без ожидания кеша')
+        detail_url = reverse('posts:post_detail', args=[self.post.pk])
+        self.authorized_client.get(detail_url)
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Свежий комментарий'
+        )
+        response = self.authorized_client.get(detail_url)
+        self.assertContains(response, 'Свежий комментарий')
+
+    def test_cache_invalidated_by_username_change(self):
+        """Новое имя автора и комментатора видно сразу, старые ETag
+        больше не дают 304"""
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий'
+        )
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': 'test-slug'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        author = self.post.author
+        author.username = 'renamed_author'
+        author.save()
+        self.user.username = 'renamed_reader'
+        self.user.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertContains(response, 'renamed_author')
+        response = self.client.get(urls[-1])
+        self.assertContains(response, 'renamed_reader')
+
+    def test_profile_cache_invalidated_by_group_change(self):
+        """Новый slug группы сразу виден в профиле ее авторов"""
+        url = reverse('posts:profile', kwargs={'username': 'tester'})
+        self.assertContains(self.client.get(url), '/group/test-slug/')
+        group = Group.objects.get(pk=self.group.pk)
+        group.slug = 'new-slug'
+        group.save()
+        response = self.client.get(url)
+        self.assertContains(response, '/group/new-slug/')
+        self.assertNotContains(response, '/group/test-slug/')
+
+    def test_profile_etag_changes_with_group(self):
+        """После правки группы старый ETag профиля не дает 304"""
+        url = reverse('posts:profile', kwargs={'username': 'tester'})
+        etag = self.client.get(url)['ETag']
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Новое название'
+        group.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_conditional_get_returns_not_modified(self):
+        """Повторный запрос с If-None-Match получает 304,
+        после новой записи - снова 200"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'tester'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        etags = {}
+        for url in urls:
+            with self.subTest(url=url):
+                # Первый запрос выдает CSRF-cookie, которая входит в ETag
+                self.authorized_client.get(url)
+                etags[url] = self.authorized_client.get(url)['ETag']
+                response = self.authorized_client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[url]
+                )
+                self.assertEqual(
+                    response.status_code, HTTPStatus.NOT_MODIFIED
+                )
+        self.post.text = 'Отредактированный пост'
+        self.post.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[url]
+                )
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
     def test_new_post_in_feed_who_followed(self):
         """Новая запись пользователя появляется в ленте тех, кто на него
         подписан"""
@@ -280,7 +418,7 @@ class TaskPagesTests(TestCase):
         # QuerySet будет пустым без единого объекта
         # object_list он вернет список для того чтобы подсчитать кол-во
         second_object = response.context['page_obj']
-        self.assertEqual(second_object.object_list.count(), 0)
+        self.assertEqual(len(second_object.object_list), 0)
 
     def test_auth_user_can_follow(self):
         """Авторизованный пользователь может подписываться на других
@@ -337,7 +475,7 @@ class TaskPagesTests(TestCase):
         self.assertEqual(response.url, f'/auth/login/?next={url}')
 
 
-class PaginatorViewsTest(TestCase):
+class PaginatorViewsTest(QueryBudgetMixin, TestCase):
     # Здесь создаются фикстуры: клиент и 13 тестовых записей.
     @classmethod
     def setUpClass(cls):
@@ -358,6 +496,8 @@ class PaginatorViewsTest(TestCase):
             )
 
     def setUp(self):
+        # Фрагменты из прошлых тестов могли пережить откат базы
+        cache.clear()
         # Создаем авторизованный клиент
         self.user = User.objects.create_user(username='auth')
         self.authorized_client = Client()
@@ -374,13 +514,88 @@ class PaginatorViewsTest(TestCase):
             # Проверка: количество постов на первой странице равно 10.
             self.assertEqual(len(response.context['page_obj']), 10)
 
+    def test_pages_fit_query_budget(self):
+        """Страницы с полной страницей постов укладываются в бюджет
+        и не делают запросов на каждый пост"""
+        Follow.objects.create(
+            user=self.user, author=User.objects.get(username='tester')
+        )
+        post = Post.objects.filter(author__username='tester').first()
+        for i in range(6):
+            Comment.objects.create(post=post, author=self.user, text=str(i))
+        budgets = {
+            reverse('posts:index'): 5,
+            reverse('posts:group_posts', kwargs={'slug': 'test-slug'}): 6,
+            reverse('posts:profile', kwargs={'username': 'tester'}): 8,
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}): 8,
+            reverse('posts:follow_index'): 7,
+            reverse('posts:post_search') + '?q=пост': 5,
+        }
+        for url, budget in budgets.items():
+            with self.subTest(url=url):
+                with self.assertQueryBudget(budget):
+                    response = self.authorized_client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
     def test_second_page_contains_three_records(self):
         # Проверка: на второй странице должно быть три поста.
+        # Вторая страница открывается по курсору из первой
         urls = (
             reverse('posts:index'),
             reverse('posts:group_posts', kwargs={'slug': 'test-slug'}),
             reverse('posts:profile', kwargs={'username': 'tester'}),
         )
         for url in urls:
-            response = self.authorized_client.get(url + '?page=3')
-            self.assertEqual(len(response.context['page_obj']), 3)
+            with self.subTest(url=url):
+                first_page = self.authorized_client.get(url).context[
+                    'page_obj']
+                response = self.authorized_client.get(
+                    url, {'cursor': first_page.next_cursor}
+                )
+                page_obj = response.context['page_obj']
+                self.assertEqual(len(page_obj), 3)
+                self.assertFalse(page_obj.has_next())
+                # Посты на страницах не повторяются
+                self.assertFalse(
+                    set(first_page.object_list) & set(page_obj.object_list)
+                )
+
+    def test_previous_cursor_returns_first_page(self):
+        """Курсор "назад" со второй страницы возвращает первую"""
+        url = reverse('posts:index')
+        first_page = self.authorized_client.get(url).context['page_obj']
+        second_page = self.authorized_client.get(
+            url, {'cursor': first_page.next_cursor}
+        ).context['page_obj']
+        response = self.authorized_client.get(
+            url, {'cursor': second_page.previous_cursor}
+        )
+        self.assertEqual(
+            response.context['page_obj'].object_list,
+            first_page.object_list
+        )
+
+    def test_last_page_and_broken_cursor(self):
+        """Последняя страница без подсчета записей, битый курсор
+        открывает первую страницу"""
+        url = reverse('posts:index')
+        first_page = self.authorized_client.get(url).context['page_obj']
+        last_page = self.authorized_client.get(
+            url, {'cursor': first_page.last_cursor}
+        ).context['page_obj']
+        self.assertEqual(
+            last_page[-1], Post.objects.order_by('pub_date', 'id')[0]
+        )
+        self.assertFalse(last_page.has_next())
+        response = self.authorized_client.get(url, {'cursor': 'мусор'})
+        self.assertEqual(
+            response.context['page_obj'].object_list,
+            first_page.object_list
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.authorized_client.get(
+                url, {'cursor': first_page.next_cursor}
+            )
+        self.assertFalse(
+            [q for q in queries if 'COUNT(' in q['sql'].upper()]
+        )
@@ -0,0 +1,138 @@
+"""Заблаговременная генерация миниатюр.
+
+Без этого sorl делает миниатюру во время первого рендера страницы,
+где она нужна, и страница с десятком свежих картинок подвисает.
+Здесь миниатюры всех размеров из шаблонов создаются сразу после
+сохранения картинки воркером фоновой очереди (приложение jobs).
+
+Для страницы ленты адреса миниатюр всех постов берутся из хранилища
+sorl одним get_many (и одним запросом к базе для промахов), а не
+отдельным обращением и проверкой exists() из каждого {% thumbnail %}.
+"""
+import logging
+
+from django.db import close_old_connections
+from django.utils.functional import SimpleLazyObject
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore
+
+from core.query_budget import unbudgeted
+from jobs.queue import enqueue
+
+logger = logging.getLogger(__name__)
+
+# Размеры и параметры {% thumbnail %} из шаблонов постов.
+# Имя файла миниатюры зависит от параметров, поэтому они должны
+# совпадать с шаблонами буква в букву
+THUMBNAILS = (
+    ('960x339', {'crop': 'center', 'upscale': True}),
+)
+
+
+def warm_image(name):
+    """Создает все миниатюры для картинки из хранилища.
+    Возвращает количество обработанных размеров."""
+    done = 0
+    try:
+        for geometry, options in THUMBNAILS:
+            get_thumbnail(name, geometry, **options)
+            done += 1
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+    finally:
+        # sorl хранит сведения о миниатюрах в базе (KVStore)
+        close_old_connections()
+    return done
+
+
+def warm_in_background(name):
+    """Ставит генерацию миниатюр в фоновую очередь,
+    чтобы не задерживать ответ на запрос."""
+    enqueue('posts.thumbnails.warm_image', name, priority=5)
+
+
+def _options(source, options):
+    """Дополняет параметры так же, как ThumbnailBackend.get_thumbnail,
+    иначе имя файла миниатюры не совпадет с созданным sorl."""
+    backend = default.backend
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def _get_many_raw(keys):
+    """Читает значения KVStore пачкой: кеш, затем одна выборка из базы."""
+    kvstore = default.kvstore
+    if not hasattr(kvstore, 'cache'):
+        # Другое хранилище sorl - читаем по одному ключу
+        values = {key: kvstore._get_raw(key) for key in keys}
+        return {key: value for key, value in values.items() if value}
+    found = kvstore.cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        rows = dict(
+            KVStore.objects.filter(key__in=missing).values_list(
+                'key', 'value'
+            )
+        )
+        kvstore.cache.set_many(
+            {key: rows.get(key, EMPTY_VALUE) for key in missing},
+            sorl_settings.THUMBNAIL_CACHE_TIMEOUT,
+        )
+        found.update(rows)
+    return {
+        key: value for key, value in found.items()
+        if value is not EMPTY_VALUE
+    }
+
+
+def resolve(posts, geometry=THUMBNAILS[0][0], **options):
+    """Возвращает словарь pk поста -> миниатюра (ImageFile).
+    Готовые миниатюры берутся из KVStore одной пачкой, недостающие
+    создаются как обычно."""
+    options = options or THUMBNAILS[0][1]
+    wanted = {}
+    for post in posts:
+        if not post.image:
+            continue
+        source = ImageFile(post.image)
+        name = default.backend._get_thumbnail_filename(
+            source, geometry, _options(source, options)
+        )
+        key = add_prefix(ImageFile(name, default.storage).key)
+        wanted[post.pk] = (key, post.image)
+    values = _get_many_raw([key for key, _ in wanted.values()])
+    result = {}
+    for pk, (key, image) in wanted.items():
+        if key in values:
+            result[pk] = deserialize_image_file(values[key])
+        else:
+            # Воркер еще не успел: создаем как sorl, один раз на картинку
+            with unbudgeted():
+                result[pk] = get_thumbnail(image, geometry, **options)
+    return result
+
+
+def attach(posts):
+    """Добавляет каждому посту атрибут thumbnail. Миниатюры всей
+    страницы разрешаются за раз при первом обращении к любой из них,
+    поэтому страница из кеша фрагментов не делает лишней работы."""
+    posts = list(posts)
+    resolved = SimpleLazyObject(lambda: resolve(posts))
+    for post in posts:
+        post.thumbnail = SimpleLazyObject(
+            lambda pk=post.pk: resolved.get(pk)
+        )
+    return posts
@@ -0,0 +1,113 @@
+from jobs.queue import enqueue
+
+from . import cache_versions as versions
+from . import sharding
+from .counters import stats_for
+from .models import Follow, Post, TimelineEntry
+
+# Размер пачки для bulk_create при раскладке постов по лентам
+TIMELINE_BATCH_SIZE = 500
+# Посты авторов с большим числом подписчиков раскладываются
+# фоновой задачей, остальные - сразу, чтобы подписчики видели их без задержки
+FAN_OUT_INLINE_LIMIT = 500
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(
+        entries,
+        batch_size=TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def _insert_fanned_out(entries, bump_timelines):
+    _bulk_insert(entries)
+    if bump_timelines:
+        for entry in entries:
+            versions.bump(versions.TIMELINE, entry.user_id)
+
+
+def fan_out_post(post, bump_timelines=False):
+    """Кладет новый пост в ленты всех подписчиков автора.
+    Сразу после сохранения поста ленты сбрасывает версия GLOBAL,
+    а фоновой задаче нужно сбросить версии лент самой
+    (bump_timelines): страницы могли закешироваться без поста."""
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    batch = []
+    for user_id in followers.iterator(chunk_size=TIMELINE_BATCH_SIZE):
+        batch.append(TimelineEntry(
+            user_id=user_id, post_id=post.pk, pub_date=post.pub_date
+        ))
+        if len(batch) >= TIMELINE_BATCH_SIZE:
+            _insert_fanned_out(batch, bump_timelines)
+            batch = []
+    if batch:
+        _insert_fanned_out(batch, bump_timelines)
+
+
+def fan_out_post_id(post_id):
+    """Задача очереди: раскладывает пост, если его еще не удалили."""
+    # Строка целиком: post_init читает группу и картинку, и отложенные
+    # поля догружались бы рекурсивно
+    post = sharding.for_post(Post.objects, post_id).filter(pk=post_id).first()
+    if post is not None:
+        fan_out_post(post, bump_timelines=True)
+
+
+def schedule_fan_out(post):
+    """Раскладывает новый пост сразу или ставит задачу в очередь."""
+    if sharding.enabled():
+        # Посты в шардах: /follow/ собирается слиянием, без лент
+        return
+    followers = stats_for(post.author).followers_count
+    if followers > FAN_OUT_INLINE_LIMIT:
+        enqueue('posts.timeline.fan_out_post_id', post.pk, priority=5)
+    else:
+        fan_out_post(post)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту пользователя все посты нового автора."""
+    if sharding.enabled():
+        return
+    posts = Post.objects.filter(
+        author_id=author_id
+    ).values_list('id', 'pub_date')
+    batch = []
+    for post_id, pub_date in posts.iterator(chunk_size=TIMELINE_BATCH_SIZE):
+        batch.append(TimelineEntry(
+            user_id=user_id, post_id=post_id, pub_date=pub_date
+        ))
+        if len(batch) >= TIMELINE_BATCH_SIZE:
+            _bulk_insert(batch)
+            batch = []
+    if batch:
+        _bulk_insert(batch)
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты пользователя посты автора после отписки."""
+    if sharding.enabled():
+        return
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def rebuild(user_ids=None):
+    """Пересобирает ленты с нуля по текущим подпискам.
+    Возвращает количество обработанных подписок."""
+    entries = TimelineEntry.objects.all()
+    follows = Follow.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+        follows = follows.filter(user_id__in=user_ids)
+    entries.delete()
+    count = 0
+    pairs = follows.values_list('user_id', 'author_id')
+    for user_id, author_id in pairs.iterator(chunk_size=TIMELINE_BATCH_SIZE):
+        backfill(user_id, author_id)
+        count += 1
+    return count
@@ -9,6 +9,8 @@ urlpatterns = [
     path('', views.index, name='index'),
     # Страница группы
     path('group/<slug:slug>/', views.group_posts, name='group_posts'),
+    # Поиск по постам
+    path('search/', views.post_search, name='post_search'),
     # Профайл пользователя
     path('profile/<str:username>/', views.profile, name='profile'),
     # Просмотр записи
@@ -17,6 +19,11 @@ urlpatterns = [
     path('create/', views.post_create, name='post_create'),
     # Страница для редактирования постов
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
+    # Следующая пачка комментариев
+    path(
+        'posts/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'),
     # Добавление комментария
     path(
         'posts/<int:post_id>/comment/',
@@ -1,25 +1,43 @@
-from django.core.paginator import Paginator
+from urllib.parse import urlencode
+
+from django.http import Http404
 from django.shortcuts import render, get_object_or_404
 from django.shortcuts import redirect
+from django.utils.functional import SimpleLazyObject
 from .forms import PostForm, CommentForm
-from .models import Post, Group, User, Follow
+from .models import Post, Group, User, Follow, TimelineEntry
+from .counters import stats_for
+from .paginator import CursorPaginator
+from . import sharding
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import condition
+from core.query_budget import query_budget
+from core.replicas import replica_reads
+from . import etags, search, thumbnails
 
 
 # Главная страница
+@query_budget(5)
+@replica_reads
+@condition(etag_func=etags.index_etag)
 def index(request):
     '''в переменную posts будет сохранена выборка из 10 объектов модели Post,
     отсортированных уже в метаклассе по убыванию (от больших к меньшим)'''
     # порядок сортировки определен в классе Meta модели,
     post_list = Post.objects.all()
     # Показывать по 10 записей на странице.
-    paginator = Paginator(post_list, 10)
+    # Страницы листаются курсором по (pub_date, id), без COUNT и OFFSET.
+    # Автор и группа нужны шаблону для каждого поста - паджинатор
+    # берет их JOIN'ом, а при шардировании сливает страницы шардов
+    paginator = sharding.paginator(post_list)
 
-    # Из URL извлекаем номер запрошенной страницы - это значение параметра page
-    page_number = request.GET.get('page')
+    # Из URL извлекаем курсор запрошенной страницы - параметр cursor
+    cursor = request.GET.get('cursor')
 
-    # Получаем набор записей для страницы с запрошенным номером
-    page_obj = paginator.get_page(page_number)
+    # Получаем набор записей для страницы с этим курсором
+    page_obj = paginator.get_page(cursor)
+    # Миниатюры всей страницы разрешаются одной пачкой
+    thumbnails.attach(page_obj)
     # В словаре context отправляем информацию в шаблон
     context = {
         'page_obj': page_obj,
@@ -28,6 +46,9 @@ def index(request):
 
 
 # Страница отфильтрованных по группам
+@query_budget(6)
+@replica_reads
+@condition(etag_func=etags.group_posts_etag)
 def group_posts(request, slug):
     '''Функция get_object_or_404 получает по заданным критериям объект
     из базы данных или возвращает сообщение об ошибке, если объект не найден.
@@ -35,10 +56,11 @@ def group_posts(request, slug):
     поле slug у которых соответствует значению slug в запросе'''
     group = get_object_or_404(Group, slug=slug)
 
-    posts = group.posts.all()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    posts = Post.objects.filter(group=group)
+    paginator = sharding.paginator(posts)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    # Миниатюры всей страницы разрешаются одной пачкой
+    thumbnails.attach(page_obj)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -46,17 +68,23 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@query_budget(8)
+@replica_reads
+@condition(etag_func=etags.profile_etag)
 def profile(request, username):
     """Страница для профиля"""
     # пришлось дать не дэфолтное название переменной (client)
     # вместо user, из-за этого совпадало с шапкой и показывало
     # пользователя неверно
     client = get_object_or_404(User, username=username)
-    posts = client.posts.all()
-    user_posts = posts.count()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    posts = Post.objects.filter(author=client)
+    # Вместо posts.count() читаем денормализованный счетчик
+    stats = stats_for(client)
+    user_posts = stats.posts_count
+    paginator = sharding.paginator(posts, authors=[client.pk])
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    # Миниатюры всей страницы разрешаются одной пачкой
+    thumbnails.attach(page_obj)
     # Проверим подписан ли текующий пользователь на автора
     following = True
     # Передам в конекст проверку, чтобы не было кнопок
@@ -79,6 +107,7 @@ def profile(request, username):
         'client': client,
         'posts': posts,
         'user_posts': user_posts,
+        'stats': stats,
         'page_obj': page_obj,
         'following': following,
         'is_myself': is_myself,
@@ -86,25 +115,64 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+@query_budget(8)
+@condition(etag_func=etags.post_detail_etag)
 def post_detail(request, post_id):
     """Страница одного поста"""
     # Здесь код запроса к модели и создание словаря контекста
-    post = get_object_or_404(Post, pk=post_id)
-    # получаем все посты фильтруем их по автору имея один пост
-    # благодаря тому что могу обраться к имени автора по одному
-    # посту и посчитали
-    count = Post.objects.all().filter(author=post.author).count()
+    post = sharding.get_post_or_404(post_id)
+    thumbnails.attach([post])
+    # количество постов автора берем из счетчика,
+    # а не считаем посты автора на каждый просмотр
+    count = stats_for(post.author).posts_count
     form = CommentForm(request.POST or None)
-    comments = post.comments.all()
+    # Первая пачка комментариев, остальные подгружает post_comments.
+    # Страница выбирается только при промахе кеша фрагмента
+    cursor = request.GET.get('cursor', '')
+    comments = SimpleLazyObject(
+        lambda: sharding.comments_paginator(post_id).get_page(cursor)
+    )
     context = {
         'post': post,
         'count': count,
         'form': form,
-        'comments': comments
+        'comments': comments,
+        'comments_cursor': cursor,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@query_budget(4)
+@condition(etag_func=etags.post_comments_etag)
+def post_comments(request, post_id):
+    """Фрагмент со следующей пачкой комментариев для «Показать еще»"""
+    posts = sharding.for_post(Post.objects, post_id)
+    if not posts.filter(pk=post_id).exists():
+        raise Http404('Пост не найден')
+    paginator = sharding.comments_paginator(post_id)
+    context = {
+        'post_id': post_id,
+        'comments': paginator.get_page(request.GET.get('cursor')),
+    }
+    return render(request, 'posts/includes/comments.html', context)
+
+
+@query_budget(5)
+def post_search(request):
+    """Поиск по тексту постов"""
+    query = request.GET.get('q', '').strip()
+    page_obj = search.search_page(query, request.GET.get('cursor'))
+    # Миниатюры всей страницы разрешаются одной пачкой
+    thumbnails.attach(page_obj)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        # чтобы ссылки паджинатора не теряли поисковый запрос
+        'pagination_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def post_create(request):
     """Страница для публикации постов"""
@@ -150,7 +218,7 @@ def post_edit(request, post_id):
     """Страница для редактирования поста"""
     is_edit = True
     # Проверим и найдем пост
-    post = get_object_or_404(Post, pk=post_id)
+    post = sharding.get_post_or_404(post_id)
     # Проверим что это не автор поста и сделаем
     # редирект
     if post.author != request.user:
@@ -175,7 +243,7 @@ def post_edit(request, post_id):
 def add_comment(request, post_id):
     """Страница добавления комментария"""
     # Получили пост
-    post = get_object_or_404(Post, pk=post_id)
+    post = sharding.get_post_or_404(post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -185,18 +253,36 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@query_budget(7)
+@replica_reads
 @login_required
 def follow_index(request):
     """Страница  постов на подписанных авторов"""
     user = get_object_or_404(User, username=request.user)
-    # Двойной related_name
-    posts = Post.objects.filter(author__following__user=user)
-    # Показывать по 10 страниц
-    paginator = Paginator(posts, 10)
-    # Из URL извлекаем номер запрошенной страницы - это значение параметра page
-    page_number = request.GET.get('page')
-    # Получаем набор записей для страницы с запрошенным номером
-    page_obj = paginator.get_page(page_number)
+    if sharding.enabled():
+        # Посты авторов разложены по шардам: сливаем их страницы
+        authors = list(Follow.objects.filter(user=user).values_list(
+            'author_id', flat=True
+        ))
+        paginator = sharding.paginator(
+            Post.objects.filter(author_id__in=authors), authors=authors
+        )
+    else:
+        # Лента подписок материализована в TimelineEntry: читаем диапазон
+        # по индексу (user, pub_date) вместо JOIN постов с подписками
+        entries = TimelineEntry.objects.filter(user=user).select_related(
+            'post__author', 'post__group'
+        )
+        # Показывать по 10 постов
+        paginator = CursorPaginator(
+            entries,
+            ordering=('-pub_date', '-post_id'),
+            transform=lambda page: [entry.post for entry in page],
+        )
+    # Получаем набор записей для страницы с курсором из URL
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    # Миниатюры всей страницы разрешаются одной пачкой
+    thumbnails.attach(page_obj)
     # В словаре context отправляем информацию в шаблон
     context = {
         'page_obj': page_obj,
@@ -32,13 +32,23 @@ ALLOWED_HOSTS = [
     'testserver',
 ]
 
-# Для подключения бэкенда кеширования
+# Для подключения бэкенда кеширования.
+# Кеш в файле SQLite общий для всех воркеров gunicorn, поэтому сброс
+# версий фрагментов виден во всех процессах. Для одного процесса
+# можно вернуть 'django.core.cache.backends.locmem.LocMemCache'
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.sqlite.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'default.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
+# Тесты работают с отдельной копией файлового кеша
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
@@ -57,11 +67,21 @@ LOGIN_REDIRECT_URL = 'posts:index'
 # и при выходе из аккаунта пользователи будут перенаправляться на главную страницу проекта.
 # LOGOUT_REDIRECT_URL = 'posts:index'
 
-#  подключаем движок filebased.EmailBackend
-EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+# Письма ставятся в фоновую очередь (приложение jobs),
+# а воркер отправляет их движком filebased.EmailBackend
+EMAIL_BACKEND = 'jobs.mail.QueuedEmailBackend'
+JOBS_EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# Фоновые задачи выполняются воркерами: python manage.py run_workers.
+# True - выполнять задачи сразу в запросе, без очереди
+JOBS_EAGER = False
+
+# Дольше скольких секунд API не держит запрос в ожидании новых постов.
+# Каждый ожидающий запрос занимает поток воркера
+LIVE_MAX_WAIT = 25
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -69,6 +89,8 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'posts.apps.PostsConfig',
     'about.apps.AboutConfig',
+    'jobs.apps.JobsConfig',
+    'api.apps.ApiConfig',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -79,21 +101,77 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым: время ответа включает все остальные middleware
+    'core.metrics.MetricsMiddleware',
+    # Сразу за метриками: запросы всех остальных middleware, в том числе
+    # после ответа представления, записываются с именем страницы
+    'core.slow_queries.SlowQueryMiddleware',
+    # Снаружи всех, кроме метрик и медленных запросов: сжимает окончательное
+    # тело и видит все cookie ответа. Медленные запросы оборачивают и ее,
+    # но сама она в базу не ходит - только в кеш со своим соединением
+    'core.compression.HtmlCompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.replicas.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # После AuthenticationMiddleware: сотрудникам X-Profile без токена
+    'core.profiler.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.query_budget.QueryBudgetMiddleware',
 ]
 
+# HTML короче стольких байт не минифицируется и не сжимается
+HTML_COMPRESSION_MIN_SIZE = 512
+# Сколько секунд хранить в кеше сжатые страницы (ключ - хеш тела)
+HTML_COMPRESSION_CACHE_TIMEOUT = 600
+
+# Куда воркеры сохраняют счетчики для /metrics (None - папка в /tmp)
+METRICS_DIR = os.environ.get('YATUBE_METRICS_DIR')
+# Как часто, в секундах, воркер сохраняет счетчики
+METRICS_FLUSH_INTERVAL = 5
+# Токен для Prometheus: Authorization: Bearer <токен>.
+# Пустой - /metrics доступен только сотрудникам
+METRICS_TOKEN = os.environ.get('YATUBE_METRICS_TOKEN', '')
+
+# Запросы дольше стольких секунд пишутся в журнал (None - не писать)
+SLOW_QUERY_THRESHOLD = 0.1
+# Журнал медленных запросов (core/slow_queries.py): у каждого процесса
+# свой файл slow_queries-<pid>.log, ротируется по размеру
+SLOW_QUERY_LOG = os.path.join(BASE_DIR, 'logs', 'slow_queries.log')
+SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+
+# Куда профилировщик пишет профили ответов (core/profiler.py)
+PROFILER_DIR = os.path.join(BASE_DIR, 'profiles')
+# Как часто, в секундах, снимать стек профилируемого ответа
+PROFILER_INTERVAL = 0.005
+# Токен заголовка X-Profile; пустой - профилируют только сотрудники
+PROFILER_TOKEN = os.environ.get('YATUBE_PROFILER_TOKEN', '')
+# Сколько последних профилей хранить
+PROFILER_MAX_FILES = 500
+# Самое долгое окно профилирования всех ответов, минуты
+PROFILER_MAX_WINDOW = 60
+
+# Бюджет запросов страниц без декоратора query_budget (None - без лимита)
+QUERY_BUDGET_DEFAULT = None
+# Сколько одинаковых запросов за ответ считаются N+1
+QUERY_BUDGET_REPEAT_LIMIT = 5
+# Сколько запросов за ответ можно сделать внутри unbudgeted()
+QUERY_BUDGET_UNBUDGETED_LIMIT = 50
+# Бросать исключение вместо предупреждения в логе (включается в тестах)
+QUERY_BUDGET_RAISE = False
+
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, который считает время рендера для /metrics
+        'BACKEND': 'core.metrics.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -119,9 +197,54 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Соединение живет между запросами: не открываем файл
+        # и не выполняем прагмы на каждый запрос
+        'CONN_MAX_AGE': 60,
     }
 }
 
+# Прагмы SQLite поверх значений по умолчанию из core/db.py
+SQLITE_PRAGMAS = {}
+
+# Реплики для чтения лент: копии db.sqlite3, которые обновляет
+# команда sync_replicas. Количество задается переменной окружения
+# YATUBE_REPLICAS, по умолчанию реплик нет и все читается из default
+DATABASE_REPLICAS = []
+for number in range(1, int(os.environ.get('YATUBE_REPLICAS', 0)) + 1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'db.replica{number}.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+# Шарды постов и комментариев по автору (posts/sharding.py).
+# Базы объявлены всегда, но используются, только если перечислены
+# в POST_SHARDS: это включает переменная окружения YATUBE_SHARDING=1.
+# Авторы и группы лежат в default, поэтому внешние ключи в шардах
+# не проверяются
+for number in (1, 2):
+    DATABASES[f'shard{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'db.shard{number}.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'PRAGMAS': {'foreign_keys': 'OFF'},
+    }
+POST_SHARDS = (
+    ['shard1', 'shard2'] if os.environ.get('YATUBE_SHARDING') else []
+)
+
+DATABASE_ROUTERS = [
+    'posts.sharding.ShardRouter',
+    'core.replicas.ReplicaRouter',
+]
+# Сколько секунд после записи пользователь читает только из default
+REPLICA_STICKY_SECONDS = 10
+REPLICA_STICKY_COOKIE = 'use_primary'
+# Попутные записи GET-запросов, после которых чтения остаются на реплике
+REPLICA_SIDE_EFFECT_MODELS = ['posts.UserStats', 'thumbnail.KVStore']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -160,3 +283,10 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 STATIC_URL = '/static/'
+# Сюда collectstatic собирает файлы с хешем в имени и их сжатые копии
+STATIC_ROOT = os.path.join(BASE_DIR, 'collected_static')
+STATICFILES_STORAGE = 'core.storage.CompressedManifestStaticFilesStorage'
+# Отдавать STATIC_ROOT самим Django (core.views.serve_static).
+# За nginx, который раздает статику сам, можно выключить.
+# При DEBUG runserver отдает статику раньше, прямо из папок приложений
+SERVE_STATIC = True
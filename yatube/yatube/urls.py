@@ -3,18 +3,45 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from core.metrics import metrics
+from core.views import (profile_download, profiles, serve_static,
+                        view_profiles_download)
+
 urlpatterns = [
     path('', include('posts.urls', namespace='posts')),
+    # Раньше admin/: иначе адреса заберет админка
+    path('admin/profiles/', profiles, name='profiles'),
+    path(
+        'admin/profiles/view/<str:view>/',
+        view_profiles_download,
+        name='view_profiles_download',
+    ),
+    path(
+        'admin/profiles/<str:name>',
+        profile_download,
+        name='profile_download',
+    ),
     path('admin/', admin.site.urls),
     path('auth/', include('users.urls', namespace='users')),
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include('about.urls', namespace='about')),
+    path('api/v1/', include('api.urls', namespace='api')),
+    path('metrics', metrics, name='metrics'),
 ]
 
 handler404 = 'core.views.page_not_found'
 handler500 = 'core.views.server_error'
 handler403 = 'core.views.permission_denied'
 
+if settings.SERVE_STATIC:
+    urlpatterns += [
+        path(
+            f'{settings.STATIC_URL.lstrip("/")}<path:path>',
+            serve_static,
+            name='static',
+        ),
+    ]
+
 if settings.DEBUG:
     urlpatterns += static(
         settings.MEDIA_URL, document_root=settings.MEDIA_ROOT